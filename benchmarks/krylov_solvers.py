@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prophtools: Tools for heterogenoeus network prioritization.
+
+Copyright (C) 2016 Carmen Navarro Luzón <cnluzon@decsai.ugr.es> GPLv3
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the RWR solvers (see solvers.iterative_solve) on a random
+symmetric network: fixed point iteration against conjugate gradient and
+BiCGSTAB with the preconditioners each one takes, propagating a block of queries from
+scratch and warm started from their propagation for a close alpha.
+
+For each solver it reports the time to build the preconditioner, the time
+of both propagations and the largest difference with fixed point
+iteration.
+
+.. module :: krylov_solvers.py
+.. author :: C. Navarro Luzón <cnluzon@decsai.ugr.es>
+
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+
+from prophtools.common.method import RWR
+import prophtools.utils.preprocessing as preprocessing
+import prophtools.utils.solvers as solvers
+
+
+def random_network(n, degree):
+    random_state = np.random.RandomState(0)
+    edges = int(n * degree / 2)
+    rows = random_state.randint(0, n, edges)
+    cols = random_state.randint(0, n, edges)
+    adjacency = sparse.csr_matrix((np.ones(edges), (rows, cols)), shape=(n, n))
+    return preprocessing.normalize_matrix(sparse.csr_matrix(adjacency + adjacency.T))
+
+
+def timed(function):
+    start = time.time()
+    result = function()
+    return [result, time.time() - start]
+
+
+def run(n, degree, queries, alpha, warm_alpha):
+    network = random_network(n, degree)
+
+    random_state = np.random.RandomState(0)
+    query_matrix = np.zeros((n, queries))
+    for j in range(queries):
+        query_matrix[random_state.choice(n, 5, replace=False), j] = 1.0
+
+    [expected, power_time] = timed(lambda: RWR(query_matrix, network, alpha))
+    guess = RWR(query_matrix, network, warm_alpha)
+    [_, power_warm_time] = timed(lambda: RWR(query_matrix, network, alpha, x0=guess))
+
+    print "Network {0}x{0}, {1} nonzeros, {2} queries, alpha {3} (warm start from {4})".format(
+        n, network.nnz, queries, alpha, warm_alpha)
+    print "    {:10} {:10} {:>10} {:>10} {:>10} {:>10}".format(
+        'method', 'precond', 'build (s)', 'cold (s)', 'warm (s)', 'max diff')
+    print "    {:10} {:10} {:>10} {:10.3f} {:10.3f} {:>10}".format(
+        'power', '-', '-', power_time, power_warm_time, '-')
+
+    for method in solvers.KRYLOV_METHODS:
+        for kind in solvers.PRECONDITIONERS:
+            if kind == 'ilu' and method == 'cg':
+                continue
+            [M, build_time] = timed(
+                lambda: solvers.build_preconditioner(network, alpha, kind))
+            [result, cold_time] = timed(
+                lambda: RWR(query_matrix, network, alpha, method=method,
+                            preconditioner=M))
+            [_, warm_time] = timed(
+                lambda: RWR(query_matrix, network, alpha, method=method,
+                            preconditioner=M, x0=guess))
+            print "    {:10} {:10} {:10.3f} {:10.3f} {:10.3f} {:10.2g}".format(
+                method, kind, build_time, cold_time, warm_time,
+                np.abs(result - expected).max())
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark RWR solvers on a random network")
+
+    parser.add_argument('--n', type=int, default=100000)
+    parser.add_argument('--degree', type=float, default=10)
+    parser.add_argument('--queries', type=int, default=8)
+    parser.add_argument('--alpha', type=float, default=0.9)
+    parser.add_argument('--warm_alpha', type=float, default=0.85)
+
+    args = parser.parse_args()
+
+    run(args.n, args.degree, args.queries, args.alpha, args.warm_alpha)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prophtools: Tools for heterogenoeus network prioritization.
+
+Copyright (C) 2016 Carmen Navarro Luzón <cnluzon@decsai.ugr.es> GPLv3
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of mixed precision propagation (see solvers.refined_iteration)
+against double precision on a random network: a block of queries
+propagated with RWR, and a block of precomputed columns.
+
+For each it reports the time of both, the iterations they take, the
+largest difference between their results and how many of the queries
+rank their top --top nodes in exactly the same order.
+
+.. module :: mixed_precision.py
+.. author :: C. Navarro Luzón <cnluzon@decsai.ugr.es>
+
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+
+from prophtools.common.method import RWR
+import prophtools.utils.preprocessing as preprocessing
+
+
+def random_network(n, degree):
+    random_state = np.random.RandomState(0)
+    edges = int(n * degree / 2)
+    rows = random_state.randint(0, n, edges)
+    cols = random_state.randint(0, n, edges)
+    adjacency = sparse.csr_matrix((np.ones(edges), (rows, cols)), shape=(n, n))
+    return preprocessing.normalize_matrix(sparse.csr_matrix(adjacency + adjacency.T))
+
+
+def best_time(function, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return [result, best]
+
+
+def same_top(expected, result, top):
+    same = 0
+    for j in range(expected.shape[1]):
+        expected_top = np.argsort(-expected[:, j], kind='mergesort')[:top]
+        result_top = np.argsort(-result[:, j], kind='mergesort')[:top]
+        same += np.array_equal(expected_top, result_top)
+
+    return same
+
+
+def run(n, degree, queries, columns, top, repeats):
+    network = random_network(n, degree)
+    query_matrix = np.zeros((n, queries))
+    random_state = np.random.RandomState(1)
+    for j in range(queries):
+        query_matrix[random_state.choice(n, 5, replace=False), j] = 1.0
+
+    print "Network {0}x{0}, {1} nonzeros".format(n, network.nnz)
+    print "    {:22} {:10} {:>10} {:>11} {:>10} {:>10}".format(
+        'task', 'precision', 'time (s)', 'iterations', 'max diff', 'same top')
+
+    identity = np.zeros((n, columns))
+    identity[np.arange(columns), np.arange(columns)] = 1.0
+
+    tasks = [('RWR, {} queries'.format(queries),
+              lambda precision: RWR(query_matrix, network, precision=precision,
+                                    return_info=True)),
+             ('precompute {} columns'.format(columns),
+              lambda precision: preprocessing.LG(
+                  identity, 0.9, network, 1000,
+                  precision=precision, return_info=True)[1:])]
+
+    for name, task in tasks:
+        expected = None
+        for precision in ['double', 'mixed']:
+            [[result, iterations, _], elapsed] = best_time(lambda: task(precision), repeats)
+            if expected is None:
+                expected = result
+            print "    {:22} {:10} {:10.3f} {:11d} {:10.2g} {:>10}".format(
+                name, precision, elapsed, iterations.max(),
+                np.abs(result - expected).max(),
+                '{}/{}'.format(same_top(expected, result, top), result.shape[1]))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark mixed precision propagation on a random network")
+
+    parser.add_argument('--n', type=int, default=100000)
+    parser.add_argument('--degree', type=float, default=10)
+    parser.add_argument('--queries', type=int, default=16)
+    parser.add_argument('--columns', type=int, default=64)
+    parser.add_argument('--top', type=int, default=100,
+                        help='nodes compared between rankings')
+    parser.add_argument('--repeats', type=int, default=3)
+
+    args = parser.parse_args()
+
+    run(args.n, args.degree, args.queries, args.columns, args.top, args.repeats)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prophtools: Tools for heterogenoeus network prioritization.
+
+Copyright (C) 2016 Carmen Navarro Luzón <cnluzon@decsai.ugr.es> GPLv3
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of propagation for several restart probabilities in a single
+pass (see solvers.series_iteration) against one propagation per alpha,
+on a random network: a block of queries propagated with RWR, and a block
+of precomputed columns.
+
+For each it reports the time of both, the sparse products they compute
+and the largest difference between their results.
+
+.. module :: multi_alpha.py
+.. author :: C. Navarro Luzón <cnluzon@decsai.ugr.es>
+
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+
+import prophtools.utils.preprocessing as preprocessing
+import prophtools.utils.solvers as solvers
+
+
+def random_network(n, degree):
+    random_state = np.random.RandomState(0)
+    edges = int(n * degree / 2)
+    rows = random_state.randint(0, n, edges)
+    cols = random_state.randint(0, n, edges)
+    adjacency = sparse.csr_matrix((np.ones(edges), (rows, cols)), shape=(n, n))
+    return preprocessing.normalize_matrix(sparse.csr_matrix(adjacency + adjacency.T))
+
+
+def timed(function):
+    start = time.time()
+    result = function()
+    return [result, time.time() - start]
+
+
+def one_per_alpha(propagate, alphas):
+    results = []
+    products = 0
+    for alpha in alphas:
+        [result, iterations, _] = propagate(alpha)
+        results.append(result)
+        products += iterations.max()
+
+    return [np.array(results), products]
+
+
+def run(n, degree, queries, columns, alphas):
+    network = random_network(n, degree)
+    query_matrix = np.zeros((n, queries))
+    random_state = np.random.RandomState(1)
+    for j in range(queries):
+        query_matrix[random_state.choice(n, 5, replace=False), j] = 1.0
+
+    identity = np.zeros((n, columns))
+    identity[np.arange(columns), np.arange(columns)] = 1.0
+
+    print "Network {0}x{0}, {1} nonzeros, alphas {2}".format(
+        n, network.nnz, ' '.join(str(alpha) for alpha in alphas))
+    print "    {:22} {:12} {:>10} {:>10} {:>10}".format(
+        'task', 'propagation', 'time (s)', 'products', 'max diff')
+
+    tasks = [('RWR, {} queries'.format(queries), query_matrix, 'sum'),
+             ('precompute {} columns'.format(columns), identity, 'max')]
+
+    for name, F, norm in tasks:
+        [[expected, products], elapsed] = timed(lambda: one_per_alpha(
+            lambda alpha: solvers.power_iteration(network, F, alpha, norm=norm),
+            alphas))
+        print "    {:22} {:12} {:10.3f} {:10d} {:>10}".format(
+            name, 'per alpha', elapsed, products, '-')
+
+        [[result, iterations, _], elapsed] = timed(
+            lambda: solvers.series_iteration(network, F, alphas, norm=norm))
+        print "    {:22} {:12} {:10.3f} {:10d} {:10.2g}".format(
+            name, 'single pass', elapsed, iterations.max(),
+            np.abs(result - expected).max())
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark single pass propagation for several alphas")
+
+    parser.add_argument('--n', type=int, default=100000)
+    parser.add_argument('--degree', type=float, default=10)
+    parser.add_argument('--queries', type=int, default=16)
+    parser.add_argument('--columns', type=int, default=64)
+    parser.add_argument('--alphas', type=float, nargs='+',
+                        default=[0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95])
+
+    args = parser.parse_args()
+
+    run(args.n, args.degree, args.queries, args.columns, args.alphas)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prophtools: Tools for heterogenoeus network prioritization.
+
+Copyright (C) 2016 Carmen Navarro Luzón <cnluzon@decsai.ugr.es> GPLv3
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of node orderings (see preprocessing.node_order) on a network
+with local structure (a ring of nodes linked to their nearest neighbours
+plus a few random shortcuts) whose node ids have been shuffled, as they
+usually come from the input files.
+
+For each ordering it reports the time of sparse products with blocks of
+1, 8 and 64 vectors, of a block RWR, and the nonzeros of the sparse
+factorization of I - alpha * W.
+
+.. module :: node_ordering.py
+.. author :: C. Navarro Luzón <cnluzon@decsai.ugr.es>
+
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+
+from prophtools.common.method import RWR
+import prophtools.utils.preprocessing as preprocessing
+import prophtools.utils.solvers as solvers
+
+
+def local_network(n, neighbours, shortcuts):
+    rows = []
+    cols = []
+    for offset in range(1, neighbours + 1):
+        rows.append(np.arange(n))
+        cols.append((np.arange(n) + offset) % n)
+
+    random_state = np.random.RandomState(0)
+    rows.append(random_state.randint(0, n, shortcuts))
+    cols.append(random_state.randint(0, n, shortcuts))
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    adjacency = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    adjacency = adjacency + adjacency.T
+
+    shuffle = random_state.permutation(n)
+    return preprocessing.normalize_matrix(preprocessing.reorder(adjacency, shuffle))
+
+
+def best_time(function, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def run(n, neighbours, shortcuts, queries, repeats):
+    network = local_network(n, neighbours, shortcuts)
+    print "Network {0}x{0}, {1} nonzeros".format(n, network.nnz)
+    print "    {:8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}".format(
+        'ordering', 'order (s)', 'SpMV k=1', 'k=8', 'k=64', 'RWR (s)', 'LU nonzeros')
+
+    random_state = np.random.RandomState(1)
+    query_matrix = np.zeros((n, queries))
+    for j in range(queries):
+        query_matrix[random_state.choice(n, 5, replace=False), j] = 1.0
+
+    for ordering in preprocessing.ORDERINGS:
+        start = time.time()
+        permutation = preprocessing.node_order(network, ordering)
+        ordered = preprocessing.reorder(network, permutation)
+        order_time = time.time() - start
+
+        products = []
+        for k in [1, 8, 64]:
+            block = np.random.RandomState(2).rand(n, k)
+            products.append(best_time(lambda: ordered.dot(block), repeats))
+
+        queries_ordered = query_matrix
+        if permutation is not None:
+            queries_ordered = query_matrix[permutation]
+        rwr_time = best_time(lambda: RWR(queries_ordered, ordered), repeats)
+
+        factorization = solvers.factorize(ordered, 0.9)
+        lu_nonzeros = factorization.L.nnz + factorization.U.nnz
+
+        print "    {:8} {:10.3f} {:10.4f} {:10.4f} {:10.4f} {:10.3f} {:12d}".format(
+            ordering, order_time, products[0], products[1], products[2],
+            rwr_time, lu_nonzeros)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark node orderings on a shuffled local network")
+
+    parser.add_argument('--n', type=int, default=300000)
+    parser.add_argument('--neighbours', type=int, default=5)
+    parser.add_argument('--shortcuts', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=16)
+    parser.add_argument('--repeats', type=int, default=3)
+
+    args = parser.parse_args()
+
+    run(args.n, args.neighbours, args.shortcuts, args.queries, args.repeats)
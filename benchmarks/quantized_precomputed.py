@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prophtools: Tools for heterogenoeus network prioritization.
+
+Copyright (C) 2016 Carmen Navarro Luzón <cnluzon@decsai.ugr.es> GPLv3
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of quantized precomputed matrices (see
+representations.quantize) on a random network, against the float64
+precomputed matrix and the float32 copy memsave makes.
+
+For each storage it reports the bytes of the precomputed matrix, the time
+to score a block of pearson queries within the network, and how much the
+rankings differ from float64: the lowest spearman correlation between the
+scores of a query and its float64 scores, and the mean overlap of their
+top --top nodes.
+
+.. module :: quantized_precomputed.py
+.. author :: C. Navarro Luzón <cnluzon@decsai.ugr.es>
+
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.stats import spearmanr
+
+from prophtools.common.graphdata import EntityNet, RelationNet, GraphDataSet
+from prophtools.common.method import ProphNet
+import prophtools.utils.preprocessing as preprocessing
+import prophtools.utils.representations as representations
+
+
+def random_network(n, degree):
+    adjacency = sparse.random(n, n, density=degree / float(n), random_state=0)
+    return preprocessing.normalize_matrix(sparse.csr_matrix(adjacency + adjacency.T))
+
+
+def score(precomputed, network, query_matrix, repeats):
+    names = [str(i) for i in range(network.shape[0])]
+    net = EntityNet(network, 'net', names, precomputed=precomputed)
+    other = EntityNet(sparse.identity(2, format='csr'), 'other', ['a', 'b'],
+                      precomputed=np.identity(2))
+    relation = RelationNet(sparse.csr_matrix((network.shape[0], 2)), 'rel')
+    dataset = GraphDataSet([net, other], [relation], np.matrix([[-1, 0], [-1, -1]]))
+    prioritizer = ProphNet(dataset)
+
+    # Row statistics are computed once per network, not per query
+    net.row_statistics()
+
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        scores = prioritizer.propagate(query_matrix, 0, 0, 'pearson')
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return [scores, best]
+
+
+def ranking_agreement(expected, scores, top):
+    correlations = []
+    overlaps = []
+    for j in range(expected.shape[1]):
+        correlations.append(spearmanr(expected[:, j], scores[:, j])[0])
+        expected_top = set(np.argsort(-expected[:, j])[:top])
+        overlaps.append(len(expected_top & set(np.argsort(-scores[:, j])[:top])) / float(top))
+
+    return [min(correlations), np.mean(overlaps)]
+
+
+def run(n, degree, queries, top, repeats):
+    network = random_network(n, degree)
+    precomputed = preprocessing.precompute_matrix(network)
+
+    random_state = np.random.RandomState(0)
+    query_matrix = np.zeros((n, queries))
+    for j in range(queries):
+        query_matrix[random_state.choice(n, 5, replace=False), j] = 1.0
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        storages = [('float64', precomputed, precomputed.nbytes),
+                    ('float32', precomputed.astype('float32'), 4 * n * n)]
+        for dtype in representations.QUANTIZED_TYPES:
+            filename = os.path.join(tmpdir, '{}.npy'.format(dtype))
+            quantized = representations.quantize(precomputed, dtype, filename)
+            nbytes = quantized.values.nbytes + quantized.scale.nbytes + quantized.offset.nbytes
+            storages.append(('{} (mmap)'.format(dtype), quantized, nbytes))
+
+        print "Network {0}x{0}, {1} nonzeros, {2} pearson queries".format(
+            n, network.nnz, queries)
+        print "    {:16} {:>10} {:>10} {:>12} {:>10}".format(
+            'storage', 'MB', 'time (s)', 'min spearman', 'top overlap')
+
+        expected = None
+        for name, matrix, nbytes in storages:
+            [scores, elapsed] = score(matrix, network, query_matrix, repeats)
+            if expected is None:
+                expected = scores
+            [correlation, overlap] = ranking_agreement(expected, scores, top)
+            print "    {:16} {:10.1f} {:10.4f} {:12.6f} {:10.3f}".format(
+                name, nbytes / 1e6, elapsed, correlation, overlap)
+            del matrix
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark quantized precomputed matrices on a random network")
+
+    parser.add_argument('--n', type=int, default=4000)
+    parser.add_argument('--degree', type=float, default=10)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top', type=int, default=100,
+                        help='nodes compared between rankings')
+    parser.add_argument('--repeats', type=int, default=3)
+
+    args = parser.parse_args()
+
+    run(args.n, args.degree, args.queries, args.top, args.repeats)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prophtools: Tools for heterogenoeus network prioritization.
+
+Copyright (C) 2016 Carmen Navarro Luzón <cnluzon@decsai.ugr.es> GPLv3
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the in place fixed point iteration (see
+solvers.power_iteration) against the previous one, which allocated new
+arrays for the product, the sum and the change in every iteration, on a
+random network and blocks of queries of several sizes.
+
+For each block size it reports the time of both and the memory they
+allocate: the megabytes of temporaries each iteration makes, and the
+peak resident memory of a process running them.
+
+.. module :: rwr_kernel.py
+.. author :: C. Navarro Luzón <cnluzon@decsai.ugr.es>
+
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+
+import prophtools.utils.preprocessing as preprocessing
+import prophtools.utils.solvers as solvers
+
+
+def random_network(n, degree):
+    random_state = np.random.RandomState(0)
+    edges = int(n * degree / 2)
+    rows = random_state.randint(0, n, edges)
+    cols = random_state.randint(0, n, edges)
+    adjacency = sparse.csr_matrix((np.ones(edges), (rows, cols)), shape=(n, n))
+    return preprocessing.normalize_matrix(sparse.csr_matrix(adjacency + adjacency.T))
+
+
+def allocating_iteration(m, F, alpha=0.9, maxiter=1000):
+    initial_F = np.asarray(F, dtype=float)
+    F = initial_F.copy()
+    active = np.arange(F.shape[1])
+    iterations = 0
+
+    for iter in range(maxiter):
+        iterations += 1
+        old_F = F[:, active]
+        new_F = alpha * (m * old_F) + (1-alpha)*initial_F[:, active]
+        F[:, active] = new_F
+
+        converged = abs(new_F - old_F).sum(axis=0) < 1e-9
+        active = active[~converged]
+        if len(active) == 0:
+            break
+
+    return [F, iterations]
+
+
+def in_place_iteration(m, F):
+    [result, iterations, _] = solvers.power_iteration(m, F)
+    return [result, iterations.max()]
+
+
+def measure(kernel, n, degree, queries, queue):
+    network = random_network(n, degree)
+    query_matrix = np.zeros((n, queries))
+    query_matrix[np.random.RandomState(1).randint(0, n, queries), np.arange(queries)] = 1.0
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    [result, iterations] = kernel(network, query_matrix)
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+    queue.put([elapsed, iterations, peak * 1024])
+
+
+def run_in_process(kernel, n, degree, queries):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure,
+                                      args=(kernel, n, degree, queries, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def run(n, degree, block_sizes):
+    print "Network {0}x{0}, degree {1}".format(n, degree)
+    print "    {:>7} {:12} {:>10} {:>11} {:>14} {:>12}".format(
+        'queries', 'kernel', 'time (s)', 'iterations', 'MB / iteration', 'peak MB')
+
+    for queries in block_sizes:
+        # Every iteration of the allocating kernel makes a n x k copy of the
+        # active block, the product, its scaling, the restart term, the sum,
+        # the difference and its absolute value.
+        for name, kernel, arrays in [('allocating', allocating_iteration, 7),
+                                     ('in place', in_place_iteration, 0)]:
+            [elapsed, iterations, peak] = run_in_process(kernel, n, degree, queries)
+            print "    {:7d} {:12} {:10.3f} {:11d} {:14.1f} {:12.1f}".format(
+                queries, name, elapsed, iterations, arrays * 8.0 * n * queries / 1e6,
+                peak / 1e6)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the in place RWR kernel on a random network")
+
+    parser.add_argument('--n', type=int, default=200000)
+    parser.add_argument('--degree', type=float, default=10)
+    parser.add_argument('--block_sizes', type=int, nargs='+', default=[1, 16, 64])
+
+    args = parser.parse_args()
+
+    run(args.n, args.degree, args.block_sizes)
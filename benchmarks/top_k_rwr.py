@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prophtools: Tools for heterogenoeus network prioritization.
+
+Copyright (C) 2016 Carmen Navarro Luzón <cnluzon@decsai.ugr.es> GPLv3
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of top k RWR (see method.top_k_RWR), which stops as soon as the
+k best scores and their order are certain, against RWR converged on every
+node, on a random network and single queries.
+
+For each k it reports the time and iterations of both, how many queries
+were certified and how many got the same top k as the converged RWR.
+
+.. module :: top_k_rwr.py
+.. author :: C. Navarro Luzón <cnluzon@decsai.ugr.es>
+
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+
+from prophtools.common.method import RWR, top_k_RWR
+import prophtools.utils.preprocessing as preprocessing
+
+
+def random_network(n, degree):
+    random_state = np.random.RandomState(0)
+    edges = int(n * degree / 2)
+    rows = random_state.randint(0, n, edges)
+    cols = random_state.randint(0, n, edges)
+    weights = random_state.rand(edges)
+    adjacency = sparse.csr_matrix((weights, (rows, cols)), shape=(n, n))
+    return preprocessing.normalize_matrix(sparse.csr_matrix(adjacency + adjacency.T))
+
+
+def run(n, degree, queries, ks):
+    network = random_network(n, degree)
+    random_state = np.random.RandomState(1)
+    query_vectors = []
+    for _ in range(queries):
+        query = np.zeros(n)
+        query[random_state.choice(n, 5, replace=False)] = 1.0 / 5
+        query_vectors.append(query)
+
+    start = time.time()
+    converged = [RWR(query, network, return_info=True) for query in query_vectors]
+    full_time = time.time() - start
+    full_iterations = int(sum(info[1].sum() for info in converged))
+
+    print "Network {0}x{0}, {1} nonzeros, {2} queries".format(n, network.nnz, queries)
+    print "    {:>5} {:10} {:>10} {:>11} {:>10} {:>9}".format(
+        'k', 'rwr', 'time (s)', 'iterations', 'certified', 'same top')
+    print "    {:>5} {:10} {:10.3f} {:11d} {:>10} {:>9}".format(
+        '-', 'converged', full_time, full_iterations, '-', '-')
+
+    for k in ks:
+        start = time.time()
+        results = [top_k_RWR(query, network, k, return_info=True)
+                   for query in query_vectors]
+        elapsed = time.time() - start
+
+        same = 0
+        for [result, _, _], [_, top, _, _] in zip(converged, results):
+            expected = np.argsort(-result, kind='mergesort')[:k]
+            same += np.array_equal(expected, top)
+
+        print "    {:5d} {:10} {:10.3f} {:11d} {:>10} {:>9}".format(
+            k, 'top k', elapsed, int(sum(info[3] for info in results)),
+            '{}/{}'.format(sum(info[2] for info in results), queries),
+            '{}/{}'.format(same, queries))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark top k RWR on a random network")
+
+    parser.add_argument('--n', type=int, default=100000)
+    parser.add_argument('--degree', type=float, default=10)
+    parser.add_argument('--queries', type=int, default=10)
+    parser.add_argument('--ks', type=int, nargs='+', default=[10, 100])
+
+    args = parser.parse_args()
+
+    run(args.n, args.degree, args.queries, args.ks)
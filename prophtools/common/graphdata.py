@@ -19,6 +19,8 @@ from scipy import sparse
 import shutil
 import sys
 import prophtools.utils.preprocessing as preprocessing
+import prophtools.utils.representations as representations
+import prophtools.utils.solvers as solvers
 import random
 from tempfile import mkdtemp
 
@@ -75,36 +77,92 @@ class EntityNet:
         name  : Name of the network.
         node_names: Names of the nodes in the network.
         precomputed: Precomputed values (used for correlation speed-up).
+        ranked: Row-wise ranks of the precomputed values (used for spearman
+                correlation). Computed on first use if not provided.
+        tmpdir: Directory where matrices derived from precomputed are memory
+                mapped (memsave mode). Kept in memory if None.
+        alpha: Restart probability used to build the precomputed matrix.
+        row_statistics: Row means and centered row norms of the precomputed
+                matrix (see row_statistics). Computed on first use if not
+                provided.
+        ordering: Node order the solvers work in (see set_ordering).
 
     length(node_names) must match shape of the network (i.e. each node is
     named.)
 
     shape of precomputed matrix and adjacency matrix must match.
+
+    The connected components of the network are found on construction
+    (component_labels, see preprocessing.component_labels), so that row
+    statistics are computed per component and precomputed matrices can be
+    built per component (representations.components_precompute).
     """
 
-    def __init__(self, matrix, net_name, node_names, precomputed=None):
+    def __init__(self, matrix, net_name, node_names, precomputed=None,
+                 ranked=None, tmpdir=None, alpha=0.9, row_statistics=None,
+                 ordering='none'):
         self.matrix = matrix
         self.name = net_name
         self.node_names = node_names
         self.precomputed = precomputed
+        self.ranked = ranked
+        self.tmpdir = tmpdir
+        self.alpha = alpha
+        self._row_statistics = row_statistics
+        self._ranked_row_statistics = None
 
         self._validate_dimensions()
+        self.component_labels = preprocessing.component_labels(matrix)
+        self.set_ordering(ordering)
         # self.precompute_dot_values()
 
     @classmethod
-    def from_raw_matrix(cls, matrix, net_name, node_names):
+    def from_raw_matrix(cls, matrix, net_name, node_names,
+                        precompute_options=None):
         """
         Creates an EntityNet object considering it raw: i.e. normalizes first
         and builds precomputed matrix.
 
         Warning: precomputing a matrix is time consuming. However, it is
         necessary for propagation methods to work.
+
+        precompute_options are keyword arguments for planner.precompute
+        (alpha, block_size, strategy...), which picks the precompute
+        strategy if not given. If they include a directory, the out of core
+        strategy may be used, and writes to "{net_name}_precomputed.npy"
+        there. They may also include a representation and its parameters
+        (see representations.build); quantized and packed ones are written
+        to "{net_name}_{representation}.npy" in directory. Their node
+        ordering (see preprocessing.node_order) is also the ordering of the
+        new network.
         """
+        precompute_options = dict(precompute_options or {})
+        directory = precompute_options.pop('directory', None)
+        alpha = precompute_options.pop('alpha', 0.9)
+        representation = precompute_options.pop('representation', 'dense')
+        spectral_k = precompute_options.pop('spectral_k', 100)
+        push_tol = precompute_options.pop('push_tol', 1e-4)
+        threshold = precompute_options.pop('threshold', 1e-4)
+        top_per_row = precompute_options.pop('top_per_row', None)
+
+        representation_file = None
+        if directory is not None:
+            precompute_options['filename'] = os.path.join(
+                directory, '{}_precomputed.npy'.format(net_name))
+            representation_file = os.path.join(
+                directory, '{}_{}.npy'.format(net_name, representation))
+
         norm_matrix = preprocessing.normalize_matrix(matrix)
-        norm_prec_matrix = preprocessing.precompute_matrix(norm_matrix)
+        norm_prec_matrix = representations.build(
+            norm_matrix, representation, alpha=alpha, spectral_k=spectral_k,
+            push_tol=push_tol, threshold=threshold, top_per_row=top_per_row,
+            representation_file=representation_file,
+            precompute_options=precompute_options)
 
         return cls(norm_matrix, net_name, node_names,
-                   precomputed=norm_prec_matrix)
+                   precomputed=norm_prec_matrix,
+                   alpha=alpha,
+                   ordering=precompute_options.get('ordering', 'none'))
 
     def _validate_dimensions(self):
         self._check_matrix_squared()
@@ -134,12 +192,159 @@ class EntityNet:
         return type(self.matrix) in sparse_types
 
     def densify(self):
-        if self.precomputed is not None and sparse.issparse(self.precomputed):
-                self.precomputed = np.asarray(self.precomputed.todense())
-
+        """
+        Makes the network matrix dense. Sparse precomputed matrices (see
+        preprocessing.sparsify and push_precompute) are kept sparse, as
+        they are read row by row without densifying them.
+        """
         if self.is_sparse():
             self.matrix = self.matrix.todense()
 
+    def row_statistics(self, solver='iterative'):
+        """
+        Mean and norm of the centered rows of the precomputed matrix. They
+        are computed on first use and cached, as they do not depend on the
+        query.
+
+        Without a precomputed matrix, they are computed from its columns,
+        one block at a time (see preprocessing.streamed_row_statistics),
+        with the given solver. The iterative one only propagates each
+        column within its connected component; the sparse factorization
+        already has no fill between components.
+
+        Returns:
+            [means, norms], two arrays of length matrix.shape[0]
+        """
+        if self._row_statistics is None:
+            precomputed = self.precomputed
+            if precomputed is None:
+                permutation = self.permutation
+                factorization = None
+                labels = self.component_labels
+                if permutation is not None:
+                    labels = labels[permutation]
+                if solver == 'factorized':
+                    factorization = self.factorization(self.alpha)
+                    labels = None
+
+                statistics = preprocessing.streamed_row_statistics(
+                    self.ordered_matrix(), self.alpha,
+                    factorization=factorization, labels=labels)
+                if permutation is not None:
+                    for values in statistics:
+                        values[permutation] = values.copy()
+
+                self._row_statistics = statistics
+                return self._row_statistics
+
+            if hasattr(precomputed, 'row_statistics'):
+                self._row_statistics = precomputed.row_statistics()
+                return self._row_statistics
+
+            self._row_statistics = preprocessing.row_statistics(precomputed)
+
+        return self._row_statistics
+
+    def set_alpha(self, alpha):
+        """
+        Changes the restart probability of the precomputed matrix. Only
+        representations that can be recomputed for another alpha from what
+        they store (such as the spectral one) support it; dense precomputed
+        matrices have to be precomputed again.
+        """
+        if alpha == self.alpha:
+            return
+
+        if self.precomputed is not None:
+            if not hasattr(self.precomputed, 'with_alpha'):
+                msg = "Precomputed matrix of {} cannot change alpha, precompute it again".format(self.name)
+                raise ValueError(msg)
+
+            self.precomputed = self.precomputed.with_alpha(alpha)
+
+        self.alpha = alpha
+        self.ranked = None
+        self._row_statistics = None
+        self._ranked_row_statistics = None
+
+    def set_ordering(self, ordering):
+        """
+        Sets the order in which the solvers see the nodes (see
+        preprocessing.node_order): propagation and streamed row statistics
+        work on ordered_matrix, for better memory locality, and are
+        reported back in the original order. matrix, node_names and every
+        result keep the original order.
+        """
+        self.ordering = ordering
+        self.permutation = preprocessing.node_order(self.matrix, ordering)
+        self._ordered_matrix = None
+        self._factorizations = {}
+        self._preconditioners = {}
+
+    def ordered_matrix(self):
+        """
+        The network matrix in the order of permutation (csr), built on
+        first use and cached. matrix itself if there is no permutation.
+        """
+        if self.permutation is None:
+            return self.matrix
+
+        if self._ordered_matrix is None:
+            self._ordered_matrix = preprocessing.reorder(self.matrix, self.permutation)
+
+        return self._ordered_matrix
+
+    def factorization(self, alpha=0.9):
+        """
+        Sparse factorization of I - alpha * ordered_matrix (see
+        solvers.factorize), computed on first use and cached per alpha.
+        """
+        if alpha not in self._factorizations:
+            self._factorizations[alpha] = solvers.factorize(self.ordered_matrix(), alpha)
+
+        return self._factorizations[alpha]
+
+    def preconditioner(self, kind, alpha=0.9):
+        """
+        Preconditioner of I - alpha * ordered_matrix for the Krylov solvers
+        (see solvers.build_preconditioner), computed on first use and
+        cached per kind and alpha.
+        """
+        if (kind, alpha) not in self._preconditioners:
+            self._preconditioners[(kind, alpha)] = solvers.build_preconditioner(
+                self.ordered_matrix(), alpha, kind)
+
+        return self._preconditioners[(kind, alpha)]
+
+    def ranked_precomputed(self):
+        """
+        Precomputed matrix with each row replaced by its ranks. It is built
+        on first use and cached (memory mapped in tmpdir, if set), so
+        spearman queries do not rank the precomputed rows again.
+        """
+        if self.ranked is None:
+            precomputed = self.precomputed
+            out = None
+            if self.tmpdir:
+                filename = os.path.join(self.tmpdir,
+                                        '{}_ranked.dat'.format(self.name))
+                out = np.memmap(filename, dtype='float32', mode='w+',
+                                shape=precomputed.shape)
+
+            self.ranked = preprocessing.rank_rows(precomputed, out=out)
+
+        return self.ranked
+
+    def ranked_row_statistics(self):
+        """
+        Same as row_statistics, for the ranked precomputed matrix.
+        """
+        if self._ranked_row_statistics is None:
+            self._ranked_row_statistics = preprocessing.row_statistics(
+                self.ranked_precomputed())
+
+        return self._ranked_row_statistics
+
     def subset(self, node_list, precompute=True):
         """
         Generate a network that contains a subset of the nodes.
@@ -167,7 +372,8 @@ class EntityNet:
         return EntityNet(reduced_matrix,
                          self.name,
                          reduced_names,
-                         precomputed=precomputed)
+                         precomputed=precomputed,
+                         ordering=self.ordering)
 
 
 class GraphDataSet:
@@ -200,6 +406,7 @@ class GraphDataSet:
         self.super_adjacency = self.compute_super_adjacency(connections)
         self.is_dense = False
         self.tmpdir = tmpdir
+        self.path_vectors = {}
 
         self._check_consistent_types()
 
@@ -213,6 +420,13 @@ class GraphDataSet:
 
         return -1
 
+    def set_ordering(self, ordering):
+        """
+        Sets the node order of every network (see EntityNet.set_ordering).
+        """
+        for net in self.networks:
+            net.set_ordering(ordering)
+
     def cleanup_resources(self):
         if self.tmpdir:
             try:
@@ -221,9 +435,30 @@ class GraphDataSet:
                 print "Unexpected error deleting tmp file:", sys.exc_info()
                 print self.tmpdir
 
+    @staticmethod
+    def _load_matrix(data, key, data_path='.'):
+        """
+        Matrix stored under key in a loaded .mat dictionary. Matrices saved
+        out of the .mat file (see preprocessing.precompute_to_file) are
+        referenced by a "{key}_file" entry with the path of a .npy file,
+        relative to data_path, and are memory mapped instead of read.
+
+        Returns None if there is no such matrix.
+        """
+        if key in data:
+            return data[key]
+
+        file_key = "{}_file".format(key)
+        if file_key in data:
+            filename = np.ravel(data[file_key])[0].rstrip()
+            return np.load(os.path.join(data_path, filename), mmap_mode='r')
+
+        return None
+
     @staticmethod
     # @profile
-    def _extract_nets_from_data_dictionary(data, memsave=False):
+    def _extract_nets_from_data_dictionary(data, memsave=False, data_path='.',
+                                           pack_symmetric=False):
         network_names = data['entities']
         network_names = [n.rstrip().encode("utf8") for n in network_names]
         relation_names = data['relations']
@@ -238,17 +473,49 @@ class GraphDataSet:
             tmpdir = mkdtemp()
 
         for name in network_names:
-            precomputed_mat = data.get("{}_precomputed".format(name), None)
-            if memsave:
+            precomputed_mat = GraphDataSet._load_matrix(
+                data, "{}_precomputed".format(name), data_path)
+            ranked_mat = GraphDataSet._load_matrix(
+                data, "{}_ranked".format(name), data_path)
+            alpha = float(data.get("{}_alpha".format(name), 0.9))
+            if precomputed_mat is None:
+                precomputed_mat = representations.load(data, name, alpha, data_path)
+            elif sparse.issparse(precomputed_mat):
+                # Sparse approximations are read by rows
+                precomputed_mat = sparse.csr_matrix(precomputed_mat)
+            row_statistics = None
+            if "{}_row_means".format(name) in data:
+                row_statistics = [np.ravel(data["{}_row_means".format(name)]),
+                                  np.ravel(data["{}_row_norms".format(name)])]
+            if (memsave and pack_symmetric and
+                    isinstance(precomputed_mat, np.ndarray) and
+                    not isinstance(precomputed_mat, np.memmap) and
+                    representations.is_symmetric(precomputed_mat)):
+                # Symmetric matrices only need their upper triangle
+                filename = os.path.join(tmpdir, '{}_packed.dat'.format(name))
+                precomputed_mat = representations.pack_symmetric(
+                    precomputed_mat, 'float32', filename)
+            elif (memsave and isinstance(precomputed_mat, np.ndarray) and
+                    not isinstance(precomputed_mat, np.memmap)):
                 filename = os.path.join(tmpdir, '{}_precomp.dat'.format(name))
                 precomputed_memmap = np.memmap(filename, dtype='float32', mode='w+', shape=precomputed_mat.shape)
                 precomputed_memmap[:] = precomputed_mat[:]
                 precomputed_mat = precomputed_memmap
 
+            if memsave and ranked_mat is not None and not isinstance(ranked_mat, np.memmap):
+                filename = os.path.join(tmpdir, '{}_ranked.dat'.format(name))
+                ranked_memmap = np.memmap(filename, dtype='float32', mode='w+', shape=ranked_mat.shape)
+                ranked_memmap[:] = ranked_mat[:]
+                ranked_mat = ranked_memmap
+
             new_net = EntityNet(data[name],
                                 name,
                                 data['{}_name'.format(name)],
-                                precomputed=precomputed_mat)
+                                precomputed=precomputed_mat,
+                                ranked=ranked_mat,
+                                tmpdir=tmpdir,
+                                alpha=alpha,
+                                row_statistics=row_statistics)
 
             entity_nets.append(new_net)
 
@@ -260,26 +527,59 @@ class GraphDataSet:
 
     @classmethod
     # @profile
-    def read(cls, data_path, data_file, memsave=False):
+    def read(cls, data_path, data_file, memsave=False, pack_symmetric=False):
         """
         Loads network data.
 
         Assumes these matrices are normalized and there are precomputed
         matrices as well, and that the names are followed by "_name" and
-        "_precomputed" to indicate which data the entities contain.
+        "_precomputed" to indicate which data the entities contain. Ranked
+        precomputed matrices ("_ranked") are loaded too, if present, and
+        "_alpha" tells the restart probability used to precompute (0.9 if
+        missing). "_row_means" and "_row_norms" hold the row statistics of
+        the precomputed matrix, if saved, which is all pearson correlation
+        needs from it.
+
+        Precomputed and ranked matrices stored in .npy files (referenced by
+        "_precomputed_file" and "_ranked_file") are memory mapped, not read.
+
+        In memsave mode, dense precomputed matrices are copied to single
+        precision memory maps. With pack_symmetric, symmetric ones are
+        packed instead (see representations.PackedPrecomputed), which
+        halves their size but makes products with them slower.
         """
         data = sio.loadmat(os.path.join(data_path, data_file))
 
-        entity_nets, relation_nets, connections, tmpdir = GraphDataSet._extract_nets_from_data_dictionary(data, memsave=memsave)
+        entity_nets, relation_nets, connections, tmpdir = GraphDataSet._extract_nets_from_data_dictionary(data, memsave=memsave, data_path=data_path, pack_symmetric=pack_symmetric)
 
         return cls(entity_nets, relation_nets, connections, densify=False, tmpdir=tmpdir)
 
     def get_relation_matrix(self, origin, destination):
         return self.relations[self.connections[origin, destination]].matrix
 
+    def get_path_vector(self, path):
+        """
+        Returns the cached propagated vector of the intermediate networks
+        of a path (a list of network indices), or None if not cached.
+        """
+        return self.path_vectors.get(tuple(path))
+
+    def set_path_vector(self, path, vector):
+        self.path_vectors[tuple(path)] = vector
+
+    def _invalidate_path_vectors(self, src, dst):
+        """
+        Drops the cached path vectors that go through the src-dst relation.
+        """
+        for path in list(self.path_vectors.keys()):
+            steps = zip(path[:-1], path[1:])
+            if (src, dst) in steps or (dst, src) in steps:
+                del self.path_vectors[path]
+
     def set_relation_matrix(self, src, dst, new_matrix):
         connected = self.super_adjacency[src, dst]
         if connected:
+            self._invalidate_path_vectors(src, dst)
             rel_index = self.connections[src, dst]
             if rel_index != -1:
                 self._set_matrix(rel_index, new_matrix)
@@ -327,8 +627,18 @@ class GraphDataSet:
             precomputed_name = "{}_precomputed".format(name)
             names_name = "{}_name".format(name)
             mdict[name] = self.networks[i].matrix
-            mdict[precomputed_name] = self.networks[i].precomputed
             mdict[names_name] = self.networks[i].node_names
+            if not representations.save(mdict, name, self.networks[i].precomputed, path):
+                self._write_matrix(mdict, precomputed_name,
+                                   self.networks[i].precomputed, path)
+            if self.networks[i].ranked is not None:
+                self._write_matrix(mdict, "{}_ranked".format(name),
+                                   self.networks[i].ranked, path)
+            if self.networks[i]._row_statistics is not None:
+                [means, norms] = self.networks[i]._row_statistics
+                mdict["{}_row_means".format(name)] = means
+                mdict["{}_row_norms".format(name)] = norms
+            mdict["{}_alpha".format(name)] = self.networks[i].alpha
 
         for i in range(len(self.relations)):
             name = self.relations[i].name
@@ -340,6 +650,22 @@ class GraphDataSet:
 
         sio.savemat(os.path.join(path, filename), mdict, do_compression=True)
 
+    @staticmethod
+    def _write_matrix(mdict, key, matrix, path):
+        """
+        Adds a matrix to a .mat dictionary. Matrices memory mapped from .npy
+        files are not copied in: a reference to the file is saved instead
+        (see _load_matrix).
+        """
+        if matrix is None:
+            return
+
+        filename = getattr(matrix, 'filename', None)
+        if isinstance(matrix, np.memmap) and filename and filename.endswith('.npy'):
+            mdict["{}_file".format(key)] = os.path.relpath(filename, path)
+        else:
+            mdict[key] = matrix
+
     def densify(self):
         """
         Computes the dense matrices from which to operate from now on where it
@@ -29,31 +29,230 @@ import networkx as nx
 import numpy as np
 
 import scipy.sparse as sparse
-from scipy.linalg.blas import dgemm
-from scipy.stats import pearsonr, spearmanr
+import prophtools.utils.representations as representations
+import prophtools.utils.solvers as solvers
+from scipy.stats import pearsonr, spearmanr, rankdata
 
 
 # Performs Random Walk with Restarts
 # F is the query vector, C_H the adjacency matrix
-def RWR(F, C_H, alpha=0.9, maxiter=1000):
+# F can also be a n x k matrix with one query per column.
+# method is 'power' (fixed point iteration), 'cg' or 'bicgstab' (see
+# solvers.iterative_solve, which takes the preconditioner), and x0 an
+# initial guess of the result (warm start).
+# Fixed point iteration runs in place (see solvers.power_iteration): each
+# iteration is a single sparse matrix by dense block product, without
+# temporaries, or with precision 'mixed' in single precision with double
+# precision corrections (see solvers.refined_iteration). With return_info,
+# returns [F, iterations, residuals], the iterations and final residual of
+# each query.
+def RWR(F, C_H, alpha=0.9, maxiter=1000, method='power',
+        preconditioner='none', x0=None, return_info=False, precision='double'):
     if not sparse.issparse(C_H):
         C_H = sparse.csr_matrix(C_H, dtype=float)
 
-    initial_F = F
-    for iter in range(maxiter):
-        old_F = F
-        F = alpha * C_H * old_F + (1-alpha)*initial_F
-        if(abs(F-old_F).sum() < 1e-9):
-            break
-    return F
+    solvers.validate_method(method)
+    solvers.validate_precision(precision, method)
+    if method != 'power':
+        result = solvers.iterative_solve(C_H, F, alpha, method, preconditioner,
+                                         x0, maxiter=maxiter)
+    elif precision == 'mixed':
+        result = solvers.refined_iteration(C_H, F, alpha, maxiter, x0=x0)
+    else:
+        result = solvers.power_iteration(C_H, F, alpha, maxiter, x0=x0)
+
+    if return_info:
+        return result
+    return result[0]
+
+
+# RWR of F for every restart probability in alphas, in a single pass that
+# shares the sparse products between them (see solvers.series_iteration).
+# Returns the results stacked in an array of shape (len(alphas),) + F.shape,
+# or with return_info [F, iterations, residuals], with one row per alpha.
+def multi_alpha_RWR(F, C_H, alphas, maxiter=1000, return_info=False):
+    if not sparse.issparse(C_H):
+        C_H = sparse.csr_matrix(C_H, dtype=float)
+
+    result = solvers.series_iteration(C_H, F, alphas, maxiter)
+    if return_info:
+        return result
+    return result[0]
+
+
+# RWR of F (a vector, or a n x q block of queries) by fixed point iteration
+# that stops as soon as the k nodes with the largest scores, and their order,
+# can no longer change with further iterations. Scores are scale * F + offset
+# (vectors of length n, F itself if None), so that scores which are an affine
+# function of the propagation (see ProphNet._top_pearson_scores) can be
+# ranked too; nodes whose scale or offset are not finite are not ranked.
+# C_H must be normalized (see preprocessing.normalize_matrix), so its 2-norm
+# is at most 1: the iterate after a change d is then within
+# alpha / (1 - alpha) * |d| (2-norm) of the exact result, and so is each of
+# its entries. After each check, the top k are checked again once the bound
+# is small enough to tell apart the closest scores (see top_slack), but
+# between a half and a sixteenth of what it was, as scores still move.
+# Queries whose top k cannot be told apart within it (ties) iterate until
+# they converge as RWR.
+# Returns [F, top, certified]: the propagated queries, the indices of their
+# top k scores in decreasing order (a k x q array for a block), and whether
+# those are certainly the top k of the exact result, in its order, or
+# approximate. With return_info, the iterations of each query follow.
+def top_k_RWR(F, C_H, k, alpha=0.9, maxiter=1000, scale=None, offset=None,
+              return_info=False):
+    if not sparse.issparse(C_H):
+        C_H = sparse.csr_matrix(C_H, dtype=float)
+
+    F = np.asarray(F, dtype=float)
+    n = F.shape[0]
+    n_queries = F.reshape(n, -1).shape[1]
+    if scale is None:
+        scale = np.ones(n)
+    if offset is None:
+        offset = np.zeros(n)
+    ranked = np.isfinite(scale) & np.isfinite(offset)
+    scale = np.where(ranked, scale, 0.0)
+    offset = np.where(ranked, offset, -np.inf)
+    widths = abs(scale) * alpha / (1 - alpha)
+
+    k = min(k, ranked.sum())
+    top = np.zeros((k, n_queries), dtype=int)
+    certified = np.zeros(n_queries, dtype=bool)
+    next_check = np.zeros(n_queries) + np.inf
+    scores = np.empty(n)
+    query_widths = np.empty(n)
+
+    def stop(active, current, change):
+        bounds = np.sqrt(np.einsum('ij,ij->j', change, change))
+        done = np.zeros(len(active), dtype=bool)
+        for j in np.flatnonzero(bounds <= next_check[active]):
+            query = active[j]
+            np.multiply(scale, current[:, j], out=scores)
+            np.add(scores, offset, out=scores)
+            np.multiply(widths, bounds[j], out=query_widths)
+            [query_top, slack] = top_slack(scores, query_widths, k)
+            if slack > 1:
+                done[j] = True
+                top[:, query] = query_top
+                certified[query] = True
+            else:
+                next_check[query] = bounds[j] * min(max(slack, 1.0 / 16), 0.5)
+        return done
+
+    [result, iterations, _] = solvers.power_iteration(C_H, F, alpha, maxiter,
+                                                      stop=stop)
+
+    columns = result.reshape(n, -1)
+    for query in np.flatnonzero(~certified):
+        np.multiply(scale, columns[:, query], out=scores)
+        scores += offset
+        top[:, query] = np.argsort(-scores, kind='mergesort')[:k]
+
+    if F.ndim == 1:
+        result = [result, top[:, 0], certified[0], iterations[0]]
+    else:
+        result = [result, top, certified, iterations]
+
+    if return_info:
+        return result
+    return result[:3]
+
+
+def top_slack(scores, widths, k):
+    """
+    The k largest scores, in decreasing order, and how much they are set
+    apart from each other and from the rest: the largest factor the widths
+    could grow by with the top k still the same, in the same order, for
+    any scores within widths of these. So they are certain if it is
+    greater than 1. Scores of -inf are not ranked (there may be fewer than
+    k).
+
+    The order of the top k is checked first, and the rest of the scores
+    only if it is certain, so a slack below 1 may be an overestimate.
+
+    Returns:
+        [top, slack]: indices of the top scores, and the slack.
+    """
+    k = min(k, len(scores))
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.lexsort((top, -scores[top]))]
+    top = top[scores[top] > -np.inf]
+    if len(top) == 0:
+        return [top, np.inf]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = -np.diff(scores[top]) / (widths[top][:-1] + widths[top][1:])
+        slack = np.nan_to_num(ratios).min() if len(ratios) else np.inf
+        if slack <= 1 or len(top) == len(scores):
+            return [top, slack]
+
+        last = top[-1]
+        ratios = (scores[last] - scores) / (widths[last] + widths)
+        ratios[top] = np.inf
+        ratios[np.isnan(ratios)] = 0.0
+        return [top, min(slack, ratios.min())]
+
+
+def dot_by_row_blocks(m, v, block_size=1024):
+    """
+    Computes m * v reading m in blocks of rows. Used for precomputed
+    matrices, which may be single precision memory maps: multiplying them
+    as a whole would make a double precision copy of the full matrix.
+    Representations (see representations.PrecomputedMatrix) and sparse
+    matrices compute the product themselves.
+    """
+    if isinstance(m, representations.PrecomputedMatrix):
+        return m.dot(v)
+
+    if sparse.issparse(m):
+        return np.asarray(m.dot(v))
+
+    n_rows = m.shape[0]
+    result = np.zeros((n_rows,) + v.shape[1:])
+    for start in range(0, n_rows, block_size):
+        stop = min(start + block_size, n_rows)
+        result[start:stop] = np.dot(np.asarray(m[start:stop]), v)
+
+    return result
 
 
 class ProphNet:
-    def __init__(self, graphdata, method="prophnet"):
+    """
+    ProphNet prioritizer on a GraphDataSet.
+
+    Args:
+        graphdata: GraphDataSet to prioritize on.
+        method:    Prioritization method (only "prophnet" for now).
+        solver:    How RWR is solved when it cannot be read from a
+                   precomputed matrix: "iterative" (fixed point iteration)
+                   "factorized" (sparse factorization cached per network,
+                   see solvers.factorize), "cg" (conjugate gradient, for
+                   symmetric networks) or "bicgstab".
+        preconditioner: Preconditioner of the "cg" and "bicgstab" solvers
+                   (see solvers.build_preconditioner), built once per
+                   network. "ilu" only for "bicgstab".
+        precision: "mixed" runs the "iterative" solver in single precision
+                   with double precision corrections (see
+                   solvers.refined_iteration).
+    """
+    def __init__(self, graphdata, method="prophnet", solver="iterative",
+                 preconditioner="none", precision="double"):
         self.graphdata = graphdata
         self.method = method
+        self.solver = solver
+        self.preconditioner = preconditioner
+        self.precision = precision
 
         self._validate_method(method)
+        solvers.validate_solver(solver, solvers.PROPAGATION_SOLVERS)
+        solvers.validate_preconditioner(preconditioner, solver)
+        if solver == "iterative":
+            solvers.validate_precision(precision)
+        else:
+            solvers.validate_precision(precision, solver)
 
     def _validate_method(self, method):
         implemented_methods = ['prophnet']
@@ -80,14 +279,20 @@ class ProphNet:
         single net prioritization.
 
         Parameters:
-            query: Input nodes of the source net (src_net)
+            query: Input nodes of the source net (src_net), or a n x k query
+                   matrix with one query per column (see
+                   generate_query_matrix).
             src_net: Source network.
             dst_net: Destination network
             corr_function: "pearson" or "spearman"
 
+        Returns:
+            A list of [score, name] pairs for the nodes of dst_net. For a
+            query matrix, a score matrix with one row per node of dst_net
+            and one column per query.
         """
 
-        self._validate_query(query, src_net, dst_net)
+        self._validate_query(query, src_net, dst_net, corr_function)
         scores = None
         if src_net == dst_net:
             scores = self.single_propagation(query,
@@ -99,10 +304,72 @@ class ProphNet:
                                                dst_net,
                                                corr_function=corr_function)
 
+        if self._is_query_matrix(query):
+            return scores
+
         names = self.graphdata.networks[dst_net].node_names
         tagged_scores = self.associate_scores_to_entities(scores, names)
         return tagged_scores
 
+    def propagate_top(self, query, src_net, dst_net, n, corr_function="pearson"):
+        """
+        The n best scoring nodes of dst_net for a query, as propagate.
+
+        When the scores need a propagation on dst_net (pearson scores on a
+        network without precomputed matrix, with the iterative solver), it
+        stops as soon as the n best scores and their order can no longer
+        change (see _top_pearson_scores) instead of converging on every
+        node. Otherwise all scores are computed as propagate does.
+
+        Parameters:
+            query: Input nodes of the source net (src_net).
+            src_net: Source network.
+            dst_net: Destination network
+            n: Number of results.
+            corr_function: "pearson" or "spearman"
+
+        Returns:
+            [results, certified]: a list of the n best [score, name] pairs,
+            in decreasing score order, and whether they are certain: False
+            if the propagation stopped without telling apart some scores
+            (ties) within its error bound, so their order is approximate.
+            results is None if the propagation resulted in all-zero
+            vectors.
+        """
+        if self._is_query_matrix(query):
+            raise ValueError("Top results are computed for a single query")
+
+        self._validate_query(query, src_net, dst_net, corr_function)
+        corr_method = self._get_correlation_method(corr_function)
+        if src_net == dst_net:
+            vectors = self._within_network_propagation(
+                self._query_block(query, src_net), src_net)
+            n_paths = 1
+        else:
+            network_list = [net.matrix for net in self.graphdata.networks]
+            [vectors, n_paths] = self._propagated_vectors(query, src_net, dst_net,
+                                                          RWR, network_list)
+
+        dst = self.graphdata.networks[dst_net]
+        certified = True
+        if (corr_method is pearsonr and dst.precomputed is None and
+                self.solver == "iterative" and vectors.sum() > 0):
+            [scores, certified] = self._top_pearson_scores(
+                np.ravel(vectors), dst_net, n_paths, n)
+        else:
+            scores = self._unblock_scores(
+                self.compute_correlation_score_matrix(dst.matrix, vectors,
+                                                      dst_net, n_paths,
+                                                      corr_method),
+                query)
+            if scores is None:
+                return [None, False]
+
+        ranked = np.flatnonzero(np.isfinite(scores))
+        top = ranked[np.argsort(-scores[ranked], kind='mergesort')][:n]
+        names = dst.node_names
+        return [[[scores[i], names[i]] for i in top], certified]
+
     def _validate_network_index(self, i):
         if i < 0 or i >= len(self.graphdata.networks):
             msg = "Network out of bounds: {}. Data only has {} nets".format(
@@ -112,27 +379,45 @@ class ProphNet:
             raise ValueError(msg)
 
     def _validate_query_bounds(self, query, i):
+        matrix = self.graphdata.networks[i].matrix
+        if self._is_query_matrix(query):
+            if query.shape[0] != matrix.shape[0]:
+                msg = "Query matrix has {} rows for matrix dims {}".format(
+                    str(query.shape[0]), str(matrix.shape))
+                raise ValueError(msg)
+            return
+
         maxquery = max(query)
         minquery = min(query)
-        matrix = self.graphdata.networks[i].matrix
         if maxquery >= matrix.shape[0] or minquery < 0:
             msg = "Query out of network bounds: [min:max] [{}:{}] for matrix dims {}".format(
                 str(minquery), str(maxquery), str(matrix.shape))
             raise ValueError(msg)
 
-    def _validate_query(self, query, src_net, dst_net):
+    def _validate_query(self, query, src_net, dst_net, corr_function="pearson"):
         self._validate_network_index(src_net)
-        self._validate_target_network(dst_net)
+        self._validate_target_network(dst_net, corr_function)
         self._validate_query_bounds(query, src_net)
 
-    def _validate_target_network(self, dst_net):
+    def _validate_target_network(self, dst_net, corr_function="pearson"):
         self._validate_network_index(dst_net)
-        self._validate_precomputed_network(dst_net)
+        self._validate_precomputed_network(dst_net, corr_function)
+
+    def _validate_precomputed_network(self, i, corr_function="pearson"):
+        """
+        Pearson scores are computed on the fly if the target net has no
+        precomputed matrix (see _pearson_scores). Spearman needs the whole
+        rows, so it needs the precomputed matrix or its ranks.
+        """
+        net = self.graphdata.networks[i]
+        if net.precomputed is not None or corr_function.lower() == "pearson":
+            return
 
-    def _validate_precomputed_network(self, i):
-        if self.graphdata.networks[i].precomputed is None:
-            msg = "Target net not precomputed ({}). Computation on the fly not implemented".format(i)
-            raise NotImplementedError(msg)
+        if net.ranked is not None and corr_function.lower() == "spearman":
+            return
+
+        msg = "Target net not precomputed ({}). Computation on the fly only implemented for pearson".format(i)
+        raise NotImplementedError(msg)
 
     def _get_correlation_method(self, method_name):
         corr_method = None
@@ -169,6 +454,45 @@ class ProphNet:
 
         return query_vector
 
+    def generate_query_matrix(self, queries, network_index):
+        """
+        Builds a n x k query matrix out of a list of k queries (lists of
+        node indices), so they can be propagated as a single block.
+        """
+        query_matrix = np.zeros((self.graphdata.networks[network_index].matrix.shape[0],
+                                 len(queries)))
+        for j, query in enumerate(queries):
+            query_matrix[:, j] = self.generate_query_vector(query, network_index)
+
+        return query_matrix
+
+    @classmethod
+    def _is_query_matrix(cls, query):
+        return isinstance(query, np.ndarray) and query.ndim == 2
+
+    def _query_block(self, query, network_index):
+        """
+        Returns the n x k query matrix for query, which is either a list of
+        node indices (k = 1) or already a query matrix.
+        """
+        if self._is_query_matrix(query):
+            return query
+
+        return self.generate_query_vector(query, network_index)[:, np.newaxis]
+
+    def _unblock_scores(self, scores, query):
+        """
+        Scores for a single query are returned as a vector, or None if the
+        propagation resulted in all-zero vectors.
+        """
+        if self._is_query_matrix(query):
+            return scores
+
+        if np.isnan(scores[:, 0]).all():
+            return None
+
+        return scores[:, 0]
+
     def associate_scores_to_entities(self, scores, names):
         result = []
         if len(scores) != len(names):
@@ -184,29 +508,106 @@ class ProphNet:
 
     def single_propagation(self, query, src_net, corr_function=None):
         network = self.graphdata.networks[src_net].matrix
-        names = self.graphdata.networks[src_net].node_names
-        query_vector = self.generate_query_vector(query, src_net)
-        initial_score = RWR(query_vector, network)
-
-        vectors = initial_score.tolist()
+        query_matrix = self._query_block(query, src_net)
+        initial_score = self._within_network_propagation(query_matrix, src_net)
 
         corr_method = self._get_correlation_method(corr_function)
-        d_vectors = dgemm(alpha=1., a=vectors, b=vectors, trans_a=True)[0][0]
         n_paths = 1
 
-        corr_score = self.compute_correlation_scores(network,
-                                                     vectors,
-                                                     d_vectors,
-                                                     src_net,
-                                                     n_paths,
-                                                     corr_method)
+        corr_score = self.compute_correlation_score_matrix(network,
+                                                           initial_score,
+                                                           src_net,
+                                                           n_paths,
+                                                           corr_method)
+
+        return self._unblock_scores(corr_score, query)
+
+    def _within_network_propagation(self, query_matrix, network_index,
+                                    within_propagation_method=RWR):
+        """
+        Propagates a query matrix within a network, reading the result from
+        the precomputed matrix when possible instead of iterating.
+        """
+        if within_propagation_method is RWR:
+            scores = self._propagate_from_precomputed(query_matrix, network_index)
+            if scores is not None:
+                return scores
+
+            return self._rwr(query_matrix, network_index)
+
+        network = self.graphdata.networks[network_index].matrix
+        return within_propagation_method(query_matrix, network)
+
+    def _rwr(self, F, network_index, alpha=0.9):
+        """
+        RWR on a network of the dataset, with the solver of this prioritizer.
+        Networks with a node ordering are solved in that order and the
+        result is returned in the original one.
+        """
+        net = self.graphdata.networks[network_index]
+        permutation = net.permutation
+        if permutation is not None:
+            F = np.asarray(F)[permutation]
+
+        if self.solver == "factorized":
+            result = solvers.factorized_solve(net.factorization(alpha), F, alpha)
+        elif self.solver in solvers.KRYLOV_METHODS:
+            preconditioner = net.preconditioner(self.preconditioner, alpha)
+            result = RWR(F, net.ordered_matrix(), alpha=alpha, method=self.solver,
+                         preconditioner=preconditioner)
+        else:
+            result = RWR(F, net.ordered_matrix(), alpha=alpha,
+                         precision=self.precision)
+
+        if permutation is None:
+            return result
+
+        result = np.asarray(result)
+        restored = np.empty(result.shape)
+        restored[permutation] = result
+        return restored
+
+    def _propagate_from_precomputed(self, query_matrix, network_index, alpha=0.9):
+        """
+        Column i of a precomputed matrix is the RWR of a query made only of
+        node i. RWR is linear in the query, so the RWR of any query is the
+        weighted sum of the precomputed columns of its nodes: a column
+        gather instead of an iterative propagation.
+
+        Only exact precomputed matrices are read (see
+        representations.is_exact): the approximate ones (spectral, push,
+        thresholded, quantized and single precision ones) are meant for
+        scoring, and propagating with them would change the results.
 
-        return corr_score
+        Returns:
+            The n x k propagated scores, or None if the network has no
+            exact precomputed matrix for this alpha.
+        """
+        net = self.graphdata.networks[network_index]
+        precomputed = net.precomputed
+        if precomputed is None or net.alpha != alpha:
+            return None
+
+        if not representations.is_exact(precomputed):
+            return None
+
+        support = np.flatnonzero(abs(query_matrix).sum(axis=1))
+        if isinstance(precomputed, representations.PrecomputedMatrix):
+            columns = precomputed.columns(support)
+        else:
+            columns = precomputed[:, support]
+        return np.asarray(columns.dot(query_matrix[support]))
 
     def across_network_propagation(self, network, connection, raise_to_one=False):
-        tmp_scores = np.zeros(network.shape[0])
-        sum_value = 0
-        count_value = 0
+        """
+        Scores each node of network with the average of the (nonzero)
+        values connecting it in connection, keeping only the top scoring
+        nodes to remove noise.
+
+        Column sums and counts are computed in bulk on a column oriented
+        (CSC) copy of connection, and the top scores are selected with a
+        partial sort.
+        """
         percent = 0.00375
 
         result = ProphNet.check_matrix_dimensions(connection, network)
@@ -214,27 +615,31 @@ class ProphNet:
             msg = "Inner problem with get connection: dimensions do not match."
             raise ValueError(msg)
 
-        for j in range(network.shape[0]):
-            column = connection[:, j]
-            sum_value = column.sum()
-            count_value = column.getnnz()
+        connection = sparse.csc_matrix(connection)
+        sum_values = np.ravel(np.asarray(connection.sum(axis=0), dtype=float))
+        count_values = np.diff(connection.indptr)
 
-            if count_value > 0:
-                tmp_scores[j] = sum_value/float(count_value)
+        tmp_scores = np.zeros(network.shape[0])
+        connected = count_values > 0
+        tmp_scores[connected] = sum_values[connected] / count_values[connected]
 
         # Network inside values propagation and remove noise
-        sorted_indices = np.argsort(tmp_scores)[::-1]
-        sorted_tmp_scores = tmp_scores[sorted_indices]
         threshold_index = int(math.ceil(percent*tmp_scores.shape[0]))
-        sorted_tmp_scores[threshold_index:tmp_scores.shape[0]] = 0.0
+        if threshold_index < tmp_scores.shape[0]:
+            top_indices = np.argpartition(-tmp_scores, threshold_index)
+            top_indices = top_indices[0:threshold_index]
+        else:
+            top_indices = np.arange(tmp_scores.shape[0])
 
+        top_scores = tmp_scores[top_indices]
         if raise_to_one:
-            sorted_tmp_scores[0:threshold_index] = 1.0
+            top_scores = 1.0
 
-        tmp_scores[sorted_indices] = sorted_tmp_scores
+        tmp_scores = np.zeros(network.shape[0])
+        tmp_scores[top_indices] = top_scores
 
         if not raise_to_one:
-            tmp_scores = tmp_scores/sum(tmp_scores)
+            tmp_scores = tmp_scores/tmp_scores.sum()
 
         return tmp_scores
 
@@ -284,42 +689,79 @@ class ProphNet:
         Core function for propagation across networks.
 
         Arguments:
-            query: List of indices of the entities of src_net in the query.
+            query: List of indices of the entities of src_net in the query,
+                or a n x k query matrix with one query per column.
             src_net: Index of src_net in network_list.
             dst_net: Index of dst_net in network_list.
             within_propagation_method: A function that takes two parameters:
-                a score list for each element in the network and an adjacency
-                matrix. Returns a score list for each element in the network
-                after propagation.
+                a score list (or a n x k block of score lists) for each
+                element in the network and an adjacency matrix. Returns a
+                score list (block) for each element in the network after
+                propagation.
 
                 Right now it can take RWR as implemented for Prophnet.
             network_list: Adjacency matrix list.
             corr_function: Correlation function used to compute final scores.
                 Right now it can be pearsonr or spearmanr from numpy.
+
+        Returns:
+            Scores for the nodes of dst_net. A score matrix (one column per
+            query) if query is a query matrix.
         """
-        vectors = []
+        [vectors, n_paths] = self._propagated_vectors(query, src_net, dst_net,
+                                                      within_propagation_method,
+                                                      network_list)
+
+        scores = self.compute_correlation_score_matrix(network_list[dst_net],
+                                                       vectors,
+                                                       dst_net,
+                                                       n_paths,
+                                                       corr_function)
+
+        return self._unblock_scores(scores, query)
+
+    def _propagated_vectors(self, query, src_net, dst_net,
+                            within_propagation_method, network_list):
+        """
+        Propagates query from src_net along every path to dst_net (see
+        _multiple_propagation).
+
+        Returns:
+            [vectors, n_paths]: the (n_paths * n) x k matrix of the
+            concatenated propagated vectors of each query, and the number of
+            paths.
+        """
+        blocks = []
         initial_net = network_list[src_net]
-        query_vector = self.generate_query_vector(query, src_net)
-        initial_score = within_propagation_method(query_vector, initial_net)
+        query_matrix = self._query_block(query, src_net)
+        n_queries = query_matrix.shape[1]
+        if initial_net is self.graphdata.networks[src_net].matrix:
+            initial_score = self._within_network_propagation(
+                query_matrix, src_net, within_propagation_method)
+        else:
+            initial_score = within_propagation_method(query_matrix, initial_net)
         path_list = ProphNet.find_all_paths(nx.from_numpy_matrix(
                                             self.graphdata.super_adjacency),
                                             src_net,
                                             dst_net)
 
+        use_cache = within_propagation_method is RWR and all(
+            network_list[i] is n.matrix
+            for i, n in enumerate(self.graphdata.networks))
+
         for path in path_list:
             current_score = initial_score
             if len(path) > 2:
-                for idx, step in enumerate(path[1:-1]):
-                    network = network_list[path[idx+1]]
-                    prev_net = path[idx]
-                    current_net = path[idx+1]
+                current_score = None
+                if use_cache:
+                    current_score = self.graphdata.get_path_vector(path[:-1])
 
-                    connection = self.graphdata.get_connection(prev_net,
-                                                               current_net)
+                if current_score is None:
+                    current_score = self._intermediate_path_scores(
+                        path, within_propagation_method, network_list)
 
-                    tmp_scores = self.across_network_propagation(network,
-                                                                 connection.matrix)
-                    current_score = within_propagation_method(tmp_scores, network)
+                    if use_cache:
+                        self.graphdata.set_path_vector(path[:-1], current_score)
 
             connection = self.graphdata.get_connection(path[-2], dst_net).matrix
             connection = self.match_matrix_dimensions(connection, current_score)
@@ -328,18 +770,45 @@ class ProphNet:
                 new_shape = (current_score.shape[0], 1)
                 current_score = np.reshape(current_score, new_shape)
 
-            compu = (connection * current_score).tolist()
-            vectors += compu
+            compu = np.asarray(connection * current_score)
+            if compu.shape[1] != n_queries:
+                # Scores past an intermediate network do not depend on the query
+                compu = np.tile(compu, (1, n_queries))
 
-        d_vectors = dgemm(alpha=1., a=vectors, b=vectors, trans_a=True)[0][0]
-        dst_net_matrix = network_list[dst_net]
+            blocks.append(compu)
 
-        return self.compute_correlation_scores(dst_net_matrix,
-                                               vectors,
-                                               d_vectors,
-                                               dst_net,
-                                               len(path_list),
-                                               corr_function)
+        if blocks:
+            vectors = np.vstack(blocks)
+        else:
+            vectors = np.zeros((0, n_queries))
+
+        return [vectors, len(path_list)]
+
+    def _intermediate_path_scores(self, path, within_propagation_method,
+                                  network_list):
+        """
+        Propagates along the intermediate networks of a path (len(path) > 2).
+        Only the relation matrices take part in this, not the query, so the
+        result is cached per dataset by _multiple_propagation.
+        """
+        current_score = None
+        for idx, step in enumerate(path[1:-1]):
+            network = network_list[path[idx+1]]
+            prev_net = path[idx]
+            current_net = path[idx+1]
+
+            connection = self.graphdata.get_connection(prev_net,
+                                                       current_net)
+
+            tmp_scores = self.across_network_propagation(network,
+                                                         connection.matrix)
+            if (within_propagation_method is RWR and
+                    network is self.graphdata.networks[current_net].matrix):
+                current_score = self._rwr(tmp_scores, current_net)
+            else:
+                current_score = within_propagation_method(tmp_scores, network)
+
+        return current_score
 
     def compute_correlation_scores(self,
                                    network,
@@ -350,27 +819,198 @@ class ProphNet:
                                    corr_function):
 
         horizontal_vectors = np.ravel(vectors)
-        corr_results = np.zeros(network.shape[0], dtype='f,f')
-        corr_scores = np.zeros(network.shape[0])
-        
+
         if sum(horizontal_vectors) > 0:
-            dst_precomputed_net = self.graphdata.networks[dst_net_index].precomputed
-            if sparse.issparse(dst_precomputed_net):
-                dst_precomputed_net = dst_precomputed_net.todense()
-
-            for i in range(network.shape[0]):
-                current_row = dst_precomputed_net[i]
-                #if sparse.issparse(current_row):
-                current_row = np.ravel(current_row)
-
-                final_net = np.tile(current_row, n_paths)
-                score_tuple = corr_function(horizontal_vectors, final_net)
-                corr_results[i] = score_tuple
-                corr_scores[i] = score_tuple[0]
+            corr_scores = self.compute_correlation_score_matrix(
+                network,
+                horizontal_vectors[:, np.newaxis],
+                dst_net_index,
+                n_paths,
+                corr_function)
+
+            return corr_scores[:, 0]
         else:
             msg = ("Warning: Propagation resulted in an all-zero vectors, which"
                    " cannot be correlated to the scores.")
             print msg
             return None
 
+    def compute_correlation_score_matrix(self,
+                                         network,
+                                         vectors,
+                                         dst_net_index,
+                                         n_paths,
+                                         corr_function):
+        """
+        Correlation scores for a block of queries.
+
+        Arguments:
+            network: Destination network matrix.
+            vectors: A (n_paths * n) x k matrix. Each column is the
+                concatenation of the propagated vectors of one query along
+                every path.
+            dst_net_index: Index of the destination network.
+            n_paths: Number of paths the vectors are made of.
+            corr_function: Correlation function used to compute final scores.
+
+        Returns:
+            A n x k score matrix. Columns of queries whose propagation resulted
+            in all-zero vectors are all nan.
+        """
+        n_queries = vectors.shape[1]
+        corr_scores = np.zeros((network.shape[0], n_queries))
+
+        valid = vectors.sum(axis=0) > 0
+        if not valid.all():
+            msg = ("Warning: Propagation resulted in an all-zero vectors, which"
+                   " cannot be correlated to the scores.")
+            print msg
+            corr_scores[:, ~valid] = np.nan
+
+        if not valid.any():
+            return corr_scores
+
+        valid_vectors = vectors[:, valid]
+        if corr_function is pearsonr:
+            corr_scores[:, valid] = self._pearson_scores(valid_vectors,
+                                                         dst_net_index,
+                                                         n_paths)
+        elif corr_function is spearmanr:
+            corr_scores[:, valid] = self._spearman_scores(valid_vectors,
+                                                          dst_net_index,
+                                                          n_paths)
+        else:
+            dst_precomputed_net = self.graphdata.networks[dst_net_index].precomputed
+            if dst_precomputed_net is None:
+                msg = "Target net not precomputed ({}). Computation on the fly only implemented for pearson".format(dst_net_index)
+                raise NotImplementedError(msg)
+            for j in np.flatnonzero(valid):
+                horizontal_vectors = vectors[:, j]
+                for i in range(network.shape[0]):
+                    current_row = dst_precomputed_net[i]
+                    if sparse.issparse(current_row):
+                        current_row = current_row.toarray()
+                    current_row = np.ravel(current_row)
+
+                    final_net = np.tile(current_row, n_paths)
+                    score_tuple = corr_function(horizontal_vectors, final_net)
+                    corr_scores[i, j] = score_tuple[0]
+
+        return corr_scores
+
+    def _pearson_scores(self, vectors, dst_net_index, n_paths):
+        """
+        Pearson correlation of the propagated vectors against every row of
+        the destination precomputed matrix at once.
+
+        Without a precomputed matrix P, the product of P with a vector v
+        (all _correlate_rows needs from P, besides its row statistics) is
+        the RWR of v, since column j of P is the RWR of node j alone. So it
+        takes one propagation per block of queries, and the row statistics,
+        which are computed once per network.
+        """
+        dst_net = self.graphdata.networks[dst_net_index]
+        precomputed = dst_net.precomputed
+        if precomputed is None:
+            def product(v):
+                return self._rwr(v, dst_net_index, alpha=dst_net.alpha)
+        else:
+            def product(v):
+                return dot_by_row_blocks(precomputed, v)
+
+        return self._correlate_rows(vectors,
+                                    product,
+                                    dst_net.row_statistics(self.solver),
+                                    n_paths)
+
+    def _top_pearson_scores(self, vector, dst_net_index, n_paths, n):
+        """
+        _pearson_scores of a single propagated vector on a destination
+        network without precomputed matrix, propagating only until its n
+        best scores and their order are certain (see top_k_RWR).
+
+        Each score is an affine function of one entry of the propagation,
+        (p_i - row_mean_i * sum(v)) / denominator_i (see _correlate_rows),
+        so the bound on the error of the propagation bounds the scores.
+
+        Returns:
+            [scores, certified]
+        """
+        dst_net = self.graphdata.networks[dst_net_index]
+        [row_means, row_norms] = dst_net.row_statistics(self.solver)
+
+        summed_vector = np.reshape(vector, (n_paths, -1)).sum(axis=0)
+        centered_vector = vector - vector.mean()
+        vector_norm = math.sqrt((centered_vector * centered_vector).sum())
+        offsets = row_means * summed_vector.sum()
+        denominators = row_norms * vector_norm * math.sqrt(n_paths)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = 1.0 / denominators
+            offset = -offsets * scale
+
+        permutation = dst_net.permutation
+        if permutation is not None:
+            [summed_vector, scale, offset] = [summed_vector[permutation],
+                                              scale[permutation],
+                                              offset[permutation]]
+
+        [product, _, certified] = top_k_RWR(summed_vector, dst_net.ordered_matrix(),
+                                            n, alpha=dst_net.alpha, scale=scale,
+                                            offset=offset)
+        if permutation is not None:
+            restored = np.empty(product.shape)
+            restored[permutation] = product
+            product = restored
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = (product - offsets) / denominators
+
+        return [scores, certified]
+
+    def _spearman_scores(self, vectors, dst_net_index, n_paths):
+        """
+        Spearman correlation of the propagated vectors against every row of
+        the destination precomputed matrix at once.
+
+        Ranking a row tiled n_paths times is an affine function of the ranks
+        of the row, so this is a Pearson correlation of the ranked vectors
+        against the (cached) ranked precomputed rows.
+        """
+        dst_net = self.graphdata.networks[dst_net_index]
+        ranked_vectors = np.zeros(vectors.shape)
+        for j in range(vectors.shape[1]):
+            ranked_vectors[:, j] = rankdata(vectors[:, j])
+
+        ranked = dst_net.ranked_precomputed()
+        return self._correlate_rows(ranked_vectors,
+                                    lambda v: dot_by_row_blocks(ranked, v),
+                                    dst_net.ranked_row_statistics(),
+                                    n_paths)
+
+    def _correlate_rows(self, vectors, product, row_statistics, n_paths):
+        """
+        Pearson correlation of each column of vectors against each row of
+        a matrix tiled n_paths times, given the row means and centered row
+        norms of the matrix, and a function that returns its product with a
+        block of vectors.
+
+        Each column of vectors is the concatenation of one vector per path.
+        Tiling does not change the row mean and scales the centered norm by
+        sqrt(n_paths), so all correlations come out of a single product of
+        the matrix with the sum of the per-path vectors.
+        """
+        [row_means, row_norms] = row_statistics
+
+        path_vectors = np.reshape(vectors, (n_paths, -1, vectors.shape[1]))
+        summed_vectors = path_vectors.sum(axis=0)
+        centered_vectors = vectors - vectors.mean(axis=0)
+        vectors_norm = np.sqrt((centered_vectors * centered_vectors).sum(axis=0))
+
+        products = product(summed_vectors)
+        numerators = products - np.outer(row_means, summed_vectors.sum(axis=0))
+        denominators = np.outer(row_norms, vectors_norm) * math.sqrt(n_paths)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr_scores = numerators / denominators
+
         return corr_scores
@@ -27,7 +27,12 @@ matrix to the same file.
 """
 from prophtools.utils.experiment import Experiment
 import prophtools.utils.preprocessing as preprocessing
+import prophtools.utils.planner as planner
+import prophtools.utils.representations as representations
+import prophtools.utils.solvers as solvers
 import scipy.io as sio
+import numpy as np
+import os
 
 
 class NormalizePrecomputeExperiment(Experiment):
@@ -44,6 +49,18 @@ class NormalizePrecomputeExperiment(Experiment):
         params['key'] = self.config.get(section, "key")
         params['matfile'] = self.config.get(section, "matfile")
         params['normalized'] = self.config.get(section, "normalized").lower() in ['true', '1', 'yes']
+        params['rank'] = self._get_optional_parameter(section, "rank", "False").lower() in ['true', '1', 'yes']
+        params['block_size'] = int(self._get_optional_parameter(section, "block_size", "256"))
+        params['solver'] = self._get_optional_parameter(section, "solver", "auto")
+        params['n_jobs'] = int(self._get_optional_parameter(section, "n_jobs", "1"))
+        params['ordering'] = self._get_optional_parameter(section, "ordering", "none")
+        params['precision'] = self._get_optional_parameter(section, "precision", "double")
+        params['precomputed_file'] = self._get_optional_parameter(section, "precomputed_file", "")
+        params['representation'] = self._get_optional_parameter(section, "representation", "dense")
+        params['spectral_k'] = int(self._get_optional_parameter(section, "spectral_k", "100"))
+        params['push_tol'] = float(self._get_optional_parameter(section, "push_tol", "1e-4"))
+        params['threshold'] = float(self._get_optional_parameter(section, "threshold", "1e-4"))
+        params['top_per_row'] = int(self._get_optional_parameter(section, "top_per_row", "0")) or None
         return params
 
     def experiment(self, extra_params):
@@ -68,12 +85,92 @@ class NormalizePrecomputeExperiment(Experiment):
                 self.log.info("Matrix already normalized")
                 normalized_matrix = matfile_content[mat_id]
 
-            self.log.info("Precomputing matrix")
-            precomputed_matrix = preprocessing.precompute_matrix(normalized_matrix)
-
             mat_id_precomputed = '{}_precomputed'.format(mat_id)
+            mat_id_ranked = '{}_ranked'.format(mat_id)
             matfile_content[mat_id] = normalized_matrix
-            matfile_content[mat_id_precomputed] = precomputed_matrix
+
+            solver = cfg_params['solver']
+            precomputed_file = cfg_params['precomputed_file']
+            matfile_dir = os.path.dirname(os.path.abspath(cfg_params['matfile']))
+
+            representation = cfg_params['representation']
+            representations.validate_representation(representation)
+
+            if representation != 'dense':
+                self.log.info("Building {} representation of precomputed matrix".format(representation))
+                precomputed_matrix = representations.build(
+                    normalized_matrix,
+                    representation,
+                    spectral_k=cfg_params['spectral_k'],
+                    push_tol=cfg_params['push_tol'],
+                    threshold=cfg_params['threshold'],
+                    top_per_row=cfg_params['top_per_row'],
+                    representation_file='{}_{}_{}.npy'.format(
+                        os.path.splitext(cfg_params['matfile'])[0], mat_id, representation),
+                    precompute_options={'block_size': cfg_params['block_size'],
+                                        'strategy': solver,
+                                        'n_jobs': cfg_params['n_jobs'],
+                                        'ordering': cfg_params['ordering'],
+                                        'precision': cfg_params['precision']})
+
+                report = representations.error_report(normalized_matrix,
+                                                      precomputed_matrix)
+                self.log.info("Error on {columns} sampled columns: max abs {max_abs_error:.3g}, "
+                              "relative {relative_error:.3g}, min column correlation "
+                              "{min_column_correlation:.4f}".format(**report))
+            elif precomputed_file:
+                self.log.info("Precomputing matrix to {}".format(precomputed_file))
+                if solver not in solvers.AVAILABLE_SOLVERS:
+                    solver = 'iterative'
+                precomputed_matrix = preprocessing.precompute_to_file(
+                    normalized_matrix,
+                    precomputed_file,
+                    block_size=cfg_params['block_size'],
+                    solver=solver,
+                    n_jobs=cfg_params['n_jobs'],
+                    log=self.log,
+                    ordering=cfg_params['ordering'],
+                    precision=cfg_params['precision'])
+            else:
+                self.log.info("Precomputing matrix")
+                # Used if the out of core strategy is chosen
+                precomputed_file = '{}_{}.npy'.format(
+                    os.path.splitext(cfg_params['matfile'])[0], mat_id_precomputed)
+                precomputed_matrix = planner.precompute(
+                    normalized_matrix,
+                    block_size=cfg_params['block_size'],
+                    n_jobs=cfg_params['n_jobs'],
+                    strategy=solver,
+                    filename=precomputed_file,
+                    ordering=cfg_params['ordering'],
+                    precision=cfg_params['precision'])
+
+            on_file = isinstance(precomputed_matrix, np.memmap)
+            for key in [mat_id_precomputed, mat_id_precomputed + '_file']:
+                matfile_content.pop(key, None)
+
+            if on_file:
+                matfile_content[mat_id_precomputed + '_file'] = os.path.relpath(
+                    os.path.abspath(precomputed_file), matfile_dir)
+            elif not representations.save(matfile_content, mat_id, precomputed_matrix,
+                                          matfile_dir):
+                matfile_content[mat_id_precomputed] = precomputed_matrix
+
+            if cfg_params['rank']:
+                self.log.info("Ranking precomputed matrix rows")
+                if on_file:
+                    ranked_file = '{}_ranked.npy'.format(os.path.splitext(precomputed_file)[0])
+                    ranked = np.lib.format.open_memmap(ranked_file, mode='w+',
+                                                       dtype='float32',
+                                                       shape=precomputed_matrix.shape)
+                    preprocessing.rank_rows(precomputed_matrix, out=ranked)
+                    del ranked
+                    matfile_content.pop(mat_id_ranked, None)
+                    matfile_content[mat_id_ranked + '_file'] = os.path.relpath(
+                        os.path.abspath(ranked_file), matfile_dir)
+                else:
+                    matfile_content.pop(mat_id_ranked + '_file', None)
+                    matfile_content[mat_id_ranked] = preprocessing.rank_rows(precomputed_matrix)
 
             self.log.info("Overwriting matrix file with precomputed and normalized matrices")
             sio.savemat(cfg_params['matfile'], matfile_content)
@@ -28,6 +28,7 @@ is required to use prophtools as prioritizer.
 from prophtools.utils.experiment import Experiment
 import prophtools.utils.preprocessing as preprocessing
 import scipy.io as sio
+import os
 import prophtools.utils.graphio as graphio
 
 class PreprocessXMLExperiment(Experiment):
@@ -47,6 +48,17 @@ class PreprocessXMLExperiment(Experiment):
         params['format'] = self.config.get(section, "format")
         params['data_path'] = self.config.get(section, "data_path")
         params['labels_as_ids'] = self.config.get(section, "labels_as_ids").lower() in ['true', '1', 'yes']
+        params['rank'] = self._get_optional_parameter(section, "rank", "False").lower() in ['true', '1', 'yes']
+        params['block_size'] = int(self._get_optional_parameter(section, "block_size", "256"))
+        params['solver'] = self._get_optional_parameter(section, "solver", "auto")
+        params['n_jobs'] = int(self._get_optional_parameter(section, "n_jobs", "1"))
+        params['ordering'] = self._get_optional_parameter(section, "ordering", "none")
+        params['precision'] = self._get_optional_parameter(section, "precision", "double")
+        params['representation'] = self._get_optional_parameter(section, "representation", "dense")
+        params['spectral_k'] = int(self._get_optional_parameter(section, "spectral_k", "100"))
+        params['push_tol'] = float(self._get_optional_parameter(section, "push_tol", "1e-4"))
+        params['threshold'] = float(self._get_optional_parameter(section, "threshold", "1e-4"))
+        params['top_per_row'] = int(self._get_optional_parameter(section, "top_per_row", "0")) or None
         return params
 
     def experiment(self, extra_params):
@@ -72,7 +84,25 @@ class PreprocessXMLExperiment(Experiment):
 
             self.log.info("Converting to ProphTools format")
 
-            converted = graphio.convert_to_graphdataset(graph, precompute=cfg_precompute, labels_as_ids=labels_as_ids)
+            # Out of core precomputed matrices are written next to the output
+            out_dir = os.path.dirname(os.path.abspath(os.path.join(path, outfile)))
+            precompute_options = {'block_size': cfg_params['block_size'],
+                                  'strategy': cfg_params['solver'],
+                                  'n_jobs': cfg_params['n_jobs'],
+                                  'ordering': cfg_params['ordering'],
+                                  'precision': cfg_params['precision'],
+                                  'directory': out_dir,
+                                  'representation': cfg_params['representation'],
+                                  'spectral_k': cfg_params['spectral_k'],
+                                  'push_tol': cfg_params['push_tol'],
+                                  'threshold': cfg_params['threshold'],
+                                  'top_per_row': cfg_params['top_per_row']}
+            converted = graphio.convert_to_graphdataset(graph, precompute=cfg_precompute, labels_as_ids=labels_as_ids, precompute_options=precompute_options)
+
+            if cfg_precompute and cfg_params['rank']:
+                self.log.info("Ranking precomputed matrix rows")
+                for n in converted.networks:
+                    n.ranked_precomputed()
 
             self.log.info("Writing mat file")
             converted.write(path, outfile)
@@ -60,6 +60,14 @@ Optional parameters:
     out          : Output csv file with the prioritization results (Default: none).
     memsave      : Run ProphTools in a memory save mode. This is recommended for
                    large networks. (Default: False).
+    pack_symmetric: In memory save mode, store symmetric precomputed matrices
+                   as their upper triangle: half the memory, slower scoring.
+                   (Default: False).
+    top_only     : Only rank the n results shown on screen (and saved to out).
+                   Propagation on a destination network without precomputed
+                   matrix stops as soon as they and their order cannot
+                   change, and whether they are certified or approximate is
+                   shown. (Default: False).
 
         """
         print(help_message)
@@ -84,8 +92,31 @@ Optional parameters:
         sorted_results = sorted(results, key=lambda x: x[0], reverse=True)
 
         return sorted_results
+
+    def _run_top_prioritizer(self, prioritizer, idx_query, origin, destination, n,
+                             corr_function="pearson", profile=False):
+        """
+        _run_prioritizer for the n best results only (see
+        ProphNet.propagate_top).
+
+        Returns:
+            [sorted_results, certified]
+        """
+        self._start_profiling()
+        [results, certified] = prioritizer.propagate_top(idx_query,
+                                                         origin,
+                                                         destination,
+                                                         n,
+                                                         corr_function)
+
+        stats = self._end_profiling()
+
+        if profile:
+            print stats
+
+        return [results, certified]
         
-    def _print_formatted_results(self, results, method, max_results):
+    def _print_formatted_results(self, results, method, max_results, certified=None):
         top_results = min(len(results), max_results)
         print "Entity\tScore"
         for i in range(top_results):
@@ -95,6 +126,12 @@ Optional parameters:
             result_str = '{}\t{:8.6f}'.format(result_entity.encode('utf-8'), result_score)
             print result_str
 
+        if certified is not None:
+            if certified:
+                print "Top {} certified: further iterations cannot change them or their order".format(top_results)
+            else:
+                print "Top {} approximate: some scores are too close to order within the error bound".format(top_results)
+
     def _save_to_file(self, out, results):
         fo = open(out, 'w')
         fo.write('Entity,Score\n')
@@ -118,6 +155,14 @@ Optional parameters:
         params['n'] = int(self.config.get(section, 'n'))
         params['memsave'] = self.config.get(section, 'memsave').lower() in ['yes','true','1']
         params['profile'] = self.config.get(section, 'profile').lower() in ['yes','true','1']
+        params['solver'] = self._get_optional_parameter(section, 'solver', 'iterative')
+        params['preconditioner'] = self._get_optional_parameter(section, 'preconditioner', 'none')
+        params['precision'] = self._get_optional_parameter(section, 'precision', 'double')
+        params['ordering'] = self._get_optional_parameter(section, 'ordering', 'none')
+        params['pack_symmetric'] = self._get_optional_parameter(
+            section, 'pack_symmetric', 'False').lower() in ['yes','true','1']
+        params['top_only'] = self._get_optional_parameter(
+            section, 'top_only', 'False').lower() in ['yes','true','1']
         return params
 
     def exit(self, prioritizer, memsave=False, exit_code=-1):
@@ -153,13 +198,17 @@ Optional parameters:
                 propagation_data = graphdata.GraphDataSet.read(
                     cfg_params['data_path'],
                     cfg_params['matfile'],
-                    memsave=cfg_params['memsave'])
+                    memsave=cfg_params['memsave'],
+                    pack_symmetric=cfg_params['pack_symmetric'])
             else:
                 msg = "Could not open matfile {}. Exiting.".format(matfile_path)
                 self.log.error(msg)
                 return -1
-            
-            prioritizer = method.ProphNet(propagation_data)
+
+            propagation_data.set_ordering(cfg_params['ordering'])
+            prioritizer = method.ProphNet(propagation_data, solver=cfg_params['solver'],
+                                          preconditioner=cfg_params['preconditioner'],
+                                          precision=cfg_params['precision'])
 
             try:
                 src_index = int(src_network)
@@ -208,13 +257,24 @@ Optional parameters:
 
             self.log.info("Prioritizing.")
 
-            sorted_results = self._run_prioritizer(prioritizer, query_vector,
-                                  src_index,
-                                  dst_index,
-                                  corr_function=cfg_params['corr_function'],
-                                  profile=cfg_params['profile'])
-
-            self._print_formatted_results(sorted_results, "prophnet", cfg_params['n'])
+            certified = None
+            if cfg_params['top_only']:
+                [sorted_results, certified] = self._run_top_prioritizer(
+                    prioritizer, query_vector,
+                    src_index,
+                    dst_index,
+                    cfg_params['n'],
+                    corr_function=cfg_params['corr_function'],
+                    profile=cfg_params['profile'])
+            else:
+                sorted_results = self._run_prioritizer(prioritizer, query_vector,
+                                      src_index,
+                                      dst_index,
+                                      corr_function=cfg_params['corr_function'],
+                                      profile=cfg_params['profile'])
+
+            self._print_formatted_results(sorted_results, "prophnet", cfg_params['n'],
+                                          certified)
 
             if cfg_params['out']:
                 self.log.info("Saving output to file {}".format(cfg_params['out']))
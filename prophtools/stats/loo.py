@@ -63,6 +63,12 @@ Optional parameters:
         
         result['memsave'] = self.config.get(section, 'memsave').lower() in ['yes','true','1']
         result['profile'] = self.config.get(section, 'profile').lower() in ['yes','true','1']
+        result['solver'] = self._get_optional_parameter(section, 'solver', 'iterative')
+        result['preconditioner'] = self._get_optional_parameter(section, 'preconditioner', 'none')
+        result['precision'] = self._get_optional_parameter(section, 'precision', 'double')
+        result['ordering'] = self._get_optional_parameter(section, 'ordering', 'none')
+        result['pack_symmetric'] = self._get_optional_parameter(
+            section, 'pack_symmetric', 'False').lower() in ['yes','true','1']
         return result
 
     def experiment(self, extra_params):
@@ -101,11 +107,15 @@ Optional parameters:
 
             network_data = graphdata.GraphDataSet.read(cfg_params['data_path'],
                                                        cfg_params['matfile'],
-                                                       memsave=cfg_params['memsave'])
+                                                       memsave=cfg_params['memsave'],
+                                                       pack_symmetric=cfg_params['pack_symmetric'])
 
             mode = cfg_params['mode']
 
-            prioritizer = method.ProphNet(network_data)
+            network_data.set_ordering(cfg_params['ordering'])
+            prioritizer = method.ProphNet(network_data, solver=cfg_params['solver'],
+                                          preconditioner=cfg_params['preconditioner'],
+                                          precision=cfg_params['precision'])
 
 
             try:
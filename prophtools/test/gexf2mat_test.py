@@ -79,6 +79,23 @@ out =
         
         self.assertEqual(result, 0)
 
+    @mock.patch.object(graphio, 'load_graph')
+    @mock.patch.object(graphio, 'convert_to_graphdataset')
+    @mock.patch.object(GraphDataSet, 'write')
+    def test_block_size_passed_to_precompute(self, mock_write, mock_convert, mock_load):
+        cfg_path = os.path.join(self.tempdir, self.configname)
+
+        exp = preprocessxml.PreprocessXMLExperiment(cfg_path, 'build_matrices', self.log, section_name='build_matrices')
+
+        parameters = ['--file', self.mock_file, '--out', 'test.mat', '--block_size', '16']
+        sys.stdout = StringIO.StringIO()
+        result = exp.run(parameters, self.configname)
+        os.remove('build_matrices.cfg')
+        sys.stdout = sys.__stdout__
+
+        options = mock_convert.call_args[1]['precompute_options']
+        self.assertEqual(options['block_size'], 16)
+        self.assertEqual(result, 0)
 
 
 if __name__ == '__main__':
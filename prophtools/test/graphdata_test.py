@@ -4,8 +4,11 @@ import unittest
 import numpy as np
 
 from prophtools.common.graphdata import EntityNet, RelationNet, GraphDataSet
-from prophtools.utils.preprocessing import precompute_matrix
+from prophtools.utils.preprocessing import precompute_matrix, normalize_matrix, push_precompute
+from prophtools.utils.preprocessing import row_statistics
+import prophtools.utils.representations as representations
 from scipy import sparse
+import os
 import shutil
 import tempfile
 import mock
@@ -87,6 +90,74 @@ class TestEntityNetFunctions(unittest.TestCase):
         type_after = type(a_from_raw.matrix)
         self.assertNotEqual(type_before, type_after)
 
+    def test_densify_keeps_sparse_precomputed(self):
+        a = EntityNet(sparse.csr_matrix(self.net_a), self.name, self.node_names,
+                      precomputed=sparse.csr_matrix(self.net_a_precomp))
+        a.densify()
+        self.assertFalse(sparse.issparse(a.matrix))
+        self.assertTrue(sparse.issparse(a.precomputed))
+
+    def test_component_labels_found_on_construction(self):
+        matrix = sparse.block_diag([self.net_a, np.zeros((1, 1))], format='csr')
+        a = EntityNet(matrix, self.name, self.node_names + ['isolated'])
+        self.assertEqual(list(a.component_labels), [0, 0, 1, 1, 0, 0, 0, -1])
+
+    def test_row_statistics_match_numpy(self):
+        a = EntityNet(self.net_a, self.name, self.node_names,
+                      precomputed=self.net_a_precomp)
+        [means, norms] = a.row_statistics()
+        precomp = np.asarray(self.net_a_precomp)
+        centered = precomp - precomp.mean(axis=1)[:, np.newaxis]
+
+        self.assertTrue(np.allclose(means, precomp.mean(axis=1)))
+        self.assertTrue(np.allclose(norms, np.linalg.norm(centered, axis=1)))
+
+    def test_row_statistics_without_precomputed_ordering_same_result(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_a))
+        expected = row_statistics(precompute_matrix(normalized))
+        for ordering in ['rcm', 'degree']:
+            for solver in ['iterative', 'factorized']:
+                a = EntityNet(normalized, self.name, self.node_names,
+                              ordering=ordering)
+                [means, norms] = a.row_statistics(solver)
+                self.assertTrue(np.allclose(means, expected[0]))
+                self.assertTrue(np.allclose(norms, expected[1]))
+
+    def test_set_ordering_keeps_original_matrix(self):
+        a = EntityNet(self.net_a, self.name, self.node_names)
+        self.assertTrue(a.ordered_matrix() is a.matrix)
+        a.set_ordering('rcm')
+        self.assertTrue(a.matrix is self.net_a)
+        ordered = a.ordered_matrix().toarray()
+        self.assertTrue(np.allclose(ordered, np.asarray(self.net_a)[a.permutation][:, a.permutation]))
+
+    def test_unknown_ordering_raises_exception(self):
+        with self.assertRaises(ValueError):
+            EntityNet(self.net_a, self.name, self.node_names, ordering='unknown')
+
+    def test_row_statistics_are_cached(self):
+        a = EntityNet(self.net_a, self.name, self.node_names,
+                      precomputed=self.net_a_precomp)
+        first = a.row_statistics()
+        with mock.patch('prophtools.utils.preprocessing.row_statistics') as m:
+            second = a.row_statistics()
+            m.assert_not_called()
+
+        self.assertTrue(first is second)
+
+    def test_ranked_precomputed_is_cached(self):
+        a = EntityNet(self.net_a, self.name, self.node_names,
+                      precomputed=self.net_a_precomp)
+        first = a.ranked_precomputed()
+        self.assertTrue(first is a.ranked_precomputed())
+        self.assertTrue(first is a.ranked)
+
+    def test_ranked_precomputed_memory_mapped_in_tmpdir(self):
+        a = EntityNet(self.net_a, self.name, self.node_names,
+                      precomputed=self.net_a_precomp, tmpdir=self.test_dir)
+        ranked = a.ranked_precomputed()
+        self.assertTrue(isinstance(ranked, np.memmap))
+
     def test_get_network_index(self):
         dataset = self._create_good_graphdataset()
         index = dataset.get_network_index('net_a')
@@ -266,6 +337,15 @@ class TestEntityNetFunctions(unittest.TestCase):
         self.assertEqual(dataset.relations[0].matrix.shape[1], self.rel_ab.shape[1])
 
 
+    def test_set_relation_matrix_invalidates_path_vectors(self):
+        dataset = self._create_good_graphdataset()
+        dataset.set_path_vector([1, 0], np.ones(7))
+        dataset.set_path_vector([1, 1], np.ones(6))
+        dataset.set_relation_matrix(0, 1, dataset.relations[0].matrix)
+
+        self.assertTrue(dataset.get_path_vector([1, 0]) is None)
+        self.assertTrue(dataset.get_path_vector([1, 1]) is not None)
+
     def test_read_write_consistency(self):
         matfile = 'testmat.mat'
         ent_a = EntityNet(self.net_a, "net_a", self.node_names, self.net_a_precomp)
@@ -281,6 +361,138 @@ class TestEntityNetFunctions(unittest.TestCase):
         self.assertEqual(len(new_dataset.relations), len(dataset.relations))
         self.assertEqual(new_dataset.connections.shape, dataset.connections.shape)
 
+    def test_read_write_keeps_ranked_matrices(self):
+        matfile = 'testmat.mat'
+        dataset = self._create_good_graphdataset()
+        ranked = dataset.networks[0].ranked_precomputed()
+        dataset.write(self.test_dir, matfile)
+
+        new_dataset = GraphDataSet.read(self.test_dir, matfile)
+        self.assertTrue(np.allclose(new_dataset.networks[0].ranked, ranked))
+        self.assertTrue(new_dataset.networks[1].ranked is None)
+
+    def test_read_write_keeps_alpha(self):
+        matfile = 'testmat.mat'
+        dataset = self._create_good_graphdataset()
+        dataset.networks[0].alpha = 0.8
+        dataset.write(self.test_dir, matfile)
+
+        new_dataset = GraphDataSet.read(self.test_dir, matfile)
+        self.assertEqual(new_dataset.networks[0].alpha, 0.8)
+        self.assertEqual(new_dataset.networks[1].alpha, 0.9)
+
+    def test_read_write_without_precomputed_keeps_row_statistics(self):
+        matfile = 'testmat.mat'
+        dataset = self._create_good_graphdataset()
+        dataset.networks[1].precomputed = None
+        [means, norms] = dataset.networks[1].row_statistics()
+        dataset.write(self.test_dir, matfile)
+
+        new_dataset = GraphDataSet.read(self.test_dir, matfile, memsave=True)
+        net = new_dataset.networks[1]
+        self.assertTrue(net.precomputed is None)
+        self.assertTrue(np.allclose(net.row_statistics()[0], means))
+        self.assertTrue(np.allclose(net.row_statistics()[1], norms))
+        new_dataset.cleanup_resources()
+
+    def test_set_alpha_dense_precomputed_raises_exception(self):
+        dataset = self._create_good_graphdataset()
+        with self.assertRaises(ValueError):
+            dataset.networks[0].set_alpha(0.5)
+
+    def test_read_write_spectral_precomputed(self):
+        matfile = 'testmat.mat'
+        dataset = self._create_good_graphdataset()
+        spectral = representations.spectral_precompute(normalize_matrix(self.net_a), k=3)
+        dataset.networks[0].precomputed = spectral
+        dataset.write(self.test_dir, matfile)
+
+        for memsave in [False, True]:
+            new_dataset = GraphDataSet.read(self.test_dir, matfile, memsave=memsave)
+            precomputed = new_dataset.networks[0].precomputed
+            self.assertTrue(isinstance(precomputed, representations.SpectralPrecomputed))
+            self.assertTrue(np.allclose(precomputed[0:7], spectral[0:7]))
+            new_dataset.networks[0].set_alpha(0.5)
+            self.assertEqual(new_dataset.networks[0].precomputed.alpha, 0.5)
+            new_dataset.cleanup_resources()
+
+    def test_read_write_sparse_precomputed(self):
+        matfile = 'testmat.mat'
+        dataset = self._create_good_graphdataset()
+        pushed = push_precompute(normalize_matrix(sparse.csr_matrix(self.net_a)))
+        dataset.networks[0].precomputed = pushed
+        dataset.write(self.test_dir, matfile)
+
+        for memsave in [False, True]:
+            new_dataset = GraphDataSet.read(self.test_dir, matfile, memsave=memsave)
+            precomputed = new_dataset.networks[0].precomputed
+            self.assertTrue(sparse.isspmatrix_csr(precomputed))
+            self.assertTrue(np.allclose(precomputed.toarray(), pushed.toarray()))
+            new_dataset.cleanup_resources()
+
+    def test_read_write_quantized_precomputed_file(self):
+        matfile = 'testmat.mat'
+        dataset = self._create_good_graphdataset()
+        quantized = representations.quantize(
+            self.net_a_precomp, 'uint8', os.path.join(self.test_dir, 'net_a_quantized.npy'))
+        dataset.networks[0].precomputed = quantized
+        dataset.write(self.test_dir, matfile)
+        del quantized
+
+        new_dataset = GraphDataSet.read(self.test_dir, matfile)
+        precomputed = new_dataset.networks[0].precomputed
+        self.assertTrue(isinstance(precomputed.values, np.memmap))
+        self.assertTrue(np.allclose(precomputed[0:7], self.net_a_precomp, atol=0.01))
+        del precomputed, new_dataset
+
+    def test_read_memsave_keeps_full_precomputed(self):
+        matfile = 'testmat.mat'
+        dataset = self._create_good_graphdataset()
+        dataset.write(self.test_dir, matfile)
+
+        new_dataset = GraphDataSet.read(self.test_dir, matfile, memsave=True)
+        for net in new_dataset.networks:
+            self.assertTrue(isinstance(net.precomputed, np.memmap))
+            self.assertEqual(net.precomputed.dtype, np.float32)
+        self.assertTrue(np.allclose(new_dataset.networks[0].precomputed[0:7],
+                                    self.net_a_precomp))
+        new_dataset.cleanup_resources()
+
+    def test_read_memsave_packs_symmetric_precomputed(self):
+        matfile = 'testmat.mat'
+        dataset = self._create_good_graphdataset()
+        dataset.write(self.test_dir, matfile)
+
+        new_dataset = GraphDataSet.read(self.test_dir, matfile, memsave=True,
+                                        pack_symmetric=True)
+        [net_a, net_b] = new_dataset.networks
+        self.assertTrue(isinstance(net_a.precomputed, representations.PackedPrecomputed))
+        self.assertTrue(np.allclose(net_a.precomputed[0:7], self.net_a_precomp))
+        # Not symmetric: stored in full
+        self.assertTrue(isinstance(net_b.precomputed, np.memmap))
+
+        new_dataset.write(self.test_dir, 'packed.mat')
+        packed_dataset = GraphDataSet.read(self.test_dir, 'packed.mat')
+        self.assertTrue(np.allclose(packed_dataset.networks[0].precomputed[0:7],
+                                    self.net_a_precomp))
+        new_dataset.cleanup_resources()
+
+    def test_read_memory_maps_precomputed_npy_files(self):
+        matfile = 'testmat.mat'
+        filename = os.path.join(self.test_dir, 'net_a_precomputed.npy')
+        np.save(filename, np.asarray(self.net_a_precomp))
+        dataset = self._create_good_graphdataset()
+        dataset.networks[0].precomputed = np.load(filename, mmap_mode='r')
+        dataset.write(self.test_dir, matfile)
+
+        for memsave in [False, True]:
+            new_dataset = GraphDataSet.read(self.test_dir, matfile, memsave=memsave)
+            precomputed = new_dataset.networks[0].precomputed
+            self.assertTrue(isinstance(precomputed, np.memmap))
+            self.assertEqual(precomputed.filename, os.path.abspath(filename))
+            self.assertTrue(np.allclose(precomputed, self.net_a_precomp))
+            new_dataset.cleanup_resources()
+
     def test_graphdataset_densify_generates_dense_matrices(self):
         ent_a = EntityNet(self.net_a, "net_a", self.node_names, self.net_a_precomp)
         ent_b = EntityNet(self.net_b, "net_b", self.node_names_b, self.net_b_precomp)
@@ -76,7 +76,8 @@ profile = False
         sys.stderr = sys.__stderr__
         sys.stdout = sys.__stdout__
 
-        mock_read.assert_called_with('.', matfile, memsave=False)
+        mock_read.assert_called_with('.', matfile, memsave=False,
+                                     pack_symmetric=False)
         mock_run_cross_validation.assert_called_with(0,
                                                      1,
                                                      fold=5,
@@ -4,8 +4,16 @@ import unittest
 import networkx as nx
 import numpy as np
 import os
-from prophtools.common.method import ProphNet
+import mock
+import math
+from scipy import sparse
+from prophtools.common.method import ProphNet, RWR, multi_alpha_RWR
+from prophtools.common.method import top_k_RWR, top_slack
 from prophtools.common.graphdata import GraphDataSet
+import prophtools.utils.preprocessing as preprocessing
+import prophtools.utils.representations as representations
+import prophtools.utils.solvers as solvers
+from scipy.stats import pearsonr, spearmanr
 
 
 class TestProphNetFunctions(unittest.TestCase):
@@ -15,6 +23,7 @@ class TestProphNetFunctions(unittest.TestCase):
     def load_test_data(self):
         script_dir = os.path.dirname(__file__)
         absolute_path = os.path.join(script_dir, '../matfiles/')
+        self.matfile_path = absolute_path
         self.sample_data = GraphDataSet.read(absolute_path, 'example.mat')
         self.sample_data_memsave = GraphDataSet.read(absolute_path, 'example.mat', memsave=True)
 
@@ -161,6 +170,552 @@ class TestProphNetFunctions(unittest.TestCase):
         result = self._across_network_propagation_dst_names_test(self.prophnet_memsave, [1], 0, 2)
         self.assertTrue(result)
 
+    def _correlation_scores(self, method, corr_function, src, dst, query):
+        query_vector = method.generate_query_vector(query, src)
+        initial_score = method.graphdata.networks[src].precomputed.dot(query_vector)
+        vectors = np.reshape(initial_score, (-1, 1)).tolist()
+        network = method.graphdata.networks[dst].matrix
+        return method.compute_correlation_scores(network, vectors, None,
+                                                 dst, 1, corr_function)
+
+    def test_vectorized_pearson_matches_pearsonr(self):
+        row_pearson = lambda a, b: pearsonr(a, b)
+        for q in [[1], [2, 4]]:
+            expected = self._correlation_scores(self.prophnet, row_pearson, 0, 0, q)
+            result = self._correlation_scores(self.prophnet, pearsonr, 0, 0, q)
+            self.assertTrue(np.allclose(expected, result))
+
+    def test_vectorized_pearson_matches_pearsonr_memsave(self):
+        row_pearson = lambda a, b: pearsonr(a, b)
+        expected = self._correlation_scores(self.prophnet_memsave, row_pearson, 0, 0, [3])
+        result = self._correlation_scores(self.prophnet_memsave, pearsonr, 0, 0, [3])
+        self.assertTrue(np.allclose(expected, result, atol=1e-5))
+
+    def test_vectorized_pearson_matches_pearsonr_several_paths(self):
+        scores = self.prophnet.propagate([1], 0, 2)
+        self.assertEqual(len(ProphNet.find_all_paths(
+            nx.from_numpy_matrix(self.sample_data.super_adjacency), 0, 2)), 2)
+        row_pearson = lambda a, b: pearsonr(a, b)
+        expected = self.prophnet._multiple_propagation(
+            [1], 0, 2,
+            network_list=[n.matrix for n in self.sample_data.networks],
+            corr_function=row_pearson)
+
+        self.assertTrue(np.allclose(expected, [s[0] for s in scores]))
+
+    def test_vectorized_spearman_matches_spearmanr(self):
+        row_spearman = lambda a, b: spearmanr(a, b)
+        for q in [[1], [2, 4]]:
+            expected = self._correlation_scores(self.prophnet, row_spearman, 0, 0, q)
+            result = self._correlation_scores(self.prophnet, spearmanr, 0, 0, q)
+            self.assertTrue(np.allclose(expected, result))
+
+    def test_vectorized_spearman_matches_spearmanr_several_paths(self):
+        scores = self.prophnet.propagate([1], 0, 2, corr_function="spearman")
+        row_spearman = lambda a, b: spearmanr(a, b)
+        expected = self.prophnet._multiple_propagation(
+            [1], 0, 2,
+            network_list=[n.matrix for n in self.sample_data.networks],
+            corr_function=row_spearman)
+
+        self.assertTrue(np.allclose(expected, [s[0] for s in scores]))
+
+    def test_spearman_memsave_ranks_into_memmap(self):
+        self.prophnet_memsave.propagate([1], 0, 0, corr_function="spearman")
+        ranked = self.prophnet_memsave.graphdata.networks[0].ranked
+        self.assertTrue(isinstance(ranked, np.memmap))
+
+    def test_block_rwr_matches_single_query_rwr(self):
+        network = self.sample_data.networks[0].matrix
+        queries = [[1], [3, 7], [0, 2, 5]]
+        query_matrix = self.prophnet.generate_query_matrix(queries, 0)
+        result = RWR(query_matrix, network)
+
+        self.assertEqual(result.shape, query_matrix.shape)
+        for j, q in enumerate(queries):
+            expected = RWR(self.prophnet.generate_query_vector(q, 0), network)
+            self.assertTrue(np.allclose(result[:, j], expected))
+
+    def _batch_matches_single_queries(self, method, src, dst, corr_function):
+        queries = [[1], [3, 7], [0, 2, 5]]
+        query_matrix = method.generate_query_matrix(queries, src)
+        scores = method.propagate(query_matrix, src, dst, corr_function)
+
+        n_dst = method.graphdata.networks[dst].matrix.shape[0]
+        self.assertEqual(scores.shape, (n_dst, len(queries)))
+        for j, q in enumerate(queries):
+            expected = [s[0] for s in method.propagate(q, src, dst, corr_function)]
+            self.assertTrue(np.allclose(scores[:, j], expected))
+
+    def test_batch_propagation_matches_single_queries_within_network(self):
+        self._batch_matches_single_queries(self.prophnet, 0, 0, "pearson")
+        self._batch_matches_single_queries(self.prophnet, 0, 0, "spearman")
+
+    def test_batch_propagation_matches_single_queries_across_networks(self):
+        for (src, dst) in [(0, 1), (1, 0), (0, 2)]:
+            self._batch_matches_single_queries(self.prophnet, src, dst, "pearson")
+            self._batch_matches_single_queries(self.prophnet, src, dst, "spearman")
+
+    def test_batch_propagation_memsave(self):
+        self._batch_matches_single_queries(self.prophnet_memsave, 0, 2, "pearson")
+
+    def test_query_matrix_wrong_rows_raises_exception(self):
+        query_matrix = self.prophnet.generate_query_matrix([[1]], 1)
+        with self.assertRaises(ValueError):
+            self.prophnet.propagate(query_matrix, 0, 1)
+
+    def test_propagate_from_precomputed_matches_rwr(self):
+        network = self.sample_data.networks[1].matrix
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 1)
+        expected = RWR(query_matrix, network)
+        result = self.prophnet._propagate_from_precomputed(query_matrix, 1)
+        self.assertTrue(np.allclose(expected, result))
+
+    def test_propagate_from_precomputed_memsave_returns_none(self):
+        # Single precision precomputed matrices are not exact
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 0)
+        result = self.prophnet_memsave._propagate_from_precomputed(query_matrix, 0)
+        self.assertTrue(result is None)
+
+    def test_propagate_from_approximate_precomputed_returns_none(self):
+        net = self.sample_data.networks[0]
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 0)
+        expected = RWR(query_matrix, net.matrix)
+        exact = net.precomputed
+        for approximate in [representations.quantize(exact, 'uint8'),
+                            representations.quantize(exact, 'float16'),
+                            preprocessing.sparsify(exact, 1e-4),
+                            representations.spectral_precompute(net.matrix, k=5)]:
+            net.precomputed = approximate
+            self.assertTrue(self.prophnet._propagate_from_precomputed(query_matrix, 0) is None)
+            result = self.prophnet._within_network_propagation(query_matrix, 0)
+            self.assertTrue(np.allclose(expected, result))
+
+        for exact_representation in [representations.pack_symmetric(exact),
+                                     representations.components_precompute(net.matrix)]:
+            net.precomputed = exact_representation
+            result = self.prophnet._propagate_from_precomputed(query_matrix, 0)
+            self.assertTrue(np.allclose(expected, result))
+
+    @mock.patch('prophtools.utils.solvers.power_iteration',
+                wraps=solvers.power_iteration)
+    def test_source_propagation_uses_precomputed(self, mock_power_iteration):
+        self.prophnet.propagate([1], 0, 1)
+        # Only the intermediate network of the second path is iterated
+        source_shape = self.sample_data.networks[0].matrix.shape
+        for call in mock_power_iteration.call_args_list:
+            self.assertNotEqual(call[0][0].shape, source_shape)
+
+    def test_propagate_from_precomputed_other_alpha_returns_none(self):
+        self.sample_data.networks[0].alpha = 0.5
+        query_matrix = self.prophnet.generate_query_matrix([[1]], 0)
+        result = self.prophnet._propagate_from_precomputed(query_matrix, 0)
+        self.assertTrue(result is None)
+
+    def test_unknown_solver_raises_exception(self):
+        with self.assertRaises(ValueError):
+            ProphNet(self.sample_data, solver="unknown")
+
+    def test_factorized_solver_matches_rwr(self):
+        prioritizer = ProphNet(self.sample_data, solver="factorized")
+        query_matrix = prioritizer.generate_query_matrix([[1], [3, 7]], 1)
+        expected = RWR(query_matrix, self.sample_data.networks[1].matrix)
+        result = prioritizer._rwr(query_matrix, 1)
+        self.assertTrue(np.allclose(expected, result))
+
+    def test_factorized_solver_same_results(self):
+        self.sample_data.networks[0].alpha = 0.5
+        prioritizer = ProphNet(self.sample_data, solver="factorized")
+        for src, dst in [(0, 0), (0, 2), (2, 0)]:
+            expected = [s[0] for s in self.prophnet.propagate([1], src, dst)]
+            result = [s[0] for s in prioritizer.propagate([1], src, dst)]
+            self.assertTrue(np.allclose(expected, result))
+
+    def test_krylov_rwr_matches_power(self):
+        matrix = self.sample_data.networks[1].matrix
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 1)
+        expected = RWR(query_matrix, matrix)
+        for method, preconditioner in [("cg", "none"), ("cg", "jacobi"),
+                                       ("bicgstab", "none"), ("bicgstab", "ilu")]:
+            result = RWR(query_matrix, matrix, method=method,
+                         preconditioner=preconditioner)
+            self.assertTrue(np.allclose(expected, result))
+
+            result = RWR(np.asarray(query_matrix)[:, 0], matrix, method=method,
+                         preconditioner=preconditioner)
+            self.assertTrue(np.allclose(np.asarray(expected)[:, 0], result))
+
+    def test_rwr_warm_start_same_result(self):
+        matrix = self.sample_data.networks[1].matrix
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 1)
+        guess = RWR(query_matrix, matrix, alpha=0.8)
+        expected = RWR(query_matrix, matrix)
+        for method in ["power", "cg", "bicgstab"]:
+            result = RWR(query_matrix, matrix, method=method, x0=guess)
+            self.assertTrue(np.allclose(expected, result))
+
+    def test_rwr_block_same_as_single_queries(self):
+        matrix = self.sample_data.networks[1].matrix
+        query_matrix = np.asarray(self.prophnet.generate_query_matrix([[1], [3, 7]], 1))
+        result = RWR(query_matrix, matrix)
+        for j in range(query_matrix.shape[1]):
+            self.assertTrue(np.array_equal(result[:, j], RWR(query_matrix[:, j], matrix)))
+
+    def test_rwr_returns_convergence_info(self):
+        matrix = self.sample_data.networks[1].matrix
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 1)
+        for method in ["power", "cg", "bicgstab"]:
+            [result, iterations, residuals] = RWR(query_matrix, matrix, method=method,
+                                                  return_info=True)
+            self.assertTrue(np.allclose(result, RWR(query_matrix, matrix)))
+            self.assertEqual(len(iterations), 2)
+            self.assertTrue(np.all(iterations > 0))
+            self.assertTrue(np.all(residuals < 1e-8))
+
+        [_, iterations, residuals] = RWR(query_matrix, matrix, maxiter=3,
+                                         return_info=True)
+        self.assertTrue(np.all(iterations == 3))
+        self.assertTrue(np.all(residuals > 1e-9))
+
+    def test_rwr_mixed_precision_same_results(self):
+        matrix = self.sample_data.networks[1].matrix
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 1)
+        expected = RWR(query_matrix, matrix)
+        [result, iterations, residuals] = RWR(query_matrix, matrix, precision="mixed",
+                                              return_info=True)
+        self.assertTrue(np.allclose(expected, result, rtol=0, atol=1e-8))
+        self.assertTrue(np.all(residuals < 1e-9))
+        self.assertTrue(np.all(iterations > 0))
+
+        single = RWR(np.asarray(query_matrix)[:, 1], matrix, precision="mixed")
+        self.assertTrue(np.allclose(np.asarray(expected)[:, 1], single, rtol=0, atol=1e-8))
+
+    def test_mixed_precision_only_for_power_iteration(self):
+        with self.assertRaises(ValueError):
+            RWR(np.ones(3), np.identity(3), method="cg", precision="mixed")
+
+        with self.assertRaises(ValueError):
+            ProphNet(self.sample_data, solver="factorized", precision="mixed")
+
+    def test_mixed_precision_prioritizer_same_results(self):
+        queries = [[1], [3, 7]]
+        for src, dst in [(0, 0), (0, 2), (2, 1)]:
+            query_matrix = self.prophnet.generate_query_matrix(queries, src)
+            expected = self.prophnet.propagate(query_matrix, src, dst)
+
+            self.load_test_data()
+            self._drop_precomputed(dst)
+            prioritizer = ProphNet(self.sample_data, precision="mixed")
+            result = prioritizer.propagate(query_matrix, src, dst)
+            self.assertTrue(np.allclose(expected, result, atol=1e-6))
+
+            self.load_test_data()
+
+    def test_multi_alpha_rwr_same_results(self):
+        matrix = self.sample_data.networks[1].matrix
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 1)
+        alphas = [0.5, 0.9, 0.0, 0.8]
+        [result, iterations, residuals] = multi_alpha_RWR(query_matrix, matrix, alphas,
+                                                          return_info=True)
+        self.assertEqual(result.shape, (4,) + query_matrix.shape)
+        for i, alpha in enumerate(alphas):
+            [expected, expected_iterations, _] = RWR(query_matrix, matrix, alpha,
+                                                     return_info=True)
+            self.assertTrue(np.allclose(expected, result[i], rtol=0, atol=1e-12))
+            self.assertTrue(np.array_equal(expected_iterations, iterations[i]))
+        self.assertTrue(np.all(residuals < 1e-9))
+
+        single = multi_alpha_RWR(np.asarray(query_matrix)[:, 1], matrix, alphas)
+        self.assertTrue(np.allclose(result[:, :, 1], single))
+
+    def test_multi_alpha_rwr_invalid_alpha_raises_exception(self):
+        for alphas in [[], [0.9, 1.0], [-0.1]]:
+            with self.assertRaises(ValueError):
+                multi_alpha_RWR(np.ones(3), np.identity(3), alphas)
+
+    def test_top_k_rwr_certified_top(self):
+        matrix = self.sample_data.networks[0].matrix
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 0)
+        exact = 0.1 * np.linalg.solve(np.identity(matrix.shape[0]) - 0.9 * matrix.toarray(),
+                                      query_matrix)
+        [_, full_iterations, _] = RWR(query_matrix, matrix, return_info=True)
+        [result, top, certified, iterations] = top_k_RWR(query_matrix, matrix, 5,
+                                                         return_info=True)
+        self.assertTrue(np.all(certified))
+        self.assertTrue(np.all(iterations <= full_iterations))
+        for j in range(2):
+            expected = np.argsort(-exact[:, j], kind='mergesort')[:5]
+            self.assertTrue(np.array_equal(expected, top[:, j]))
+
+        [_, single_top, single_certified] = top_k_RWR(query_matrix[:, 1], matrix, 5)
+        self.assertTrue(single_certified)
+        self.assertTrue(np.array_equal(top[:, 1], single_top))
+
+    def test_top_k_rwr_ties_are_approximate(self):
+        matrix = np.ones((5, 5)) / 5.0
+        [result, top, certified] = top_k_RWR(np.ones(5) / 5.0, matrix, 3)
+        self.assertFalse(certified)
+        self.assertTrue(np.array_equal(top, [0, 1, 2]))
+        self.assertTrue(np.allclose(result, RWR(np.ones(5) / 5.0, matrix)))
+
+    def test_top_slack(self):
+        scores = np.array([0.1, 0.5, -np.inf, 0.3, 0.2])
+        [top, slack] = top_slack(scores, np.zeros(5) + 0.01, 2)
+        self.assertTrue(np.array_equal(top, [1, 3]))
+        self.assertTrue(np.allclose(slack, 5.0))
+
+        [top, slack] = top_slack(scores, np.zeros(5) + 0.06, 2)
+        self.assertTrue(np.array_equal(top, [1, 3]))
+        self.assertTrue(slack < 1)
+
+        [top, slack] = top_slack(scores, np.zeros(5), 10)
+        self.assertTrue(np.array_equal(top, [1, 3, 4, 0]))
+        self.assertTrue(slack > 1)
+
+        [top, slack] = top_slack(np.array([0.5, 0.3, 0.5]), np.zeros(3), 2)
+        self.assertTrue(np.array_equal(top, [0, 2]))
+        self.assertEqual(slack, 0)
+
+    def test_propagate_top_same_results(self):
+        for src, dst in [(0, 0), (0, 2), (2, 1)]:
+            expected = sorted(self.prophnet.propagate([1, 3], src, dst),
+                              key=lambda x: x[0], reverse=True)[:5]
+            [results, certified] = self.prophnet.propagate_top([1, 3], src, dst, 5)
+            self.assertTrue(certified)
+            self.assertEqual([r[1] for r in expected], [r[1] for r in results])
+
+            self._drop_precomputed(dst)
+            [results, certified] = self.prophnet.propagate_top([1, 3], src, dst, 5)
+            self.assertTrue(certified)
+            self.assertEqual([r[1] for r in expected], [r[1] for r in results])
+            self.assertTrue(np.allclose([r[0] for r in expected], [r[0] for r in results],
+                                        atol=1e-4))
+
+            self.load_test_data()
+
+    def test_propagate_top_query_matrix_raises_exception(self):
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 0)
+        with self.assertRaises(ValueError):
+            self.prophnet.propagate_top(query_matrix, 0, 1, 5)
+
+    def test_rwr_unknown_method_raises_exception(self):
+        with self.assertRaises(ValueError):
+            RWR(np.ones(3), np.identity(3), method="unknown")
+
+    def test_krylov_solvers_same_results(self):
+        queries = [[1], [3, 7]]
+        for src, dst in [(0, 0), (0, 2), (2, 1)]:
+            query_matrix = self.prophnet.generate_query_matrix(queries, src)
+            expected = self.prophnet.propagate(query_matrix, src, dst)
+
+            self.load_test_data()
+            self._drop_precomputed(dst)
+            for solver, preconditioner in [("cg", "jacobi"), ("bicgstab", "ilu")]:
+                prioritizer = ProphNet(self.sample_data, solver=solver,
+                                       preconditioner=preconditioner)
+                result = prioritizer.propagate(query_matrix, src, dst)
+                self.assertTrue(np.allclose(expected, result, atol=1e-6))
+
+            self.load_test_data()
+
+    def test_unknown_preconditioner_raises_exception(self):
+        with self.assertRaises(ValueError):
+            ProphNet(self.sample_data, solver="cg", preconditioner="unknown")
+
+        with self.assertRaises(ValueError):
+            ProphNet(self.sample_data, solver="cg", preconditioner="ilu")
+
+    def test_preconditioner_is_cached(self):
+        net = self.sample_data.networks[0]
+        self.assertTrue(net.preconditioner("ilu", 0.9) is net.preconditioner("ilu", 0.9))
+        self.assertTrue(net.preconditioner("none", 0.9) is None)
+
+    def test_factorization_is_cached_per_alpha(self):
+        net = self.sample_data.networks[0]
+        self.assertTrue(net.factorization(0.9) is net.factorization(0.9))
+        self.assertTrue(net.factorization(0.9) is not net.factorization(0.5))
+
+    def test_ordering_same_results(self):
+        queries = [[1], [3, 7]]
+        for src, dst in [(0, 0), (0, 2), (2, 1)]:
+            query_matrix = self.prophnet.generate_query_matrix(queries, src)
+            expected = self.prophnet.propagate(query_matrix, src, dst)
+
+            for ordering in ["rcm", "degree"]:
+                for solver in ["iterative", "factorized"]:
+                    self.load_test_data()
+                    self._drop_precomputed(dst)
+                    self.sample_data.set_ordering(ordering)
+                    prioritizer = ProphNet(self.sample_data, solver=solver)
+                    result = prioritizer.propagate(query_matrix, src, dst)
+                    self.assertTrue(np.allclose(expected, result, atol=1e-6))
+
+            self.load_test_data()
+
+    def test_ordering_rwr_in_original_order(self):
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 1)
+        expected = RWR(query_matrix, self.sample_data.networks[1].matrix)
+        self.sample_data.set_ordering("rcm")
+        for solver in ["iterative", "factorized"]:
+            prioritizer = ProphNet(self.sample_data, solver=solver)
+            result = prioritizer._rwr(query_matrix, 1)
+            self.assertTrue(np.allclose(expected, result))
+
+    def _drop_precomputed(self, network_index):
+        net = self.sample_data.networks[network_index]
+        net.precomputed = None
+        net._row_statistics = None
+
+    def test_pearson_without_precomputed_matches_precomputed(self):
+        queries = [[1], [3, 7]]
+        for src, dst in [(0, 0), (0, 2), (2, 1)]:
+            query_matrix = self.prophnet.generate_query_matrix(queries, src)
+            expected = self.prophnet.propagate(query_matrix, src, dst)
+
+            self.load_test_data()
+            self._drop_precomputed(dst)
+            for solver in ["iterative", "factorized"]:
+                prioritizer = ProphNet(self.sample_data, solver=solver)
+                result = prioritizer.propagate(query_matrix, src, dst)
+                self.assertTrue(np.allclose(expected, result, atol=1e-6))
+
+            self.load_test_data()
+
+    def test_spearman_without_precomputed_raises_exception(self):
+        self._drop_precomputed(1)
+        with self.assertRaises(NotImplementedError):
+            self.prophnet.propagate([1], 0, 1, corr_function="spearman")
+
+    def test_spectral_precomputed_same_results(self):
+        queries = [[1], [3, 7]]
+        for src, dst in [(0, 0), (0, 2), (2, 1)]:
+            query_matrix = self.prophnet.generate_query_matrix(queries, src)
+            for corr_function in ["pearson", "spearman"]:
+                expected = self.prophnet.propagate(query_matrix, src, dst, corr_function)
+
+                dataset = GraphDataSet.read(self.matfile_path, 'example.mat')
+                for net in dataset.networks:
+                    net.precomputed = representations.spectral_precompute(
+                        net.matrix, k=net.matrix.shape[0])
+                result = ProphNet(dataset).propagate(query_matrix, src, dst, corr_function)
+                self.assertTrue(np.allclose(expected, result, atol=1e-6))
+
+    def test_push_precomputed_same_results(self):
+        queries = [[1], [3, 7]]
+        for src, dst in [(0, 0), (0, 2), (2, 1)]:
+            query_matrix = self.prophnet.generate_query_matrix(queries, src)
+            for corr_function in ["pearson", "spearman"]:
+                expected = self.prophnet.propagate(query_matrix, src, dst, corr_function)
+
+                dataset = GraphDataSet.read(self.matfile_path, 'example.mat')
+                for net in dataset.networks:
+                    net.precomputed = preprocessing.push_precompute(net.matrix, tol=1e-10)
+                result = ProphNet(dataset).propagate(query_matrix, src, dst, corr_function)
+                self.assertTrue(np.allclose(expected, result, atol=1e-6))
+
+    def test_quantized_precomputed_close_results(self):
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 0)
+        for dst in [0, 2]:
+            expected = self.prophnet.propagate(query_matrix, 0, dst, "pearson")
+            for dtype in representations.QUANTIZED_TYPES:
+                dataset = GraphDataSet.read(self.matfile_path, 'example.mat')
+                for net in dataset.networks:
+                    net.precomputed = representations.quantize(net.precomputed, dtype)
+                result = ProphNet(dataset).propagate(query_matrix, 0, dst, "pearson")
+                self.assertTrue(np.allclose(expected, result, atol=1e-2))
+
+    def test_packed_precomputed_same_results(self):
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 0)
+        for dst in [0, 2]:
+            for corr_function in ["pearson", "spearman"]:
+                expected = self.prophnet.propagate(query_matrix, 0, dst, corr_function)
+                dataset = GraphDataSet.read(self.matfile_path, 'example.mat')
+                for net in dataset.networks:
+                    net.precomputed = representations.pack_symmetric(net.precomputed)
+                result = ProphNet(dataset).propagate(query_matrix, 0, dst, corr_function)
+                self.assertTrue(np.allclose(expected, result))
+
+    def test_components_precomputed_same_results(self):
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 0)
+        for dst in [0, 2]:
+            for corr_function in ["pearson", "spearman"]:
+                expected = self.prophnet.propagate(query_matrix, 0, dst, corr_function)
+                dataset = GraphDataSet.read(self.matfile_path, 'example.mat')
+                for net in dataset.networks:
+                    net.precomputed = representations.components_precompute(net.matrix)
+                result = ProphNet(dataset).propagate(query_matrix, 0, dst, corr_function)
+                self.assertTrue(np.allclose(expected, result))
+
+    def test_spectral_precomputed_other_alpha(self):
+        net = self.sample_data.networks[0]
+        net.precomputed = representations.spectral_precompute(net.matrix, k=net.matrix.shape[0])
+        net.set_alpha(0.5)
+        query_matrix = self.prophnet.generate_query_matrix([[1], [3, 7]], 0)
+        expected = RWR(query_matrix, net.matrix)
+        self.assertTrue(self.prophnet._propagate_from_precomputed(query_matrix, 0) is None)
+        result = self.prophnet._within_network_propagation(query_matrix, 0)
+        self.assertTrue(np.allclose(expected, result))
+
+    def test_intermediate_path_vectors_are_cached(self):
+        first = self.prophnet.propagate([1], 0, 2)
+        self.assertTrue(self.sample_data.get_path_vector([0, 1]) is not None)
+
+        with mock.patch.object(ProphNet, '_intermediate_path_scores') as m:
+            second = self.prophnet.propagate([1], 0, 2)
+            m.assert_not_called()
+
+        self.assertTrue(np.allclose([s[0] for s in first], [s[0] for s in second]))
+
+    def test_intermediate_path_vectors_recomputed_after_relation_change(self):
+        self.prophnet.propagate([1], 0, 2)
+        relation = self.sample_data.get_connection(0, 1).matrix
+        self.sample_data.set_relation_matrix(0, 1, relation)
+        self.assertTrue(self.sample_data.get_path_vector([0, 1]) is None)
+
+    def _column_by_column_scores(self, network, connection):
+        tmp_scores = np.zeros(network.shape[0])
+        for j in range(network.shape[0]):
+            column = connection[:, j]
+            if column.getnnz() > 0:
+                tmp_scores[j] = column.sum()/float(column.getnnz())
+
+        sorted_indices = np.argsort(tmp_scores)[::-1]
+        sorted_tmp_scores = tmp_scores[sorted_indices]
+        threshold_index = int(math.ceil(0.00375*tmp_scores.shape[0]))
+        sorted_tmp_scores[threshold_index:tmp_scores.shape[0]] = 0.0
+        tmp_scores[sorted_indices] = sorted_tmp_scores
+
+        return tmp_scores/sum(tmp_scores)
+
+    def test_across_network_propagation_matches_column_by_column(self):
+        network = sparse.identity(1000, format='csr')
+        connection = sparse.random(300, 1000, density=0.05, format='csr',
+                                   random_state=1)
+        expected = self._column_by_column_scores(network, connection)
+        for matrix in [connection, connection.tocsc(), connection.tolil()]:
+            result = self.prophnet.across_network_propagation(network, matrix)
+            self.assertTrue(np.allclose(expected, result))
+
+        self.assertEqual(np.count_nonzero(result), 4)
+
+    def test_across_network_propagation_raise_to_one(self):
+        network = sparse.identity(1000, format='csr')
+        connection = sparse.random(300, 1000, density=0.05, format='csc',
+                                   random_state=1)
+        expected = self._column_by_column_scores(network, connection)
+        result = self.prophnet.across_network_propagation(network, connection,
+                                                          raise_to_one=True)
+        self.assertTrue(np.array_equal(result, (expected > 0) * 1.0))
+
+    def test_across_network_propagation_dense_connection(self):
+        network = sparse.identity(1000, format='csr')
+        connection = sparse.random(300, 1000, density=0.05, format='csr',
+                                   random_state=2)
+        expected = self._column_by_column_scores(network, connection)
+        result = self.prophnet.across_network_propagation(network,
+                                                          connection.todense())
+        self.assertTrue(np.allclose(expected, result))
+
 if __name__ == '__main__':
 
     # Run the whole test using this function
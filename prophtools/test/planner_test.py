@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+import os
+import shutil
+import tempfile
+
+from scipy import sparse
+import prophtools.utils.planner as planner
+from prophtools.utils.preprocessing import normalize_matrix, precompute_matrix
+
+"""
+Test for precompute planner.
+"""
+
+class TestPlannerFunctions(unittest.TestCase):
+
+    def setUp(self):
+        adjacency = sparse.random(60, 60, density=0.1, random_state=0)
+        self.normalized = normalize_matrix(sparse.csr_matrix(adjacency + adjacency.T))
+        self.tmpdir = tempfile.mkdtemp()
+
+        self.estimates = [{'strategy': 'dense', 'time': 1.0, 'memory': 300},
+                          {'strategy': 'factorized', 'time': 3.0, 'memory': 150},
+                          {'strategy': 'iterative', 'time': 2.0, 'memory': 120},
+                          {'strategy': 'out_of_core', 'time': 4.0, 'memory': 20}]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_matrix_features_path_graph(self):
+        path = sparse.diags([np.ones(9), np.ones(9)], [-1, 1], shape=(10, 10))
+        features = planner.matrix_features(path)
+        self.assertEqual(features['n'], 10)
+        self.assertEqual(features['nnz'], 18)
+        self.assertEqual(features['max_degree'], 2)
+        self.assertEqual(features['envelope'], 18)
+
+    def test_estimates_cover_all_strategies(self):
+        estimates = planner.estimate_strategies(self.normalized)
+        self.assertEqual([e['strategy'] for e in estimates], planner.STRATEGIES)
+        for e in estimates:
+            self.assertTrue(e['time'] > 0)
+            self.assertTrue(e['memory'] > 0)
+
+    def test_out_of_core_estimate_uses_least_memory(self):
+        estimates = planner.estimate_strategies(self.normalized, block_size=4)
+        out_of_core = [e for e in estimates if e['strategy'] == 'out_of_core'][0]
+        self.assertEqual(min(e['memory'] for e in estimates), out_of_core['memory'])
+
+    def test_choose_strategy_fastest_without_memory_limit(self):
+        chosen = planner.choose_strategy(self.estimates)
+        self.assertEqual(chosen['strategy'], 'dense')
+
+    def test_choose_strategy_respects_memory_limit(self):
+        chosen = planner.choose_strategy(self.estimates, memory_limit=200)
+        self.assertEqual(chosen['strategy'], 'iterative')
+
+        chosen = planner.choose_strategy(self.estimates, memory_limit=100)
+        self.assertEqual(chosen['strategy'], 'out_of_core')
+
+    def test_choose_strategy_least_memory_if_nothing_fits(self):
+        chosen = planner.choose_strategy(self.estimates, memory_limit=10,
+                                         out_of_core=False)
+        self.assertEqual(chosen['strategy'], 'iterative')
+
+    def test_precompute_strategies_same_result(self):
+        expected = precompute_matrix(self.normalized)
+        for strategy in ['auto', 'dense', 'factorized', 'iterative']:
+            result = planner.precompute(self.normalized, strategy=strategy)
+            self.assertTrue(np.allclose(expected, result))
+
+    def test_precompute_out_of_core_writes_file(self):
+        filename = os.path.join(self.tmpdir, 'precomputed.npy')
+        result = planner.precompute(self.normalized, strategy='out_of_core',
+                                    filename=filename)
+        self.assertTrue(isinstance(result, np.memmap))
+        self.assertTrue(np.allclose(precompute_matrix(self.normalized), result))
+        del result
+
+    def test_precompute_auto_goes_out_of_core_without_memory(self):
+        filename = os.path.join(self.tmpdir, 'precomputed.npy')
+        result = planner.precompute(self.normalized, filename=filename,
+                                    block_size=4, memory_limit=1)
+        self.assertTrue(isinstance(result, np.memmap))
+        del result
+
+    def test_precompute_out_of_core_without_file_raises_exception(self):
+        with self.assertRaises(ValueError):
+            planner.precompute(self.normalized, strategy='out_of_core')
+
+    def test_unknown_strategy_raises_exception(self):
+        with self.assertRaises(ValueError):
+            planner.precompute(self.normalized, strategy='unknown')
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestPlannerFunctions)
+    unittest.TextTestRunner(verbosity=2).run(suite)
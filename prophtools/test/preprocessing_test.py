@@ -1,10 +1,24 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import mock
 import numpy as np
 
 from prophtools.utils.preprocessing import precompute_matrix, normalize_matrix, estimate_precomputing_time
+from prophtools.utils.preprocessing import rank_rows, precompute_to_file
+from prophtools.utils.preprocessing import row_statistics, streamed_row_statistics
+from prophtools.utils.preprocessing import push_precompute, sparsify
+from prophtools.utils.preprocessing import component_labels, component_nodes
+from prophtools.utils.preprocessing import node_order, reorder, LG
+from prophtools.utils.preprocessing import multi_alpha_precompute
+from prophtools.utils.preprocessing import _matrix_fingerprint
+import prophtools.utils.solvers as solvers
+import os
+import shutil
+import tempfile
+import warnings
 import scipy.sparse as sparse
+from scipy.stats import rankdata
 
 """
 Test for preprocessing methods class.
@@ -98,6 +112,21 @@ class TestPreprocessingFunctions(unittest.TestCase):
         normalized = normalize_matrix(sparse_d)
         self.assertTrue(sparse.issparse(normalized))
 
+    def test_normalize_matrix_matches_degree_scaling(self):
+        # net_c has zero rows and columns, which must stay zero
+        m = np.asarray(self.net_c)
+        row_sums = m.sum(axis=1)
+        column_sums = m.sum(axis=0)
+        expected = np.zeros(m.shape)
+        for i, j in zip(*np.nonzero(m)):
+            expected[i, j] = m[i, j] / np.sqrt(row_sums[i] * column_sums[j])
+
+        for matrix in [self.net_c, m, sparse.csr_matrix(m), sparse.coo_matrix(m)]:
+            normalized = normalize_matrix(matrix)
+            if sparse.issparse(normalized):
+                normalized = normalized.toarray()
+            self.assertTrue(np.allclose(normalized, expected))
+
     def test_precompute_matrix_returns_dense_result(self):
 
         normalized = normalize_matrix(self.net_d)
@@ -106,14 +135,402 @@ class TestPreprocessingFunctions(unittest.TestCase):
         self.assertFalse(sparse.issparse(precomputed))
 
     def test_estimate_precomputing_runs(self):
-        result = estimate_precomputing_time(self.net_d, iterations=2)
+        result = estimate_precomputing_time(self.net_d)
         self.assertTrue(result > 0)
 
+    def test_estimate_precomputing_iterations_is_deprecated(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            result = estimate_precomputing_time(self.net_d, iterations=2)
+            self.assertTrue(result > 0)
+            self.assertEqual(len(caught), 1)
+            self.assertTrue(issubclass(caught[0].category, DeprecationWarning))
+
     def test_estimate_precomputing_zero_iterations_equals_zero_time(self):
-        result = estimate_precomputing_time(self.net_d, iterations=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            result = estimate_precomputing_time(self.net_d, iterations=0)
         self.assertEquals(result, 0.00)
 
-    
+
+    def test_precompute_matrix_matches_known_values(self):
+        precomputed = precompute_matrix(normalize_matrix(self.net_d))
+        self.assertTrue(self.compare_matrices_epsilon(precomputed,
+                                                      np.asarray(self.net_d_precomp),
+                                                      epsilon=1e-7))
+
+    def test_precompute_matrix_block_size_does_not_change_result(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        expected = precompute_matrix(normalized, block_size=7)
+        for block_size in [1, 2, 3, 100]:
+            result = precompute_matrix(normalized, block_size=block_size)
+            self.assertTrue(np.allclose(expected, result, rtol=0, atol=1e-12))
+
+    def test_precompute_matrix_fills_given_output(self):
+        out = np.zeros((7, 7))
+        result = precompute_matrix(normalize_matrix(self.net_d), out=out)
+        self.assertTrue(result is out)
+        self.assertTrue(np.allclose(out, self.net_d_precomp))
+
+    def test_precompute_matrix_factorized_solver_same_result(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        expected = precompute_matrix(normalized)
+        result = precompute_matrix(normalized, solver='factorized', block_size=3)
+        self.assertTrue(np.allclose(expected, result))
+
+    def test_precompute_matrix_dense_solver_matches_known_values(self):
+        precomputed = precompute_matrix(normalize_matrix(self.net_d), solver='dense')
+        self.assertTrue(np.allclose(precomputed, self.net_d_precomp))
+
+    def test_precompute_matrix_unknown_solver_raises_exception(self):
+        with self.assertRaises(ValueError):
+            precompute_matrix(normalize_matrix(self.net_d), solver='unknown')
+
+    def test_precompute_matrix_parallel_same_result(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        expected = precompute_matrix(normalized)
+        for solver in ['iterative', 'factorized']:
+            result = precompute_matrix(normalized, block_size=2, n_jobs=3,
+                                       solver=solver)
+            self.assertTrue(np.allclose(expected, result))
+
+    def test_precompute_matrix_parallel_writes_into_memmap(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'precomputed.dat')
+            out = np.memmap(filename, dtype=float, mode='w+', shape=(7, 7))
+            result = precompute_matrix(normalize_matrix(self.net_d), out=out,
+                                       block_size=3, n_jobs=2)
+            self.assertTrue(result is out)
+            self.assertTrue(np.allclose(out, self.net_d_precomp))
+            del out, result
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_precompute_to_file_matches_precompute_matrix(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'precomputed.npy')
+            result = precompute_to_file(normalize_matrix(self.net_d), filename,
+                                        block_size=3)
+            self.assertTrue(isinstance(result, np.memmap))
+            self.assertTrue(np.allclose(result, self.net_d_precomp))
+            self.assertFalse(os.path.exists(filename + '.checkpoint'))
+            del result
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_precompute_to_file_resumes_from_checkpoint(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'precomputed.npy')
+            normalized = normalize_matrix(self.net_d)
+            precompute_to_file(normalized, filename, block_size=3)
+
+            # Interrupted after the first block: later columns are missing
+            # and the first one must not be computed again.
+            interrupted = np.load(filename, mmap_mode='r+')
+            interrupted[:, 0] = 42.0
+            interrupted[:, 3:] = 0.0
+            del interrupted
+            with open(filename + '.checkpoint', 'w') as f:
+                f.write("3 0.9 none {}\n".format(_matrix_fingerprint(normalized)))
+
+            result = precompute_to_file(normalized, filename, block_size=3)
+            self.assertTrue(np.all(result[:, 0] == 42.0))
+            self.assertTrue(np.allclose(result[:, 1:], np.asarray(self.net_d_precomp)[:, 1:]))
+            del result
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_precompute_to_file_other_matrix_starts_over(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'precomputed.npy')
+            normalized = normalize_matrix(self.net_d)
+            changed = sparse.csr_matrix(normalized, copy=True)
+            changed.data[0] += 0.1
+
+            # Same shape, alpha and ordering, but made for another matrix
+            # (or, for old checkpoints, for an unknown one)
+            for fingerprint in [_matrix_fingerprint(changed), '']:
+                np.save(filename, np.zeros((7, 7)))
+                with open(filename + '.checkpoint', 'w') as f:
+                    f.write("6 0.9 none {}\n".format(fingerprint))
+
+                result = precompute_to_file(normalized, filename, block_size=3)
+                self.assertTrue(np.allclose(result, self.net_d_precomp))
+                del result
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_matrix_fingerprint(self):
+        normalized = sparse.csr_matrix(normalize_matrix(self.net_d))
+        same = sparse.coo_matrix(normalized).tocsr()
+        changed = sparse.csr_matrix(normalized, copy=True)
+        changed.data[-1] *= 2
+
+        self.assertEqual(_matrix_fingerprint(normalized), _matrix_fingerprint(same))
+        self.assertNotEqual(_matrix_fingerprint(normalized), _matrix_fingerprint(changed))
+        self.assertTrue(_matrix_fingerprint(normalized).startswith(
+            "{}:".format(normalized.nnz)))
+
+    def test_precompute_to_file_other_alpha_starts_over(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'precomputed.npy')
+            np.save(filename, np.zeros((7, 7)))
+            with open(filename + '.checkpoint', 'w') as f:
+                f.write("6 0.5\n")
+
+            result = precompute_to_file(normalize_matrix(self.net_d), filename,
+                                        block_size=3)
+            self.assertTrue(np.allclose(result, self.net_d_precomp))
+            del result
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_node_order_is_permutation(self):
+        for ordering in ['rcm', 'degree']:
+            permutation = node_order(self.net_d, ordering)
+            self.assertEqual(sorted(permutation), range(7))
+        self.assertTrue(node_order(self.net_d, 'none') is None)
+
+    def test_node_order_rcm_reduces_bandwidth(self):
+        path = sparse.diags([np.ones(29), np.ones(29)], [-1, 1], shape=(30, 30))
+        shuffle = np.random.RandomState(0).permutation(30)
+        shuffled = reorder(path, shuffle)
+
+        def bandwidth(m):
+            m = sparse.coo_matrix(m)
+            return np.abs(m.row - m.col).max()
+
+        ordered = reorder(shuffled, node_order(shuffled, 'rcm'))
+        self.assertEqual(bandwidth(ordered), 1)
+        self.assertTrue(bandwidth(shuffled) > 1)
+
+    def test_node_order_unknown_ordering_raises_exception(self):
+        with self.assertRaises(ValueError):
+            node_order(self.net_d, 'unknown')
+
+    def test_precompute_matrix_ordering_same_result(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        for ordering in ['rcm', 'degree']:
+            for solver in ['iterative', 'factorized']:
+                for n_jobs in [1, 2]:
+                    result = precompute_matrix(normalized, block_size=3,
+                                               solver=solver, n_jobs=n_jobs,
+                                               ordering=ordering)
+                    self.assertTrue(np.allclose(result, self.net_d_precomp))
+
+    def test_precompute_to_file_ordering_same_result(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'precomputed.npy')
+            result = precompute_to_file(normalize_matrix(self.net_d), filename,
+                                        block_size=3, ordering='rcm')
+            self.assertTrue(np.allclose(result, self.net_d_precomp))
+            del result
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_precompute_to_file_other_ordering_starts_over(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'precomputed.npy')
+            np.save(filename, np.zeros((7, 7)))
+            with open(filename + '.checkpoint', 'w') as f:
+                f.write("6 0.9 none\n")
+
+            result = precompute_to_file(normalize_matrix(self.net_d), filename,
+                                        block_size=3, ordering='degree')
+            self.assertTrue(np.allclose(result, self.net_d_precomp))
+            del result
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_lg_krylov_methods_match_power(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        identity = np.identity(7)
+        for method, preconditioner in [('cg', 'none'), ('cg', 'jacobi'),
+                                       ('bicgstab', 'jacobi'), ('bicgstab', 'ilu')]:
+            [_, result] = LG(identity, 0.9, normalized, 1000, method=method,
+                             preconditioner=preconditioner)
+            self.assertTrue(np.allclose(result, self.net_d_precomp))
+
+    def test_lg_block_of_queries(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        for identity in [np.identity(7), np.matrix(np.identity(7))]:
+            [_, result, iterations, residuals] = LG(identity, 0.9, normalized, 1000,
+                                                    return_info=True)
+            self.assertTrue(np.allclose(result, self.net_d_precomp))
+            self.assertTrue(np.all(residuals < 1e-9))
+            self.assertTrue(np.all(iterations < 1000))
+
+    @mock.patch.object(solvers, 'csr_matvecs', None)
+    def test_lg_without_sparsetools_same_result(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        for precision in ['double', 'mixed']:
+            [_, result] = LG(np.identity(7), 0.9, normalized, 1000,
+                             precision=precision)
+            self.assertTrue(np.allclose(result, self.net_d_precomp, rtol=0, atol=1e-8))
+            [_, column] = LG(np.identity(7)[:, [2]], 0.9, normalized, 1000,
+                             precision=precision)
+            self.assertTrue(np.allclose(column, np.asarray(self.net_d_precomp)[:, [2]],
+                                        rtol=0, atol=1e-8))
+
+    def test_lg_mixed_precision_same_result(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        [_, result, _, residuals] = LG(np.identity(7), 0.9, normalized, 1000,
+                                       precision='mixed', return_info=True)
+        self.assertTrue(np.allclose(result, self.net_d_precomp, rtol=0, atol=1e-8))
+        self.assertTrue(np.all(residuals <= 1e-9))
+
+    def test_precompute_matrix_mixed_precision_same_result(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        expected = precompute_matrix(normalized)
+        for n_jobs in [1, 2]:
+            result = precompute_matrix(normalized, block_size=3, n_jobs=n_jobs,
+                                       precision='mixed')
+            self.assertTrue(np.allclose(expected, result, rtol=0, atol=1e-8))
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'precomputed.npy')
+            result = precompute_to_file(normalized, filename, block_size=3,
+                                        precision='mixed')
+            self.assertTrue(np.allclose(expected, result, rtol=0, atol=1e-8))
+            del result
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_multi_alpha_precompute_same_result(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        alphas = [0.9, 0.5, 0.75]
+        for ordering in ['none', 'rcm']:
+            result = multi_alpha_precompute(normalized, alphas, block_size=3,
+                                            ordering=ordering)
+            self.assertEqual(result.shape, (3, 7, 7))
+            for i, alpha in enumerate(alphas):
+                expected = precompute_matrix(normalized, alpha)
+                self.assertTrue(np.allclose(expected, result[i], rtol=0, atol=1e-12))
+
+        out = np.zeros((3, 7, 7))
+        result = multi_alpha_precompute(normalized, alphas, out=out)
+        self.assertTrue(result is out)
+        self.assertTrue(np.allclose(precompute_matrix(normalized, 0.5), out[1]))
+
+    def test_precompute_matrix_unknown_precision_raises_exception(self):
+        with self.assertRaises(ValueError):
+            precompute_matrix(normalize_matrix(self.net_d), precision='half')
+
+    def test_lg_bicgstab_non_symmetric(self):
+        directed = sparse.csr_matrix(np.triu(np.ones((6, 6)), 1) + np.diag(np.ones(5), -1))
+        normalized = normalize_matrix(directed)
+        query = np.zeros((6, 1))
+        query[2] = 1.0
+        [_, expected] = LG(query, 0.9, normalized, 1000)
+        [_, result] = LG(query, 0.9, normalized, 1000, method='bicgstab',
+                         preconditioner='ilu')
+        self.assertTrue(np.allclose(expected, result))
+
+    def test_lg_warm_start_same_result(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        query = np.zeros((7, 1))
+        query[3] = 1.0
+        [_, guess] = LG(query, 0.5, normalized, 1000)
+        for method in ['power', 'cg']:
+            [_, result] = LG(query, 0.9, normalized, 1000, method=method, x0=guess)
+            self.assertTrue(np.allclose(result, np.asarray(self.net_d_precomp)[:, [3]]))
+
+    def test_streamed_row_statistics_match_precomputed(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        [expected_means, expected_norms] = row_statistics(precompute_matrix(normalized))
+
+        factorization = solvers.factorize(normalized, 0.9)
+        for f in [None, factorization]:
+            [means, norms] = streamed_row_statistics(normalized, block_size=3,
+                                                     factorization=f)
+            self.assertTrue(np.allclose(means, expected_means))
+            self.assertTrue(np.allclose(norms, expected_norms))
+
+    def test_push_precompute_within_tolerance(self):
+        normalized = normalize_matrix(sparse.csr_matrix(self.net_d))
+        expected = precompute_matrix(normalized)
+        for tol in [1e-3, 1e-6, 1e-9]:
+            result = push_precompute(normalized, tol=tol, block_size=3)
+            self.assertTrue(isinstance(result, sparse.csr_matrix))
+            self.assertTrue(abs(result.toarray() - expected).max() < 10 * tol)
+
+    def test_push_precompute_fewer_nonzeros_with_larger_tolerance(self):
+        adjacency = sparse.random(200, 200, density=0.01, random_state=0)
+        normalized = normalize_matrix(sparse.csr_matrix(adjacency + adjacency.T))
+        coarse = push_precompute(normalized, tol=1e-2)
+        fine = push_precompute(normalized, tol=1e-4)
+        self.assertTrue(coarse.nnz < fine.nnz)
+
+    def test_sparsify_drops_entries_below_epsilon(self):
+        precomputed = np.asarray(self.net_d_precomp)
+        result = sparsify(precomputed, epsilon=0.05, block_size=3)
+        self.assertTrue(isinstance(result, sparse.csr_matrix))
+        expected = np.where(abs(precomputed) > 0.05, precomputed, 0)
+        self.assertTrue(np.allclose(result.toarray(), expected))
+
+    def test_sparsify_keeps_top_entries_per_row(self):
+        precomputed = np.asarray(self.net_d_precomp)
+        result = sparsify(precomputed, top=2).toarray()
+        for i in range(precomputed.shape[0]):
+            kept = np.flatnonzero(result[i])
+            self.assertEqual(len(kept), 2)
+            self.assertTrue(abs(precomputed[i, kept]).min() >= np.sort(abs(precomputed[i]))[-2])
+            self.assertTrue(np.allclose(result[i, kept], precomputed[i, kept]))
+
+    def test_row_statistics_sparse_same_result(self):
+        precomputed = push_precompute(normalize_matrix(sparse.csr_matrix(self.net_d)), tol=1e-3)
+        [expected_means, expected_norms] = row_statistics(precomputed.toarray())
+        [means, norms] = row_statistics(precomputed)
+        self.assertTrue(np.allclose(means, expected_means))
+        self.assertTrue(np.allclose(norms, expected_norms))
+
+    def test_rank_rows_sparse_same_result(self):
+        precomputed = push_precompute(normalize_matrix(sparse.csr_matrix(self.net_d)), tol=1e-2)
+        expected = rank_rows(precomputed.toarray())
+        self.assertTrue(np.allclose(rank_rows(precomputed), expected))
+
+    def test_component_labels_by_size_and_isolated_nodes(self):
+        m = sparse.csr_matrix((7, 7))
+        m[0, 6] = 1.0
+        m[2, 3] = 1.0
+        m[4, 3] = 1.0
+        m[5, 5] = 1.0
+        labels = component_labels(m)
+        self.assertEqual(list(labels), [1, -1, 0, 0, 0, 2, 1])
+
+        nodes = component_nodes(labels)
+        self.assertEqual([list(n) for n in nodes], [[2, 3, 4], [0, 6], [5]])
+
+    def test_streamed_row_statistics_per_component(self):
+        m = sparse.block_diag([self.net_d, self.net_a, np.zeros((2, 2))], format='csr')
+        normalized = normalize_matrix(m)
+        [expected_means, expected_norms] = row_statistics(precompute_matrix(normalized))
+
+        [means, norms] = streamed_row_statistics(normalized, block_size=3,
+                                                 labels=component_labels(normalized))
+        self.assertTrue(np.allclose(means, expected_means))
+        self.assertTrue(np.allclose(norms, expected_norms))
+
+    def test_rank_rows_averages_ties(self):
+        ranked = rank_rows(np.asarray(self.net_d_precomp))
+        for i in range(ranked.shape[0]):
+            expected = rankdata(self.net_d_precomp[i])
+            self.assertTrue(np.allclose(ranked[i], expected))
+
+    def test_rank_rows_fills_given_output(self):
+        out = np.zeros((7, 7), dtype='float32')
+        result = rank_rows(np.asarray(self.net_d_precomp), out=out)
+        self.assertTrue(result is out)
+        self.assertEqual(out[2, 0], 3.0)
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+import os
+import shutil
+import tempfile
+import scipy.io as sio
+import mock
+
+from scipy import sparse
+import prophtools.utils.representations as representations
+from prophtools.utils.preprocessing import normalize_matrix, precompute_matrix, row_statistics
+
+"""
+Test for precomputed matrix representations.
+"""
+
+class TestRepresentationsFunctions(unittest.TestCase):
+
+    def setUp(self):
+        adjacency = sparse.random(40, 40, density=0.1, random_state=0)
+        self.normalized = normalize_matrix(sparse.csr_matrix(adjacency + adjacency.T))
+        self.precomputed = precompute_matrix(self.normalized)
+        self.spectral = representations.spectral_precompute(self.normalized, k=8)
+
+    def _dense(self, representation):
+        return representation.rows(0, representation.shape[0])
+
+    def test_spectral_all_eigenpairs_is_exact(self):
+        spectral = representations.spectral_precompute(self.normalized, k=40)
+        self.assertTrue(np.allclose(self._dense(spectral), self.precomputed))
+
+    def test_spectral_rows_columns_and_products_agree(self):
+        dense = self._dense(self.spectral)
+        self.assertTrue(np.allclose(dense, dense.T))
+        self.assertTrue(np.allclose(self.spectral.columns([3, 5]), dense[:, [3, 5]]))
+
+        v = np.random.RandomState(0).rand(40, 3)
+        self.assertTrue(np.allclose(self.spectral.dot(v), dense.dot(v)))
+        self.assertTrue(np.allclose(self.spectral.dot(v[:, 0]), dense.dot(v[:, 0])))
+
+    def test_spectral_indexing_reads_rows(self):
+        dense = self._dense(self.spectral)
+        self.assertTrue(np.allclose(self.spectral[4], dense[4]))
+        self.assertTrue(np.allclose(self.spectral[-1], dense[-1]))
+        self.assertTrue(np.allclose(self.spectral[2:6], dense[2:6]))
+        self.assertEqual(len(self.spectral), 40)
+
+    def test_spectral_with_alpha_matches_precompute(self):
+        spectral = representations.spectral_precompute(self.normalized, k=40)
+        expected = precompute_matrix(self.normalized, alpha=0.5)
+        self.assertTrue(np.allclose(self._dense(spectral.with_alpha(0.5)), expected))
+
+    def test_spectral_non_symmetric_raises_exception(self):
+        with self.assertRaises(ValueError):
+            representations.spectral_precompute(sparse.csr_matrix([[0, 1.0], [0, 0]]))
+
+    def test_error_report_exact_representation(self):
+        report = representations.error_report(self.normalized, self.precomputed,
+                                              n_samples=5)
+        self.assertEqual(report['columns'], 5)
+        self.assertTrue(report['max_abs_error'] < 1e-8)
+        self.assertTrue(report['min_column_correlation'] > 0.999999)
+
+    def test_error_report_spectral(self):
+        report = representations.error_report(self.normalized, self.spectral)
+        errors = self._dense(self.spectral) - self.precomputed
+        self.assertTrue(report['max_abs_error'] <= abs(errors).max() + 1e-8)
+        self.assertTrue(report['relative_error'] > 0)
+
+    def test_save_load_spectral(self):
+        mdict = {}
+        self.assertTrue(representations.save(mdict, 'net', self.spectral))
+        loaded = representations.load(mdict, 'net', alpha=0.9)
+        self.assertTrue(np.allclose(self._dense(loaded), self._dense(self.spectral)))
+
+    def test_save_ignores_dense_matrices(self):
+        mdict = {}
+        self.assertFalse(representations.save(mdict, 'net', self.precomputed))
+        self.assertEqual(mdict, {})
+        self.assertTrue(representations.load(mdict, 'net') is None)
+
+    def test_build_push_is_sparse(self):
+        result = representations.build(self.normalized, 'push', push_tol=1e-8)
+        self.assertTrue(sparse.isspmatrix_csr(result))
+        report = representations.error_report(self.normalized, result)
+        self.assertTrue(report['max_abs_error'] < 1e-6)
+
+    def test_build_thresholded_is_sparse(self):
+        result = representations.build(self.normalized, 'thresholded', threshold=1e-2)
+        self.assertTrue(sparse.isspmatrix_csr(result))
+        self.assertTrue(result.nnz < np.count_nonzero(self.precomputed))
+        self.assertTrue(abs(result.toarray() - self.precomputed).max() <= 1e-2)
+
+    def test_pearson_change_exact_is_zero(self):
+        report = representations.pearson_change(self.precomputed, sparse.csr_matrix(self.precomputed))
+        self.assertEqual(report['queries'], 20)
+        self.assertTrue(report['max_score_change'] < 1e-10)
+
+    def test_pearson_change_grows_with_threshold(self):
+        changes = []
+        for threshold in [1e-4, 1e-2]:
+            thresholded = representations.build(self.normalized, 'thresholded', threshold=threshold)
+            changes.append(representations.pearson_change(self.precomputed, thresholded)['mean_score_change'])
+        self.assertTrue(0 < changes[0] < changes[1])
+
+    def test_pearson_change_spectral(self):
+        report = representations.pearson_change(self.precomputed, self.spectral)
+        self.assertTrue(report['max_score_change'] > 0)
+
+    def test_quantize_error_within_step(self):
+        float16 = representations.quantize(self.precomputed, 'float16')
+        self.assertEqual(float16.values.dtype, np.float16)
+        self.assertTrue(np.allclose(self._dense(float16), self.precomputed, rtol=1e-3, atol=0))
+
+        uint8 = representations.quantize(self.precomputed, 'uint8', block_size=7)
+        self.assertEqual(uint8.values.dtype, np.uint8)
+        errors = abs(self._dense(uint8) - self.precomputed).max(axis=1)
+        self.assertTrue((errors <= uint8.scale / 2 + 1e-12).all())
+
+    def test_quantized_rows_columns_and_products_agree(self):
+        uint8 = representations.quantize(self.precomputed, 'uint8')
+        uint8.block_size = 7
+        dense = self._dense(uint8)
+        self.assertTrue(np.allclose(uint8.columns([3, 5]), dense[:, [3, 5]]))
+
+        v = np.random.RandomState(0).rand(40, 3)
+        self.assertTrue(np.allclose(uint8.dot(v), dense.dot(v)))
+        self.assertTrue(np.allclose(uint8.dot(v[:, 0]), dense.dot(v[:, 0])))
+
+    def test_quantize_to_file_is_memory_mapped(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'quantized.npy')
+            uint8 = representations.quantize(self.precomputed, 'uint8', filename)
+            self.assertTrue(isinstance(uint8.values, np.memmap))
+
+            mdict = {}
+            self.assertTrue(representations.save(mdict, 'net', uint8, tmpdir))
+            self.assertEqual(mdict['net_quantized_file'], 'quantized.npy')
+            loaded = representations.load(mdict, 'net', data_path=tmpdir)
+            self.assertTrue(isinstance(loaded.values, np.memmap))
+            self.assertTrue(np.allclose(self._dense(loaded), self._dense(uint8)))
+            del uint8, loaded
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_save_load_quantized_in_mat_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'quantized.mat')
+            for dtype in representations.QUANTIZED_TYPES:
+                quantized = representations.quantize(self.precomputed, dtype)
+                mdict = {}
+                representations.save(mdict, 'net', quantized)
+                sio.savemat(filename, mdict)
+                loaded = representations.load(sio.loadmat(filename), 'net')
+                self.assertEqual(loaded.values.dtype, np.dtype(dtype))
+                self.assertTrue(np.allclose(self._dense(loaded), self._dense(quantized)))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_quantize_unknown_type_raises_exception(self):
+        with self.assertRaises(ValueError):
+            representations.quantize(self.precomputed, 'int4')
+
+    def test_packed_matches_full_matrix(self):
+        packed = representations.pack_symmetric(self.precomputed)
+        self.assertEqual(len(packed.values), 40 * 41 / 2)
+        packed.block_size = 7
+        self.assertTrue(np.allclose(self._dense(packed), self.precomputed))
+        self.assertTrue(np.allclose(packed[13:29], self.precomputed[13:29]))
+        self.assertTrue(np.allclose(packed[-1], self.precomputed[-1]))
+        self.assertTrue(np.allclose(packed.columns([3, 5]), self.precomputed[:, [3, 5]]))
+
+        v = np.random.RandomState(0).rand(40, 3)
+        self.assertTrue(np.allclose(packed.dot(v), self.precomputed.dot(v)))
+        self.assertTrue(np.allclose(packed.dot(v[:, 0]), self.precomputed.dot(v[:, 0])))
+
+    def test_packed_precompute_matches_precompute_matrix(self):
+        for solver in ['iterative', 'factorized']:
+            packed = representations.packed_precompute(self.normalized, block_size=7,
+                                                       solver=solver)
+            self.assertTrue(np.allclose(self._dense(packed), self.precomputed))
+
+    def test_packed_non_symmetric_raises_exception(self):
+        with self.assertRaises(ValueError):
+            representations.pack_symmetric(np.triu(self.precomputed))
+        with self.assertRaises(ValueError):
+            representations.packed_precompute(sparse.csr_matrix([[0, 1.0], [0, 0]]))
+
+    def test_save_load_packed(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'packed.npy')
+            on_file = representations.build(self.normalized, 'packed',
+                                            representation_file=filename)
+            self.assertTrue(isinstance(on_file.values, np.memmap))
+
+            matfile = os.path.join(tmpdir, 'packed.mat')
+            for packed in [on_file, representations.pack_symmetric(self.precomputed)]:
+                mdict = {}
+                self.assertTrue(representations.save(mdict, 'net', packed, tmpdir))
+                sio.savemat(matfile, mdict)
+                loaded = representations.load(sio.loadmat(matfile), 'net', data_path=tmpdir)
+                self.assertTrue(isinstance(loaded, representations.PackedPrecomputed))
+                self.assertTrue(np.allclose(self._dense(loaded), self.precomputed))
+            del on_file, loaded
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def _fragmented(self):
+        # Two components of each size, a larger one and isolated nodes
+        blocks = [self.normalized[:5, :5], self.normalized[5:10, 5:10],
+                  self.normalized[:3, :3], self.normalized[10:13, 10:13],
+                  self.normalized, np.zeros((3, 3))]
+        m = sparse.block_diag(blocks, format='csr')
+        order = np.random.RandomState(0).permutation(m.shape[0])
+        return normalize_matrix(m[order][:, order])
+
+    def test_components_precompute_matches_precompute_matrix(self):
+        fragmented = self._fragmented()
+        expected = precompute_matrix(fragmented)
+        components = representations.components_precompute(fragmented)
+        self.assertTrue(len(components.values) < expected.size)
+
+        self.assertTrue(np.allclose(self._dense(components), expected))
+        self.assertTrue(np.allclose(components[10:30], expected[10:30]))
+        self.assertTrue(np.allclose(components.columns([0, 7, 20]), expected[:, [0, 7, 20]]))
+
+        v = np.random.RandomState(0).rand(fragmented.shape[0], 3)
+        self.assertTrue(np.allclose(components.dot(v), expected.dot(v)))
+        self.assertTrue(np.allclose(components.dot(v[:, 0]), expected.dot(v[:, 0])))
+
+        [means, norms] = components.row_statistics()
+        [expected_means, expected_norms] = row_statistics(expected)
+        self.assertTrue(np.allclose(means, expected_means))
+        self.assertTrue(np.allclose(norms, expected_norms))
+
+    def test_components_precompute_plans_large_components(self):
+        fragmented = self._fragmented()
+        with mock.patch.object(representations, 'DENSE_COMPONENT_SIZE', 4):
+            components = representations.build(fragmented, 'components',
+                                               precompute_options={'strategy': 'iterative'})
+        self.assertTrue(np.allclose(self._dense(components), precompute_matrix(fragmented)))
+
+    def test_save_load_components(self):
+        components = representations.components_precompute(self._fragmented())
+        mdict = {}
+        self.assertTrue(representations.save(mdict, 'net', components))
+        loaded = representations.load(mdict, 'net', alpha=0.9)
+        self.assertTrue(isinstance(loaded, representations.ComponentsPrecomputed))
+        self.assertTrue(np.allclose(self._dense(loaded), self._dense(components)))
+
+    def test_unknown_representation_raises_exception(self):
+        with self.assertRaises(ValueError):
+            representations.build(self.normalized, 'unknown')
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestRepresentationsFunctions)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -76,7 +76,8 @@ profile = False
         sys.stderr = sys.__stderr__
         sys.stdout = sys.__stdout__
 
-        mock_read.assert_called_with('.', matfile, memsave=False)
+        mock_read.assert_called_with('.', matfile, memsave=False,
+                                     pack_symmetric=False)
         mock_propagate.assert_called_with([1], 0, 1, "pearson")
         
         self.assertEqual(result, 0)
@@ -98,7 +99,8 @@ profile = False
         sys.stderr = sys.__stderr__
         sys.stdout = sys.__stdout__
 
-        mock_read.assert_called_with('.', matfile, memsave=False)
+        mock_read.assert_called_with('.', matfile, memsave=False,
+                                     pack_symmetric=False)
         mock_exit.assert_called()
         
         self.assertEqual(result, -1)
@@ -120,12 +122,39 @@ profile = False
         sys.stderr = sys.__stderr__
         sys.stdout = sys.__stdout__
 
-        mock_read.assert_called_with('.', matfile, memsave=False)
+        mock_read.assert_called_with('.', matfile, memsave=False,
+                                     pack_symmetric=False)
         mock_propagate.assert_called()
         mock_save.assert_called_with('test.txt', [])
         self.assertEqual(result, 0)
 
 
+    @mock.patch.object(GraphDataSet, 'read')
+    @mock.patch.object(ProphNet, 'propagate_top')
+    @mock.patch.object(ProphNet, 'propagate')
+    def test_top_only_propagates_top_results(self, mock_propagate, mock_propagate_top,
+                                             mock_read):
+        cfg_path = os.path.join(self.tempdir, self.configname)
+
+        exp = run.LocalRunExperiment(cfg_path, 'run', self.log, section_name='run')
+        matfile = os.path.join(self.tempdir, 'mockmat.mat')
+        mock_propagate_top.return_value = [[[0.5, u'a'], [0.25, u'b']], True]
+
+        parameters = ['--qindex', '1', '--src', '0', '--dst', '1', '--matfile', matfile,
+                      '--top_only', 'True']
+        sys.stdout = StringIO.StringIO()
+        sys.stderr = StringIO.StringIO()
+        result = exp.run(parameters, self.configname)
+        output = sys.stdout.getvalue()
+        os.remove('run.cfg')
+        sys.stderr = sys.__stderr__
+        sys.stdout = sys.__stdout__
+
+        mock_propagate_top.assert_called_with([1], 0, 1, 10, "pearson")
+        mock_propagate.assert_not_called()
+        self.assertTrue("Top 2 certified" in output)
+        self.assertEqual(result, 0)
+
     def test_required_parameters_non_existing_file_returns_without_running(self):
         cfg_path = os.path.join(self.tempdir, self.configname)
         exp = run.LocalRunExperiment(cfg_path, 'run', self.log, section_name='run')
@@ -156,7 +185,8 @@ profile = False
         sys.stderr = sys.__stderr__
         sys.stdout = sys.__stdout__
 
-        mock_read.assert_called_with('.', matfile, memsave=True)
+        mock_read.assert_called_with('.', matfile, memsave=True,
+                                     pack_symmetric=False)
         mock_propagate.assert_called()
         
         self.assertEqual(result, 0)
@@ -154,6 +154,16 @@ class Experiment:
 
         return True
 
+    def _get_optional_parameter(self, section, option, default):
+        """
+        Returns a config value, or default if the option is missing. Used
+        for options added after config files were already in use.
+        """
+        try:
+            return self.config.get(section, option)
+        except ConfigParser.NoOptionError:
+            return default
+
     def _missing_parameters_msg(self, missing):
         missing_str = ', '.join(missing)
         msg = 'Cannot properly run this experiment, missing parameters: {}'.format(missing_str)
@@ -188,7 +188,7 @@ def separate_node_tags_per_group(graph):
 
     return groups
 
-def build_within_group_matrix(graph, group_node_list, group_tag, precompute=False, labels_as_ids=False):
+def build_within_group_matrix(graph, group_node_list, group_tag, precompute=False, labels_as_ids=False, precompute_options=None):
     result_mat = []
     adj_mat = nx.adjacency_matrix(graph).todense()
 
@@ -202,7 +202,7 @@ def build_within_group_matrix(graph, group_node_list, group_tag, precompute=Fals
     result_mat = result_mat[:, indices]
 
     if precompute:
-        entity = EntityNet.from_raw_matrix(scipy.sparse.csr_matrix(result_mat), group_tag, group_node_list)
+        entity = EntityNet.from_raw_matrix(scipy.sparse.csr_matrix(result_mat), group_tag, group_node_list, precompute_options=precompute_options)
     else:
         entity = EntityNet(scipy.sparse.csr_matrix(result_mat), group_tag, group_node_list)
 
@@ -226,7 +226,7 @@ def build_across_groups_matrix(graph, src_node_list, dst_node_list, relation_tag
     else:
         return None
 
-def convert_to_graphdataset(graph, precompute=False, labels_as_ids=False):
+def convert_to_graphdataset(graph, precompute=False, labels_as_ids=False, precompute_options=None):
     converted_object = None
 
     networks = []
@@ -256,7 +256,7 @@ def convert_to_graphdataset(graph, precompute=False, labels_as_ids=False):
         else:
             id_list = [v[0] for v in groups[g]]
 
-        m = build_within_group_matrix(graph, id_list, g, precompute=precompute, labels_as_ids=labels_as_ids)
+        m = build_within_group_matrix(graph, id_list, g, precompute=precompute, labels_as_ids=labels_as_ids, precompute_options=precompute_options)
         networks.append(m)
 
     # super-adjacency matrix is a |groups|x|groups| matrix
@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+"""
+.. module:: planner.py
+.. moduleauthor:: Carmen Navarro Luzon
+
+Chooses how to precompute a normalized matrix. Each strategy is modelled
+from the shape of the matrix (size, nonzeros, degree spread and the
+envelope of its reverse Cuthill-McKee ordering) and from the speed of this
+machine, measured with small probes:
+
+    dense:       (1 - alpha) * inv(I - alpha * m) as a dense matrix.
+                 O(n^3) time, three n x n matrices in memory.
+    factorized:  sparse LU factorization of I - alpha * m, then one pair
+                 of triangular solves per column.
+    iterative:   blocks of columns propagated by fixed point iteration.
+    out_of_core: blocked iteration streamed to a .npy file, so the n x n
+                 result is never held in memory.
+
+Predictions are rough: they are meant to rank the strategies and to warn
+before running out of memory, not to time them to the second.
+"""
+
+import logging
+import os
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+import prophtools.utils.preprocessing as preprocessing
+
+
+STRATEGIES = ['dense', 'factorized', 'iterative', 'out_of_core']
+
+# Sparse LU does not run at dense BLAS speed
+SPARSE_FLOP_PENALTY = 4.0
+
+# Bytes per second assumed for writing the out of core result
+DISK_BANDWIDTH = 200e6
+
+_dense_flop_time = []
+
+log = logging.getLogger(__name__)
+
+
+def validate_strategy(strategy):
+    if strategy not in STRATEGIES + ['auto']:
+        msg = "Unknown precompute strategy: {}. Available: auto, {}".format(
+            strategy, ', '.join(STRATEGIES))
+        raise ValueError(msg)
+
+
+def matrix_features(m):
+    """
+    Describes a normalized matrix for the cost models.
+
+    The envelope of the matrix in reverse Cuthill-McKee order (the entries
+    between the first nonzero of each row or column and the diagonal) bounds
+    the fill of its LU factors, and the sum of squared row and column
+    bandwidths bounds the work to compute them.
+
+    Returns:
+        A dictionary with n, nnz, mean_degree, max_degree, envelope and
+        factor_flops.
+    """
+    m = sparse.csr_matrix(m, dtype=float)
+    n = m.shape[0]
+    degrees = np.diff(m.indptr)
+
+    order = reverse_cuthill_mckee(m, symmetric_mode=False)
+    reordered = m[order, :][:, order]
+    lower = _bandwidths(sparse.csr_matrix(reordered))
+    upper = _bandwidths(sparse.csr_matrix(reordered.T))
+
+    return {'n': n,
+            'nnz': m.nnz,
+            'mean_degree': float(degrees.mean()) if n else 0.0,
+            'max_degree': int(degrees.max()) if n else 0,
+            'envelope': int(lower.sum() + upper.sum()),
+            'factor_flops': float((lower**2).sum() + (upper**2).sum())}
+
+
+def _bandwidths(m):
+    """
+    For each row i of a csr matrix, i minus the column of its first nonzero
+    (0 if there is none left of the diagonal).
+    """
+    n = m.shape[0]
+    first = np.arange(n)
+    nonempty = np.diff(m.indptr) > 0
+    if m.nnz:
+        row_minimums = np.minimum.reduceat(m.indices, m.indptr[:-1][nonempty])
+        first[nonempty] = np.minimum(row_minimums, first[nonempty])
+
+    return (np.arange(n) - first).astype(float)
+
+
+def _sparse_product_time(m, columns=16):
+    """
+    Measured seconds per nonzero and column of a sparse by dense block
+    product with m.
+    """
+    m = sparse.csr_matrix(m, dtype=float)
+    block = np.ones((m.shape[1], columns))
+    best = None
+    for _ in range(3):
+        start = time.time()
+        m * block
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return max(best, 1e-9) / (max(m.nnz, 1) * columns)
+
+
+def _column_time(m, alpha, maxiter, block_size):
+    """
+    Measured seconds per column of precompute_columns, on a block of
+    columns from the middle of m. Unlike the product alone, this accounts
+    for the number of iterations until convergence and for the dense work
+    on the block at each of them. The block is as large as the ones that
+    will be computed (per column cost grows with the block, as it falls out
+    of cache) but no more than a twentieth of the columns.
+    """
+    m = sparse.csr_matrix(m, dtype=float)
+    columns = min(block_size, max(16, m.shape[1] // 20), m.shape[1])
+    start_column = (m.shape[1] - columns) // 2
+
+    start = time.time()
+    preprocessing.precompute_columns(m, start_column, start_column + columns,
+                                     alpha, maxiter)
+    elapsed = time.time() - start
+
+    return max(elapsed, 1e-9) / max(columns, 1)
+
+
+def _dense_flop_seconds(size=256):
+    """
+    Measured seconds per floating point operation of a dense solve. It does
+    not depend on the matrix, so it is measured once.
+    """
+    if not _dense_flop_time:
+        a = np.identity(size) + np.random.RandomState(0).rand(size, size) / size
+        best = None
+        for _ in range(3):
+            start = time.time()
+            np.linalg.solve(a, a)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        flops = (2.0 / 3 + 2.0) * size**3
+        _dense_flop_time.append(max(best, 1e-9) / flops)
+
+    return _dense_flop_time[0]
+
+
+def available_memory():
+    """
+    Bytes of physical memory currently available, or None if unknown.
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimate_strategies(m, alpha=0.9, maxiter=1000, block_size=256, n_jobs=1):
+    """
+    Predicts time (seconds) and peak memory (bytes) of each precompute
+    strategy for a normalized matrix m.
+
+    Arguments:
+        m:          sparse matrix (normalized)
+        (see preprocessing.precompute_matrix for the rest)
+
+    Returns:
+        A list with a dictionary per strategy: strategy, time and memory,
+        in the order of STRATEGIES.
+    """
+    features = matrix_features(m)
+    n = float(features['n'])
+    nnz = float(features['nnz'])
+    n_jobs = max(1, n_jobs)
+    block = float(min(block_size, max(n, 1)))
+
+    product_time = _sparse_product_time(m)
+    column_time = _column_time(m, alpha, maxiter, block_size)
+    flop_time = _dense_flop_seconds()
+
+    output_bytes = 8 * n * n
+    matrix_bytes = 12 * nnz + 4 * (n + 1)
+    # Identity block, current block and the temporaries of one iteration
+    block_bytes = 4 * 8 * n * block
+    iteration_time = n * column_time / n_jobs
+
+    lu_nnz = min(n * n, n + features['envelope'])
+    factorization_time = features['factor_flops'] * flop_time * SPARSE_FLOP_PENALTY
+    solve_time = n * 2 * lu_nnz * product_time / n_jobs
+
+    return [{'strategy': 'dense',
+             'time': 2.0 * n**3 * flop_time,
+             'memory': 3 * output_bytes},
+            {'strategy': 'factorized',
+             'time': factorization_time + solve_time,
+             'memory': output_bytes + 12 * lu_nnz + matrix_bytes + n_jobs * block_bytes / 2},
+            {'strategy': 'iterative',
+             'time': iteration_time,
+             'memory': output_bytes + matrix_bytes + n_jobs * block_bytes},
+            {'strategy': 'out_of_core',
+             'time': iteration_time + output_bytes / DISK_BANDWIDTH,
+             'memory': matrix_bytes + n_jobs * block_bytes}]
+
+
+def choose_strategy(estimates, memory_limit=None, out_of_core=True):
+    """
+    The fastest strategy that fits in memory_limit bytes (no limit if None).
+    If none fits, the one that uses least memory.
+
+    Arguments:
+        estimates:      as returned by estimate_strategies
+        out_of_core:    whether out_of_core may be chosen (it needs a file)
+    """
+    candidates = [e for e in estimates
+                  if out_of_core or e['strategy'] != 'out_of_core']
+    fitting = [e for e in candidates
+               if memory_limit is None or e['memory'] <= memory_limit]
+
+    if fitting:
+        return min(fitting, key=lambda e: e['time'])
+
+    return min(candidates, key=lambda e: e['memory'])
+
+
+def precompute(m, alpha=0.9, maxiter=1000, block_size=256, n_jobs=1,
+               strategy='auto', filename=None, memory_limit=None,
+               ordering='none', precision='double'):
+    """
+    Precomputes a normalized matrix with the given strategy, or with the
+    one estimate_strategies and choose_strategy pick for it if 'auto'. The
+    choice and the estimates are logged.
+
+    Arguments:
+        m:              sparse matrix (normalized)
+        strategy:       'auto' or one of STRATEGIES
+        filename:       .npy file for the out_of_core strategy. Auto never
+                        picks out_of_core if it is None.
+        memory_limit:   bytes auto may use. Available memory if None.
+        ordering:       node order the solvers work in (see
+                        preprocessing.node_order)
+        precision:      of the iterative solvers (see
+                        preprocessing.precompute_matrix)
+        (see preprocessing.precompute_matrix for the rest)
+
+    Returns:
+        The precomputed matrix (memory mapped from filename if out_of_core)
+    """
+    validate_strategy(strategy)
+
+    if strategy == 'auto':
+        if memory_limit is None:
+            memory_limit = available_memory()
+
+        estimates = estimate_strategies(m, alpha, maxiter, block_size, n_jobs)
+        for e in estimates:
+            log.info("Precompute strategy {}: {:.1f} s, {:.1f} MB".format(
+                e['strategy'], e['time'], e['memory'] / 1e6))
+
+        strategy = choose_strategy(estimates, memory_limit,
+                                   out_of_core=filename is not None)['strategy']
+        log.info("Chosen precompute strategy for {}x{} matrix: {}".format(
+            m.shape[0], m.shape[1], strategy))
+
+    if strategy == 'out_of_core':
+        if filename is None:
+            raise ValueError("out_of_core precompute needs an output file")
+
+        return preprocessing.precompute_to_file(m, filename, alpha=alpha,
+                                                maxiter=maxiter,
+                                                block_size=block_size,
+                                                n_jobs=n_jobs, log=log,
+                                                ordering=ordering,
+                                                precision=precision)
+
+    return preprocessing.precompute_matrix(m, alpha=alpha, maxiter=maxiter,
+                                           block_size=block_size,
+                                           solver=strategy, n_jobs=n_jobs,
+                                           ordering=ordering,
+                                           precision=precision)
@@ -11,99 +11,897 @@ Ported from Victor Martínez Octave version.
 
 import scipy.sparse as sparse
 import numpy as np
-import time
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import warnings
+from scipy.stats import rankdata
+from scipy.sparse.csgraph import connected_components, reverse_cuthill_mckee
+import prophtools.utils.solvers as solvers
 
 
-def LG(F, alpha, C_H, maxiter):
-    initial_F = F
-    for iter in range(maxiter):
-        old_F = F
-        F = alpha * C_H * old_F + (1-alpha) * initial_F
-        if not ((max(max(abs(F - old_F)))) > 1e-9):
-            break
+ORDERINGS = ['none', 'rcm', 'degree']
 
-    return [initial_F, F]
 
+# method is 'power' (fixed point iteration, in place, until no entry
+# changes by more than 1e-9), 'cg' or 'bicgstab' (see
+# solvers.iterative_solve), and x0 an initial guess of F (warm start).
+# precision 'mixed' iterates in single precision (see
+# solvers.refined_iteration). With return_info, the iterations and final
+# residual of each query follow.
+def LG(F, alpha, C_H, maxiter, method='power', preconditioner='none', x0=None,
+       return_info=False, precision='double'):
+    solvers.validate_method(method)
+    solvers.validate_precision(precision, method)
+    if method != 'power':
+        result = solvers.iterative_solve(C_H, F, alpha, method, preconditioner,
+                                         x0, maxiter=maxiter)
+    elif precision == 'mixed':
+        result = solvers.refined_iteration(C_H, F, alpha, maxiter, tol=1e-9,
+                                           norm='max', x0=x0)
+    else:
+        result = solvers.power_iteration(C_H, F, alpha, maxiter, tol=1e-9,
+                                         norm='max', x0=x0)
 
-def estimate_precomputing_time(m, iterations=5):
-    expected_time = 0.0
+    if return_info:
+        return [F] + result
+    return [F, result[0]]
 
-    if iterations > 0:
-        n_iterations_max = iterations
 
-        n_iterations = min(n_iterations_max, m.shape[0])
-        times = np.zeros(n_iterations)
+def estimate_precomputing_time(m, iterations=None):
+    """
+    Predicted seconds to precompute m by blocked iteration. Kept for
+    compatibility: planner.estimate_strategies predicts time and memory of
+    every precompute strategy.
+
+    iterations (the number of columns that used to be timed) is deprecated
+    and ignored, as the estimate now times a block of columns, except that
+    0 still gives 0.
+    """
+    if iterations is not None:
+        warnings.warn("estimate_precomputing_time: iterations is deprecated "
+                      "and ignored", DeprecationWarning, stacklevel=2)
+        if iterations <= 0:
+            return 0.0
+
+    # planner depends on this module
+    import prophtools.utils.planner as planner
+    estimates = planner.estimate_strategies(m)
+    return [e['time'] for e in estimates if e['strategy'] == 'iterative'][0]
+
+
+def validate_ordering(ordering):
+    if ordering not in ORDERINGS:
+        msg = "Unknown node ordering: {}. Available: {}".format(
+            ordering, ', '.join(ORDERINGS))
+        raise ValueError(msg)
+
 
-        output = sparse.lil_matrix((m.shape))
-        query = np.zeros((m.shape[0], 1))
+def node_order(m, ordering='rcm'):
+    """
+    Permutation of the nodes of a network for the solvers to work on.
+
+    Node ids usually come in arbitrary order, so the neighbours of a node
+    are scattered over the vectors a sparse product reads. Reverse
+    Cuthill-McKee ('rcm') numbers neighbours close together, which gives a
+    banded matrix whose products read vectors almost sequentially; 'degree'
+    numbers nodes by decreasing degree, so the rows of the hubs, read most
+    often, are kept together.
 
-        for i in range(n_iterations):
-            start = time.clock()
-            query[i] = 1
-            [temp, precomp_score] = LG(query, 0.9, m, 1000)
-            output[:, i] = precomp_score
-            query[i] = 0
-            end = time.clock()
-            times[i] = end-start
+    Arguments:
+        m:          matrix (sparse or dense)
+        ordering:   'none', 'rcm' or 'degree'
 
-        average_time = np.mean(times)
+    Returns:
+        The permutation (position i holds the original index of node i in
+        the new order), or None for 'none'.
+    """
+    validate_ordering(ordering)
+    if ordering == 'none':
+        return None
 
-        expected_time = average_time * m.shape[0]
+    m = sparse.csr_matrix(m)
+    if ordering == 'rcm':
+        return reverse_cuthill_mckee(m, symmetric_mode=False).astype(int)
 
-    return expected_time
+    degrees = np.diff(m.indptr) + np.diff(sparse.csc_matrix(m).indptr)
+    return np.argsort(-degrees, kind='mergesort')
 
 
-def precompute_matrix(m):
+def reorder(m, permutation):
+    """
+    m with rows and columns in the order of permutation (see node_order),
+    as a csr matrix.
+    """
+    m = sparse.csr_matrix(m, dtype=float)
+    if permutation is None:
+        return m
+
+    return sparse.csr_matrix(m[permutation][:, permutation])
+
+
+def precompute_matrix(m, alpha=0.9, maxiter=1000, block_size=256, out=None,
+                      solver='iterative', n_jobs=1, ordering='none',
+                      precision='double'):
     """
     Returns the precomputed matrix for a normalized adjacency matrix m.
     m Must be normalized.
 
     Returns a dense matrix (precomputed values are always dense)
 
+    Columns are computed in blocks of block_size, each block as a single
+    propagation of the matching identity columns (see precompute_columns).
+
+    Arguments:
+        m:          sparse matrix (normalized)
+        alpha:      restart probability
+        maxiter:    maximum number of iterations per column
+        block_size: number of columns propagated at once. Memory used by the
+                    propagation grows as m.shape[0] * block_size.
+        out:        optional preallocated output (for instance a memmap).
+                    A new array is created if None.
+        solver:     'iterative' propagates the identity columns. 'factorized'
+                    factorizes I - alpha * m once and solves for them.
+                    'dense' inverts I - alpha * m as a dense matrix (see
+                    precompute_dense, block_size and n_jobs are ignored).
+        n_jobs:     number of processes computing blocks of columns (-1 for
+                    one per CPU). Workers write their blocks straight into a
+                    memmapped output, see precompute_matrix_parallel.
+        ordering:   node order the columns are computed in (see node_order).
+                    The result is in the original order either way.
+        precision:  'mixed' runs the iterative solver in single precision
+                    with double precision corrections (see
+                    solvers.refined_iteration). Other solvers ignore it.
+    """
+    solvers.validate_solver(solver, solvers.PRECOMPUTE_SOLVERS)
+    solvers.validate_precision(precision)
+    if not sparse.isspmatrix_csr(m):
+        m = sparse.csr_matrix(m, dtype=float)
+
+    if solver == 'dense':
+        return precompute_dense(m, alpha, out)
+
+    permutation = node_order(m, ordering)
+    m = reorder(m, permutation)
+
+    if n_jobs < 0:
+        n_jobs = multiprocessing.cpu_count()
+
+    if n_jobs > 1:
+        return precompute_matrix_parallel(m, alpha, maxiter, block_size, out,
+                                          solver, n_jobs, permutation, precision)
+
+    if out is None:
+        out = np.zeros(m.shape)
+
+    factorization = None
+    if solver == 'factorized':
+        factorization = solvers.factorize(m, alpha)
+
+    for _ in compute_blocks(m, column_blocks(m.shape[1], block_size), out,
+                            alpha, maxiter, factorization,
+                            permutation=permutation, precision=precision):
+        pass
+
+    return out
+
+
+def multi_alpha_precompute(m, alphas, maxiter=1000, block_size=256, out=None,
+                           ordering='none'):
+    """
+    Precomputed matrices of a normalized matrix m for every restart
+    probability in alphas, in a single pass: each block of identity
+    columns is propagated for all of them with the same sparse products
+    (see solvers.series_iteration, with the criterion of LG).
+
+    Arguments:
+        m:          sparse matrix (normalized)
+        alphas:     restart probabilities, in [0, 1)
+        block_size: number of columns propagated at once. Memory used by the
+                    propagation grows as len(alphas) * m.shape[0] * block_size.
+        out:        optional preallocated output of shape
+                    (len(alphas),) + m.shape (for instance a memmap). A new
+                    array is created if None.
+        ordering:   node order the columns are computed in (see node_order).
+                    The result is in the original order either way.
+
+    Returns:
+        The precomputed matrices stacked in out, out[i] the one for
+        alphas[i].
+    """
+    alphas = solvers.validate_alphas(alphas)
+    m = sparse.csr_matrix(m, dtype=float)
+    permutation = node_order(m, ordering)
+    m = reorder(m, permutation)
+
+    if out is None:
+        out = np.zeros((len(alphas),) + m.shape)
+
+    inverse = None
+    if permutation is not None:
+        inverse = np.argsort(permutation)
+
+    for start, stop in column_blocks(m.shape[1], block_size):
+        identity = np.zeros((m.shape[0], stop - start))
+        identity[np.arange(start, stop), np.arange(stop - start)] = 1.0
+        [blocks, _, _] = solvers.series_iteration(m, identity, alphas, maxiter,
+                                                  tol=1e-9, norm='max')
+        for i in range(len(alphas)):
+            _write_block(out[i], blocks[i], start, stop, permutation, inverse)
+
+    return out
+
+
+def precompute_dense(m, alpha=0.9, out=None):
+    """
+    Precomputed matrix of m as (1 - alpha) * inv(I - alpha * m), by dense
+    inversion. It is exact, but takes O(n^3) time and holds a few n x n
+    matrices, so it only pays off on small networks.
+    """
+    if sparse.issparse(m):
+        m = m.toarray()
+
+    system = np.identity(m.shape[0]) - alpha * np.asarray(m)
+    result = (1 - alpha) * np.linalg.inv(system)
+
+    if out is None:
+        return result
+
+    out[:, :] = result
+    return out
+
+
+def column_blocks(n_columns, block_size, start=0):
+    """
+    Returns the (start, stop) bounds of consecutive blocks of block_size
+    columns, from column start to n_columns.
+    """
+    return [(i, min(i + block_size, n_columns))
+            for i in range(start, n_columns, block_size)]
+
+
+def _precompute_block(m, start, stop, alpha, maxiter, factorization=None,
+                      precision='double'):
+    if factorization is not None:
+        identity = np.zeros((m.shape[0], stop - start))
+        identity[np.arange(start, stop), np.arange(stop - start)] = 1.0
+        return solvers.factorized_solve(factorization, identity, alpha)
+
+    return precompute_columns(m, start, stop, alpha, maxiter, precision)
+
+
+def _write_block(out, block, start, stop, permutation=None, inverse=None):
+    """
+    Writes the block of columns start to stop of the precomputed matrix of
+    a reordered matrix (see reorder) into out, in the original order.
+    """
+    if permutation is None:
+        out[:, start:stop] = block
+    else:
+        out[:, permutation[start:stop]] = block[inverse]
+
+
+# State shared by the precompute workers. It is set before the pool forks,
+# so the matrix (and its factorization) is not pickled to each worker.
+_worker_state = {}
+
+
+def _precompute_worker(block):
+    state = _worker_state
+    start, stop = block
+    out = np.memmap(state['filename'], dtype=state['dtype'], mode='r+',
+                    shape=state['shape'], order=state['order'],
+                    offset=state['offset'])
+    block_values = _precompute_block(state['m'], start, stop, state['alpha'],
+                                     state['maxiter'], state['factorization'],
+                                     state['precision'])
+    _write_block(out, block_values, start, stop, state['permutation'],
+                 state['inverse'])
+    out.flush()
+    del out
+    return block
+
+
+def compute_blocks(m, blocks, out, alpha=0.9, maxiter=1000,
+                   factorization=None, n_jobs=1, permutation=None,
+                   precision='double'):
+    """
+    Writes the given blocks of columns of the precomputed matrix of m into
+    out. This is a generator: it yields the bounds of each block, in order,
+    once the block is written.
+
+    With n_jobs > 1, blocks are computed by a pool of processes which write
+    them to the file of out, so out must be a file backed memmap.
+
+    Arguments:
+        m:              csr sparse matrix (normalized)
+        blocks:         list of (start, stop) column bounds
+        out:            output matrix
+        factorization:  factorization of I - alpha * m (solvers.factorize)
+                        if blocks are to be solved with it, None to iterate.
+        permutation:    if m was reordered with it (see reorder), blocks are
+                        columns of the reordered matrix, and they are
+                        written to out in the original order.
+        precision:      of the iterative solver (see precompute_matrix).
+    """
+    inverse = None
+    if permutation is not None:
+        inverse = np.argsort(permutation)
+
+    if n_jobs <= 1:
+        for start, stop in blocks:
+            _write_block(out, _precompute_block(m, start, stop, alpha, maxiter,
+                                                factorization, precision),
+                         start, stop, permutation, inverse)
+            yield (start, stop)
+        return
+
+    out.flush()
+    _worker_state.clear()
+    _worker_state.update({'m': m,
+                          'alpha': alpha,
+                          'maxiter': maxiter,
+                          'factorization': factorization,
+                          'precision': precision,
+                          'permutation': permutation,
+                          'inverse': inverse,
+                          'filename': out.filename,
+                          'dtype': out.dtype,
+                          'shape': out.shape,
+                          'order': 'F' if np.isfortran(out) else 'C',
+                          'offset': out.offset})
+
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        for block in pool.imap(_precompute_worker, blocks):
+            yield block
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _worker_state.clear()
+
+
+def precompute_matrix_parallel(m, alpha=0.9, maxiter=1000, block_size=256,
+                               out=None, solver='iterative', n_jobs=2,
+                               permutation=None, precision='double'):
+    """
+    precompute_matrix on a pool of n_jobs processes. Each worker solves a
+    block of columns at a time and writes it into a memmapped output, so
+    blocks are never sent back to the parent and each worker only holds
+    m.shape[0] * block_size values besides the shared matrix.
+
+    If out is a memmap, blocks are written to its file directly. Otherwise
+    they are written to a temporary file, which is copied to out (or to a
+    new array) and removed afterwards.
+
+    m may be already reordered with permutation (see compute_blocks).
+    """
+    solvers.validate_solver(solver)
+    if not sparse.isspmatrix_csr(m):
+        m = sparse.csr_matrix(m, dtype=float)
+
+    tmp_filename = None
+    if isinstance(out, np.memmap) and out.filename is not None:
+        target = out
+    else:
+        tmp_fd, tmp_filename = tempfile.mkstemp(suffix='.dat')
+        os.close(tmp_fd)
+        # Column major, so every block is a contiguous region of the file.
+        target = np.memmap(tmp_filename, dtype=float, mode='w+',
+                           shape=m.shape, order='F')
+
+    factorization = None
+    if solver == 'factorized':
+        factorization = solvers.factorize(m, alpha)
+
+    for _ in compute_blocks(m, column_blocks(m.shape[1], block_size), target,
+                            alpha, maxiter, factorization, n_jobs, permutation,
+                            precision):
+        pass
+
+    if tmp_filename is None:
+        return out
+
+    try:
+        if out is None:
+            out = np.array(target)
+        else:
+            out[:, :] = target
+    finally:
+        del target
+        os.remove(tmp_filename)
+
+    return out
+
+
+def precompute_to_file(m, filename, alpha=0.9, maxiter=1000, block_size=256,
+                       solver='iterative', n_jobs=1, log=None, ordering='none',
+                       precision='double'):
+    """
+    Out of core precompute_matrix. Blocks of columns are streamed into a
+    memmapped .npy file, so the precomputed matrix never has to fit in
+    memory.
+
+    After each block, the number of finished columns is saved to a
+    checkpoint file (filename + '.checkpoint'), together with a fingerprint
+    of m. If the process is killed, calling this again with the same
+    arguments resumes from the first unfinished block. If m changed in
+    between, the checkpoint is ignored and all columns are computed again.
+    The checkpoint is removed once all columns are done.
+
+    The result can be opened without reading it with
+    np.load(filename, mmap_mode='r').
+
+    Arguments:
+        m:          sparse matrix (normalized)
+        filename:   .npy output file
+        log:        optional logger for progress messages
+        (see precompute_matrix for the rest)
+
+    Returns:
+        The precomputed matrix, memory mapped from filename.
+    """
+    solvers.validate_solver(solver)
+    solvers.validate_precision(precision)
+    permutation = node_order(m, ordering)
+    m = reorder(m, permutation)
+
+    if n_jobs < 0:
+        n_jobs = multiprocessing.cpu_count()
+
+    checkpoint = filename + '.checkpoint'
+    fingerprint = _matrix_fingerprint(m)
+    done = _read_checkpoint(checkpoint, filename, m.shape, alpha, ordering,
+                            fingerprint)
+
+    if done is None:
+        out = np.lib.format.open_memmap(filename, mode='w+', dtype=float,
+                                        shape=m.shape)
+        done = 0
+        _write_checkpoint(checkpoint, done, alpha, ordering, fingerprint)
+    else:
+        out = np.lib.format.open_memmap(filename, mode='r+')
+        if log:
+            log.info("Resuming precompute of {} from column {}".format(
+                filename, done))
+
+    factorization = None
+    if solver == 'factorized':
+        factorization = solvers.factorize(m, alpha)
+
+    blocks = column_blocks(m.shape[1], block_size, start=done)
+    for start, stop in compute_blocks(m, blocks, out, alpha, maxiter,
+                                      factorization, n_jobs, permutation,
+                                      precision):
+        out.flush()
+        _write_checkpoint(checkpoint, stop, alpha, ordering, fingerprint)
+        if log:
+            log.info("Precomputed {} of {} columns".format(stop, m.shape[1]))
+
+    del out
+    os.remove(checkpoint)
+
+    return np.load(filename, mmap_mode='r')
+
+
+def _matrix_fingerprint(m):
+    """
+    Identifies the contents of sparse matrix m: its number of nonzeros and a
+    sha1 hash of its shape and csr arrays (indptr, indices and data), as
+    'nnz:hexdigest'. Duplicate entries are summed and indices sorted first,
+    so equal matrices give the same fingerprint however they were built.
+    """
+    m = sparse.csr_matrix(m, dtype=float, copy=True)
+    m.sum_duplicates()
+
+    digest = hashlib.sha1(np.array(m.shape, dtype=np.int64).tostring())
+    for values in [m.indptr.astype(np.int64), m.indices.astype(np.int64),
+                   m.data]:
+        digest.update(np.ascontiguousarray(values).tostring())
+
+    return "{}:{}".format(m.nnz, digest.hexdigest())
+
+
+def _read_checkpoint(checkpoint, filename, shape, alpha, ordering='none',
+                     fingerprint=None):
+    """
+    Number of finished columns recorded in a checkpoint, or None if there is
+    nothing to resume (no checkpoint or output file, or they were made for
+    another matrix, alpha or node ordering). Checkpoints without ordering
+    were made in the original order. When fingerprint is given (see
+    _matrix_fingerprint), checkpoints without one or with another one are
+    not resumed either, since their columns may come from another matrix.
+    """
+    if not (os.path.exists(checkpoint) and os.path.exists(filename)):
+        return None
+
+    with open(checkpoint) as f:
+        fields = f.read().split()
+
+    try:
+        existing = np.load(filename, mmap_mode='r')
+    except (IOError, ValueError):
+        return None
+
+    if len(fields) == 2:
+        fields.append('none')
+
+    if len(fields) == 3:
+        fields.append(None)
+
+    if (len(fields) != 4 or existing.shape != shape or
+            float(fields[1]) != alpha or fields[2] != ordering or
+            existing.dtype != float):
+        return None
+
+    if fingerprint is not None and fields[3] != fingerprint:
+        return None
+
+    return int(fields[0])
+
+
+def _write_checkpoint(checkpoint, done, alpha, ordering='none',
+                      fingerprint=None):
+    # Written aside and renamed, so a kill never leaves a partial checkpoint
+    tmp_checkpoint = checkpoint + '.tmp'
+    fields = [str(done), repr(alpha), ordering]
+    if fingerprint is not None:
+        fields.append(fingerprint)
+    with open(tmp_checkpoint, 'w') as f:
+        f.write(" ".join(fields) + "\n")
+    os.rename(tmp_checkpoint, checkpoint)
+
+
+def precompute_columns(m, start, stop, alpha=0.9, maxiter=1000, precision='double'):
+    """
+    Returns columns start to stop of the precomputed matrix of m, as a dense
+    m.shape[0] x (stop - start) array.
+
+    The identity columns are propagated together, in place, with sparse
+    matrix by dense block products until they converge (same criterion as
+    LG, see solvers.power_iteration).
+
     Arguments:
-        m:      sparse matrix (normalized)
+        m:          csr sparse matrix (normalized)
     """
+    n_columns = stop - start
+    initial_F = np.zeros((m.shape[0], n_columns))
+    initial_F[np.arange(start, stop), np.arange(n_columns)] = 1.0
 
-    output = sparse.lil_matrix((m.shape))
-    query = np.zeros((m.shape[0], 1))   # Divides time ten-fold
+    [_, F] = LG(initial_F, alpha, m, maxiter, precision=precision)
+    return F
+
+
+def push_precompute(m, alpha=0.9, tol=1e-4, block_size=256, maxiter=1000):
+    """
+    Sparse approximation of the precomputed matrix of m by forward push.
+
+    Each column j keeps an estimate p and a residual r, starting from
+    p = 0 and r = e_j, such that column j of P is p + P * r. Pushing the
+    residual of node u moves (1 - alpha) * r_u to p_u and spreads
+    alpha * r_u over the neighbours of u (as P = (1 - alpha) I + alpha m P),
+    which keeps that invariant. Only residuals larger than tol are pushed,
+    so the work and the nonzeros of each column depend on tol and on the
+    neighbourhood of j, not on the size of the network.
+
+    All residuals above tol of a block of columns are pushed together, as a
+    sparse by sparse product.
+
+    Arguments:
+        m:          sparse matrix (normalized)
+        tol:        largest residual left unpushed
+        maxiter:    maximum number of push rounds per block
+
+    Returns:
+        csr sparse matrix
+    """
+    m = sparse.csr_matrix(m, dtype=float)
+    n = m.shape[0]
+    blocks = []
+    for start, stop in column_blocks(n, block_size):
+        n_columns = stop - start
+        residual = sparse.csc_matrix((np.ones(n_columns),
+                                      (np.arange(start, stop), np.arange(n_columns))),
+                                     shape=(n, n_columns))
+        estimate = sparse.csc_matrix((n, n_columns))
+        for iter in range(maxiter):
+            pushed = abs(residual.data) > tol
+            if not pushed.any():
+                break
+
+            active = residual.copy()
+            active.data[~pushed] = 0
+            active.eliminate_zeros()
+            residual.data[pushed] = 0
+            residual.eliminate_zeros()
+
+            estimate = estimate + (1-alpha) * active
+            residual = residual + alpha * (m * active)
+
+        blocks.append(estimate)
+
+    if not blocks:
+        return sparse.csr_matrix((n, n))
+
+    return sparse.csr_matrix(sparse.hstack(blocks))
+
+
+def sparsify(m, epsilon=0.0, top=None, block_size=1024):
+    """
+    Sparse copy of a precomputed matrix without its small entries: those
+    with absolute value at most epsilon and, if top is given, all but the
+    top largest (in absolute value) of each row.
+
+    Rows are read in blocks, so memory mapped matrices are never loaded
+    in memory as a whole.
+
+    Arguments:
+        m:          dense matrix (array, np.matrix or memmap) or sparse matrix
+        epsilon:    largest absolute value dropped
+        top:        number of entries kept per row (all if None)
+        block_size: number of rows read at once
+
+    Returns:
+        csr sparse matrix
+    """
+    n_rows = m.shape[0]
+    n_cols = m.shape[1]
+    if sparse.issparse(m):
+        m = sparse.csr_matrix(m)
+
+    blocks = []
+    for start, stop in column_blocks(n_rows, block_size):
+        block = m[start:stop]
+        if sparse.issparse(block):
+            block = block.toarray()
+        block = np.asarray(block, dtype=float)
+
+        magnitudes = abs(block)
+        keep = magnitudes > epsilon
+        if top is not None and top < n_cols:
+            largest = np.argpartition(-magnitudes, top - 1, axis=1)[:, :top]
+            in_top = np.zeros(block.shape, dtype=bool)
+            in_top[np.arange(stop - start)[:, np.newaxis], largest] = True
+            keep &= in_top
+
+        blocks.append(sparse.csr_matrix(np.where(keep, block, 0)))
+
+    if not blocks:
+        return sparse.csr_matrix((n_rows, n_cols))
+
+    return sparse.csr_matrix(sparse.vstack(blocks))
+
+
+def row_statistics(m, block_size=1024):
+    """
+    Returns the mean and the norm of the centered rows of a precomputed
+    matrix, which is all Pearson correlation needs to know about them.
+
+    Rows are read in blocks, so memory mapped matrices are never loaded
+    in memory as a whole.
+
+    Sparse matrices are not densified: the centered norms come from the
+    sums of squares of their nonzeros.
+
+    Arguments:
+        m:          dense matrix (array, np.matrix or memmap) or sparse matrix
+        block_size: number of rows read at once
+
+    Returns:
+        [means, norms], two arrays of length m.shape[0]
+    """
+    n_rows = m.shape[0]
+    n_cols = m.shape[1]
+    if sparse.issparse(m):
+        m = sparse.csr_matrix(m, dtype=float)
+        means = np.ravel(m.sum(axis=1)) / n_cols
+        squares = np.ravel(m.multiply(m).sum(axis=1)) - n_cols * means**2
+        return [means, np.sqrt(np.maximum(squares, 0))]
+
+    means = np.zeros(n_rows)
+    norms = np.zeros(n_rows)
+
+    for start in range(0, n_rows, block_size):
+        stop = min(start + block_size, n_rows)
+        block = np.asarray(m[start:stop], dtype=float)
+        block_means = block.sum(axis=1) / n_cols
+        centered = block - block_means[:, np.newaxis]
+        means[start:stop] = block_means
+        norms[start:stop] = np.sqrt((centered * centered).sum(axis=1))
+
+    return [means, norms]
+
+
+def component_labels(m):
+    """
+    Connected component of each node of a network (ignoring edge
+    direction). Components are numbered by decreasing size, and nodes
+    without edges get -1 instead: their precomputed row and column are
+    (1 - alpha) on the diagonal and zero elsewhere.
+
+    The precomputed matrix has no entries between different components,
+    so each can be precomputed on its own.
+
+    Arguments:
+        m:      matrix (sparse or dense)
+
+    Returns:
+        array of length m.shape[0]
+    """
+    m = sparse.csr_matrix(m)
+    degrees = np.diff(m.indptr) + np.diff(sparse.csc_matrix(m).indptr)
+    [_, labels] = connected_components(m, directed=True, connection='weak')
+
+    connected = degrees > 0
+    [components, relabeled, sizes] = np.unique(labels[connected],
+                                               return_inverse=True,
+                                               return_counts=True)
+    # Stable, so equal sized components keep the order of their first node
+    by_size = np.argsort(-sizes, kind='mergesort')
+    rank = np.empty(len(components), dtype=int)
+    rank[by_size] = np.arange(len(components))
+
+    result = -np.ones(m.shape[0], dtype=int)
+    result[connected] = rank[relabeled]
+    return result
+
+
+def component_nodes(labels):
+    """
+    Nodes of each component of component_labels, in increasing order.
+
+    Returns:
+        A list of arrays, one per component
+    """
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind='mergesort')
+    n_components = labels.max() + 1 if len(labels) else 0
+    bounds = np.searchsorted(labels[order], np.arange(n_components + 1))
+    return [order[bounds[c]:bounds[c + 1]] for c in range(n_components)]
+
+
+def streamed_row_statistics(m, alpha=0.9, maxiter=1000, block_size=256,
+                            factorization=None, labels=None):
+    """
+    Same as row_statistics, for the precomputed matrix of a normalized
+    matrix m, without storing it: columns are computed block by block and
+    only what row_statistics needs is kept from each block.
+
+    Row means come first from a single propagation (the precomputed matrix
+    times a vector of ones), so the centered norms are accumulated in one
+    pass over the blocks without cancellation.
+
+    Given the component_labels of m, columns are only computed within
+    their component (they are zero elsewhere), so the work grows with the
+    sum of the squared component sizes instead of with n squared.
+
+    Arguments:
+        m:              sparse matrix (normalized)
+        factorization:  factorization of I - alpha * m (solvers.factorize)
+                        to solve for the columns, None to iterate.
+        labels:         component_labels of m, to iterate per component.
+        (see precompute_matrix for the rest)
+
+    Returns:
+        [means, norms], two arrays of length m.shape[0]
+    """
+    if not sparse.isspmatrix_csr(m):
+        m = sparse.csr_matrix(m, dtype=float)
+
+    if labels is not None and factorization is None:
+        return _components_row_statistics(m, labels, alpha, maxiter, block_size)
+
+    n_columns = m.shape[1]
+    ones = np.ones((n_columns, 1))
+    if factorization is not None:
+        row_sums = solvers.factorized_solve(factorization, ones, alpha)
+    else:
+        [_, row_sums] = LG(ones, alpha, m, maxiter)
+
+    means = np.ravel(row_sums) / n_columns
+    squares = np.zeros(m.shape[0])
+    for start, stop in column_blocks(n_columns, block_size):
+        block = _precompute_block(m, start, stop, alpha, maxiter, factorization)
+        centered = block - means[:, np.newaxis]
+        squares += (centered * centered).sum(axis=1)
+
+    return [means, np.sqrt(squares)]
+
+
+def _components_row_statistics(m, labels, alpha, maxiter, block_size):
+    """
+    streamed_row_statistics, one component at a time. A row of a component
+    of s nodes is zero in the other n - s columns, which only add to its
+    centered norm (n - s) times its squared mean.
+    """
+    n = m.shape[1]
+    labels = np.asarray(labels)
+
+    means = np.zeros(n)
+    squares = np.zeros(n)
+
+    isolated = labels < 0
+    means[isolated] = (1 - alpha) / n
+    squares[isolated] = (1 - alpha - means[isolated])**2 + (n - 1) * means[isolated]**2
+
+    for nodes in component_nodes(labels):
+        s = len(nodes)
+        component = m[nodes][:, nodes]
+        [component_means, component_norms] = streamed_row_statistics(
+            component, alpha, maxiter, block_size)
+        means[nodes] = component_means * s / n
+        squares[nodes] = (component_norms**2 +
+                          s * (component_means - means[nodes])**2 +
+                          (n - s) * means[nodes]**2)
+
+    return [means, np.sqrt(squares)]
+
+
+def rank_rows(m, out=None):
+    """
+    Replaces each row of a precomputed matrix by its ranks (ties get the
+    average rank, as in spearmanr). Spearman correlation against the rows
+    then becomes Pearson correlation against the ranked rows.
+
+    Arguments:
+        m:      dense matrix (array, np.matrix or memmap) or sparse matrix,
+                which is densified one row at a time
+        out:    optional preallocated output (for instance a memmap). A new
+                array is created if None.
+
+    Returns:
+        The ranked matrix (out, if provided)
+    """
+    if out is None:
+        out = np.zeros(m.shape)
+
+    if sparse.issparse(m):
+        m = sparse.csr_matrix(m)
+        for i in range(m.shape[0]):
+            out[i] = rankdata(np.ravel(m.getrow(i).toarray()))
+        return out
 
     for i in range(m.shape[0]):
-        query[i] = 1
-        [temp, precomp_score] = LG(query, 0.9, m, 1000)
-        output[:, i] = precomp_score
-        query[i] = 0
+        out[i] = rankdata(np.ravel(m[i]))
 
-    return np.asarray(output.todense())
+    return out
 
 
 def normalize_matrix(m):
     """
-    Returns the normalized matrix for an adjacency matrix m.
+    Returns the normalized matrix for an adjacency matrix m, D1^-1/2 m D2^-1/2,
+    where D1 and D2 hold the row and column sums of m. Rows and columns that
+    add up to zero stay zero.
+
+    Sums are computed in bulk and the matrix is scaled by sparse diagonal
+    products (or broadcasting, if dense), so it takes time linear in the
+    number of nonzeros.
 
-    Keeps the type of matrix (dense or sparse)
+    Keeps the type of matrix (dense or sparse, sparse results are csr)
     Arguments:
         m:      csr_sparse matrix to normalize (sparse)
         
     """
-    diagonal1 = sparse.lil_matrix((m.shape[0], m.shape[0]))
-    diagonal2 = sparse.lil_matrix((m.shape[1], m.shape[1]))
+    row_factors = _inverse_sqrt_degrees(m.sum(axis=1))
+    column_factors = _inverse_sqrt_degrees(m.sum(axis=0))
 
-    for i in range(m.shape[0]):
-        value = m[i, :].sum()
-        if value > 0:
-            diagonal1[i, i] = value**(-0.5)
-        else:
-            diagonal1[i, i] = 0
+    if sparse.issparse(m):
+        output = (sparse.diags(row_factors) *
+                  sparse.csr_matrix(m, dtype=float) *
+                  sparse.diags(column_factors))
+        return sparse.csr_matrix(output)
 
-    for i in range(m.shape[1]):
-        value = m[:, i].sum()
-        if value > 0:
-            diagonal2[i, i] = value**(-0.5)
-        else:
-            diagonal2[i, i] = 0
+    output = np.multiply(m, row_factors[:, np.newaxis])
+    return np.multiply(output, column_factors[np.newaxis, :])
 
-    diagonal1 = sparse.lil_matrix(diagonal1)
-    diagonal2 = sparse.lil_matrix(diagonal2)
-    output = diagonal1 * m * diagonal2
 
-    return output
+def _inverse_sqrt_degrees(sums):
+    sums = np.ravel(np.asarray(sums, dtype=float))
+    factors = np.zeros(len(sums))
+    positive = sums > 0
+    factors[positive] = sums[positive]**(-0.5)
+    return factors
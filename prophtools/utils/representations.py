@@ -0,0 +1,878 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+"""
+.. module:: representations.py
+.. moduleauthor:: Carmen Navarro Luzon
+
+Compact representations of precomputed matrices. The dense n x n
+precomputed matrix P = (1 - alpha) * inv(I - alpha * W) is what limits the
+size of the networks ProphTools can handle, but prioritization only reads
+it through a few operations: blocks of rows (row statistics, ranks),
+columns (propagation of a query) and products with a block of vectors
+(correlation). Representations provide those without storing P.
+
+They are saved in .mat files as a few entries with the name of the network
+as prefix (see save and load). Sparse approximations (push, thresholded)
+are plain scipy sparse matrices, which are saved and read as such.
+Quantized (float16, uint8) and packed symmetric matrices can be kept in
+.npy files, which are referenced from the .mat file and memory mapped when
+loaded.
+"""
+
+import logging
+import os
+
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as splinalg
+
+import prophtools.utils.planner as planner
+import prophtools.utils.preprocessing as preprocessing
+import prophtools.utils.solvers as solvers
+
+
+REPRESENTATIONS = ['dense', 'spectral', 'push', 'thresholded', 'float16', 'uint8',
+                   'packed', 'components']
+
+# Components up to this size are inverted directly instead of planned
+DENSE_COMPONENT_SIZE = 1024
+
+QUANTIZED_TYPES = ['float16', 'uint8']
+
+log = logging.getLogger(__name__)
+
+
+def validate_representation(representation):
+    if representation not in REPRESENTATIONS:
+        msg = "Unknown precomputed representation: {}. Available: {}".format(
+            representation, ', '.join(REPRESENTATIONS))
+        raise ValueError(msg)
+
+
+class PrecomputedMatrix:
+    """
+    Base class of precomputed matrix representations. Subclasses implement
+    rows and dot, and store the shape.
+
+    Indexing with an integer or a slice reads rows, as in a dense matrix,
+    so representations can be used wherever precomputed rows are read.
+
+    exact tells whether the representation holds the precomputed matrix
+    itself, in double precision, rather than an approximation of it.
+    """
+    shape = (0, 0)
+    exact = False
+
+    def rows(self, start, stop):
+        """
+        Rows start to stop, as a dense (stop - start) x n array.
+        """
+        raise NotImplementedError
+
+    def dot(self, v):
+        """
+        Product with a vector or a n x k block of vectors.
+        """
+        raise NotImplementedError
+
+    def columns(self, index):
+        """
+        Columns in index (a list of integers), as a dense n x len(index)
+        array.
+        """
+        identity = np.zeros((self.shape[1], len(index)))
+        identity[index, np.arange(len(index))] = 1.0
+        return self.dot(identity)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.shape[0])
+            if step != 1:
+                raise IndexError("Precomputed rows must be read in contiguous blocks")
+            return self.rows(start, stop)
+
+        if isinstance(key, (int, long, np.integer)):
+            if key < 0:
+                key += self.shape[0]
+            return self.rows(key, key + 1)[0]
+
+        raise IndexError("Precomputed representations are indexed by rows")
+
+    def __len__(self):
+        return self.shape[0]
+
+
+class SpectralPrecomputed(PrecomputedMatrix):
+    """
+    Precomputed matrix of a symmetric normalized matrix W from its top k
+    eigenpairs. If W = U diag(l) U^T, then P = U diag(f(l)) U^T with
+    f(l) = (1 - alpha) / (1 - alpha * l). The largest eigenvalues give the
+    largest f, so the top k eigenpairs keep most of P.
+
+    The rest of the spectrum is not dropped but replaced by the f of its
+    mean eigenvalue (known from the trace of W), so the approximation is
+
+        U_k diag(f(l_k) - c) U_k^T + c I,    c = f(mean of the rest)
+
+    which keeps the strong diagonal of P. Changing alpha only changes f,
+    so with_alpha is immediate.
+
+    Args:
+        vectors:    n x k top eigenvectors of W.
+        values:     their k eigenvalues.
+        trace:      trace of W.
+        alpha:      restart probability.
+    """
+    def __init__(self, vectors, values, trace, alpha=0.9):
+        self.vectors = np.asarray(vectors, dtype=float)
+        self.values = np.ravel(np.asarray(values, dtype=float))
+        self.trace = float(trace)
+        self.alpha = alpha
+        self.shape = (self.vectors.shape[0], self.vectors.shape[0])
+
+        n, k = self.vectors.shape
+        self.rest_value = 0.0
+        if k < n:
+            self.rest_value = (self.trace - self.values.sum()) / (n - k)
+
+        self.rest_factor = self._kernel(self.rest_value)
+        self.factors = self._kernel(self.values) - self.rest_factor
+
+    def _kernel(self, values):
+        return (1 - self.alpha) / (1 - self.alpha * values)
+
+    def with_alpha(self, alpha):
+        """
+        Same representation for another restart probability.
+        """
+        return SpectralPrecomputed(self.vectors, self.values, self.trace, alpha)
+
+    def rows(self, start, stop):
+        block = np.dot(self.vectors[start:stop] * self.factors, self.vectors.T)
+        block[np.arange(stop - start), np.arange(start, stop)] += self.rest_factor
+        return block
+
+    def columns(self, index):
+        # P is symmetric
+        index = np.asarray(index)
+        block = np.dot(self.vectors, (self.vectors[index] * self.factors).T)
+        block[index, np.arange(len(index))] += self.rest_factor
+        return block
+
+    def dot(self, v):
+        v = np.asarray(v, dtype=float)
+        projection = np.dot(self.vectors.T, v)
+        if projection.ndim == 1:
+            scaled = projection * self.factors
+        else:
+            scaled = projection * self.factors[:, np.newaxis]
+
+        return np.dot(self.vectors, scaled) + self.rest_factor * v
+
+
+class QuantizedPrecomputed(PrecomputedMatrix):
+    """
+    Precomputed matrix stored with fewer bits per entry (see quantize),
+    dequantized one block of rows at a time, so a memory mapped matrix is
+    never loaded or converted as a whole.
+
+    Entry q of row i stands for offset[i] + scale[i] * q. float16 entries
+    are used as they are (scale 1, offset 0); uint8 entries use the minimum
+    of their row as offset and its range over 255 as scale.
+
+    Args:
+        values:     n x n float16 or uint8 array, possibly memory mapped.
+        scale:      per row scale (ones if None).
+        offset:     per row offset (zeros if None).
+        block_size: number of rows dequantized at once.
+    """
+    def __init__(self, values, scale=None, offset=None, block_size=1024):
+        self.values = values
+        self.shape = values.shape
+        self.block_size = block_size
+
+        if scale is None:
+            scale = np.ones(self.shape[0])
+        if offset is None:
+            offset = np.zeros(self.shape[0])
+
+        self.scale = np.ravel(np.asarray(scale, dtype=float))
+        self.offset = np.ravel(np.asarray(offset, dtype=float))
+
+    def rows(self, start, stop):
+        block = np.asarray(self.values[start:stop], dtype=float)
+        return block * self.scale[start:stop, np.newaxis] + self.offset[start:stop, np.newaxis]
+
+    def columns(self, index):
+        block = np.asarray(self.values[:, index], dtype=float)
+        return block * self.scale[:, np.newaxis] + self.offset[:, np.newaxis]
+
+    def dot(self, v):
+        # (offset + scale * q) . v = scale * (q . v) + offset * sum(v)
+        v = np.asarray(v, dtype=float)
+        sums = v.sum(axis=0)
+        result = np.zeros((self.shape[0],) + v.shape[1:])
+        for start, stop in preprocessing.column_blocks(self.shape[0], self.block_size):
+            products = np.dot(np.asarray(self.values[start:stop], dtype=float), v)
+            scale = self.scale[start:stop]
+            offset = self.offset[start:stop]
+            if v.ndim > 1:
+                scale = scale[:, np.newaxis]
+                offset = offset[:, np.newaxis]
+            result[start:stop] = products * scale + offset * sums
+
+        return result
+
+
+def is_exact(precomputed):
+    """
+    Whether a precomputed matrix (a representation, or a dense or sparse
+    matrix) holds the exact precomputed values in double precision. Sparse
+    ones (push, thresholded) drop entries, and memory save mode loads
+    dense ones in single precision.
+    """
+    if isinstance(precomputed, PrecomputedMatrix):
+        return precomputed.exact
+
+    if sparse.issparse(precomputed):
+        return False
+
+    return np.dtype(precomputed.dtype) == np.float64
+
+
+def quantize(m, dtype='uint8', filename=None, block_size=1024):
+    """
+    QuantizedPrecomputed representation of a precomputed matrix, read in
+    blocks of rows.
+
+    Arguments:
+        m:          dense matrix (array, np.matrix or memmap)
+        dtype:      'float16' or 'uint8'
+        filename:   .npy file for the quantized values, which are then
+                    memory mapped. In memory if None.
+    """
+    if dtype not in QUANTIZED_TYPES:
+        msg = "Unknown quantized type: {}. Available: {}".format(
+            dtype, ', '.join(QUANTIZED_TYPES))
+        raise ValueError(msg)
+
+    n_rows = m.shape[0]
+    if filename is None:
+        values = np.zeros(m.shape, dtype=dtype)
+    else:
+        values = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                           shape=m.shape)
+
+    scale = np.ones(n_rows)
+    offset = np.zeros(n_rows)
+    for start, stop in preprocessing.column_blocks(n_rows, block_size):
+        block = np.asarray(m[start:stop], dtype=float)
+        if dtype == 'uint8':
+            offset[start:stop] = block.min(axis=1)
+            ranges = block.max(axis=1) - offset[start:stop]
+            scale[start:stop] = np.where(ranges > 0, ranges / 255.0, 1.0)
+            block = np.rint((block - offset[start:stop, np.newaxis]) /
+                            scale[start:stop, np.newaxis])
+        values[start:stop] = block
+
+    if filename is not None:
+        values.flush()
+        del values
+        values = np.load(filename, mmap_mode='r')
+
+    return QuantizedPrecomputed(values, scale, offset)
+
+
+class PackedPrecomputed(PrecomputedMatrix):
+    """
+    Symmetric precomputed matrix stored as its upper triangle, row by row,
+    in a one dimensional array of n * (n + 1) / 2 entries: row i holds
+    entries i to n - 1 of row i of the matrix. The precomputed matrix of a
+    symmetric normalized network is symmetric, so this halves its size
+    without losing anything.
+
+    Entries left of the diagonal of a row are read from the rows above it,
+    where they are a column of contiguous segments.
+
+    Args:
+        values:     packed upper triangle, possibly memory mapped.
+        block_size: number of rows unpacked at once.
+    """
+    def __init__(self, values, block_size=1024):
+        self.values = values
+        n = int(round((np.sqrt(8 * len(values) + 1) - 1) / 2))
+        if n * (n + 1) // 2 != len(values):
+            raise ValueError("{} entries are not a packed triangle".format(len(values)))
+
+        self.shape = (n, n)
+        self.block_size = block_size
+        self.exact = np.dtype(values.dtype) == np.float64
+
+    def _upper_rows(self, start, stop):
+        """
+        Rows start to stop of the upper triangle, with zeros left of the
+        diagonal. Packed rows are contiguous, so this is a single read.
+        """
+        n = self.shape[0]
+        block = np.zeros((stop - start, n))
+        first, last = _packed_offsets(n, [start, stop])
+        block[_upper_mask(n, start, stop)] = self.values[first:last]
+        return block
+
+    def rows(self, start, stop):
+        block = self._upper_rows(start, stop)
+        inner = block[:, start:stop]
+        block[:, start:stop] = inner + np.triu(inner, 1).T
+
+        # Left of the block: rows j < start, columns start to stop
+        columns = np.arange(start, stop)
+        for j_start, j_stop in preprocessing.column_blocks(start, self.block_size):
+            above = np.arange(j_start, j_stop)
+            index = _packed_offsets(self.shape[0], above)[:, np.newaxis] + (columns[np.newaxis, :] - above[:, np.newaxis])
+            block[:, j_start:j_stop] = np.asarray(self.values[index], dtype=float).T
+
+        return block
+
+    def columns(self, index):
+        block = np.zeros((self.shape[0], len(index)))
+        for k, i in enumerate(index):
+            block[:, k] = self.rows(i, i + 1)[0]
+        return block
+
+    def dot(self, v):
+        # P = U + U^T - diag(U), reading each row of U once
+        v = np.asarray(v, dtype=float)
+        result = np.zeros((self.shape[0],) + v.shape[1:])
+        for start, stop in preprocessing.column_blocks(self.shape[0], self.block_size):
+            block = self._upper_rows(start, stop)
+            result[start:stop] += np.dot(block, v)
+            result += np.dot(block.T, v[start:stop])
+            diagonal = block[np.arange(stop - start), np.arange(start, stop)]
+            if v.ndim > 1:
+                diagonal = diagonal[:, np.newaxis]
+            result[start:stop] -= diagonal * v[start:stop]
+
+        return result
+
+
+def _packed_offsets(n, rows):
+    """
+    Position of the diagonal entry of each row in packed values.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    return rows * n - rows * (rows - 1) // 2
+
+
+def _upper_mask(n, start, stop):
+    """
+    Entries of rows start to stop on or right of the diagonal.
+    """
+    return np.arange(n)[np.newaxis, :] >= np.arange(start, stop)[:, np.newaxis]
+
+
+def _packed_values(n, dtype, filename):
+    size = n * (n + 1) // 2
+    if filename is None:
+        return np.zeros(size, dtype=dtype)
+
+    return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(size,))
+
+
+def _packed_result(values, filename):
+    if filename is not None:
+        values.flush()
+        del values
+        values = np.load(filename, mmap_mode='r')
+
+    return PackedPrecomputed(values)
+
+
+def is_symmetric(m, block_size=1024, tol=1e-8):
+    """
+    Whether a dense matrix equals its transpose (up to tol), comparing
+    blocks of rows with blocks of columns.
+    """
+    if m.shape[0] != m.shape[1]:
+        return False
+
+    for start, stop in preprocessing.column_blocks(m.shape[0], block_size):
+        rows = np.asarray(m[start:stop], dtype=float)
+        columns = np.asarray(m[:, start:stop], dtype=float)
+        if abs(rows - columns.T).max() > tol:
+            return False
+
+    return True
+
+
+def pack_symmetric(m, dtype='float64', filename=None, block_size=1024):
+    """
+    PackedPrecomputed representation of a symmetric precomputed matrix,
+    read in blocks of rows.
+
+    Arguments:
+        m:          dense matrix (array, np.matrix or memmap)
+        dtype:      type of the packed values
+        filename:   .npy file for the packed values, which are then memory
+                    mapped. In memory if None.
+    """
+    if not is_symmetric(m, block_size):
+        raise ValueError("Packed representation needs a symmetric matrix")
+
+    n = m.shape[0]
+    values = _packed_values(n, dtype, filename)
+    for start, stop in preprocessing.column_blocks(n, block_size):
+        block = np.asarray(m[start:stop], dtype=float)
+        first, last = _packed_offsets(n, [start, stop])
+        values[first:last] = block[_upper_mask(n, start, stop)]
+
+    return _packed_result(values, filename)
+
+
+def packed_precompute(m, alpha=0.9, maxiter=1000, block_size=256, solver='iterative',
+                      filename=None):
+    """
+    PackedPrecomputed representation of the precomputed matrix of a
+    symmetric normalized matrix m, computed a block of columns at a time
+    without ever holding the full matrix: by symmetry, columns start to
+    stop are also rows start to stop, whose upper triangle is packed.
+
+    Arguments:
+        m:          sparse matrix (normalized, symmetric)
+        solver:     'iterative' or 'factorized' (see precompute_matrix)
+        filename:   .npy file for the packed values (in memory if None)
+    """
+    m = sparse.csr_matrix(m, dtype=float)
+    n = m.shape[0]
+    if n and abs(m - m.T).max() > 1e-10:
+        raise ValueError("Packed representation needs a symmetric matrix")
+
+    factorization = None
+    if solver == 'factorized':
+        factorization = solvers.factorize(m, alpha)
+
+    values = _packed_values(n, 'float64', filename)
+    for start, stop in preprocessing.column_blocks(n, block_size):
+        if factorization is None:
+            columns = preprocessing.precompute_columns(m, start, stop, alpha, maxiter)
+        else:
+            identity = np.zeros((n, stop - start))
+            identity[np.arange(start, stop), np.arange(stop - start)] = 1.0
+            columns = solvers.factorized_solve(factorization, identity, alpha)
+
+        first, last = _packed_offsets(n, [start, stop])
+        values[first:last] = np.asarray(columns).T[_upper_mask(n, start, stop)]
+
+    return _packed_result(values, filename)
+
+
+class ComponentsPrecomputed(PrecomputedMatrix):
+    """
+    Precomputed matrix of a network with several connected components,
+    stored as one dense block per component. There are no entries between
+    components, and nodes without edges (label -1) are not stored at all:
+    their row and column are (1 - alpha) on the diagonal.
+
+    Components are numbered by decreasing size (see
+    preprocessing.component_labels), so blocks of equal size are adjacent
+    and products with them are computed together.
+
+    Args:
+        labels:     component of each node (preprocessing.component_labels).
+        values:     the blocks, flattened and concatenated by component,
+                    each with its nodes in increasing order.
+        alpha:      restart probability.
+    """
+    def __init__(self, labels, values, alpha=0.9):
+        self.labels = np.ravel(np.asarray(labels)).astype(int)
+        self.values = values
+        self.alpha = alpha
+        self.shape = (len(self.labels), len(self.labels))
+        self.exact = np.dtype(values.dtype) == np.float64
+
+        self.nodes = preprocessing.component_nodes(self.labels)
+        sizes = np.array([len(nodes) for nodes in self.nodes], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(sizes**2)])
+        if self.offsets[-1] != len(values):
+            raise ValueError("Components need {} values, got {}".format(
+                self.offsets[-1], len(values)))
+
+        # Position of each node in the block of its component
+        self.positions = np.zeros(self.shape[0], dtype=int)
+        for nodes in self.nodes:
+            self.positions[nodes] = np.arange(len(nodes))
+
+        # Runs of components of equal size: (first, last, size)
+        self.groups = []
+        for c, size in enumerate(sizes):
+            if self.groups and self.groups[-1][2] == size:
+                self.groups[-1][1] = c + 1
+            else:
+                self.groups.append([c, c + 1, size])
+
+        self.isolated = np.flatnonzero(self.labels < 0)
+
+    def block(self, c):
+        """
+        Precomputed block of component c.
+        """
+        size = len(self.nodes[c])
+        return np.asarray(self.values[self.offsets[c]:self.offsets[c + 1]],
+                          dtype=float).reshape(size, size)
+
+    def rows(self, start, stop):
+        result = np.zeros((stop - start, self.shape[1]))
+        labels = self.labels[start:stop]
+        for c in np.unique(labels):
+            rows = np.flatnonzero(labels == c)
+            if c < 0:
+                result[rows, rows + start] = 1 - self.alpha
+            else:
+                block = self.block(c)[self.positions[rows + start]]
+                result[np.ix_(rows, self.nodes[c])] = block
+
+        return result
+
+    def columns(self, index):
+        result = np.zeros((self.shape[0], len(index)))
+        for k, i in enumerate(index):
+            c = self.labels[i]
+            if c < 0:
+                result[i, k] = 1 - self.alpha
+            else:
+                result[self.nodes[c], k] = self.block(c)[:, self.positions[i]]
+
+        return result
+
+    def dot(self, v):
+        v = np.asarray(v, dtype=float)
+        result = np.zeros(v.shape)
+        result[self.isolated] = (1 - self.alpha) * v[self.isolated]
+
+        for first, last, size in self.groups:
+            blocks = np.asarray(self.values[self.offsets[first]:self.offsets[last]],
+                                dtype=float).reshape(last - first, size, size)
+            nodes = np.concatenate(self.nodes[first:last])
+            vectors = v[nodes].reshape((last - first, size, -1))
+            products = np.matmul(blocks, vectors)
+            result[nodes] = products.reshape((len(nodes),) + v.shape[1:])
+
+        return result
+
+    def row_statistics(self):
+        """
+        Same as preprocessing.row_statistics, from the blocks alone: a row
+        of a component of s nodes is zero in the other n - s columns.
+        """
+        n = self.shape[1]
+        means = np.zeros(n)
+        squares = np.zeros(n)
+
+        means[self.isolated] = (1 - self.alpha) / n
+        squares[self.isolated] = ((1 - self.alpha - means[self.isolated])**2 +
+                                  (n - 1) * means[self.isolated]**2)
+
+        for first, last, size in self.groups:
+            blocks = np.asarray(self.values[self.offsets[first]:self.offsets[last]],
+                                dtype=float).reshape(last - first, size, size)
+            nodes = np.concatenate(self.nodes[first:last])
+            block_means = blocks.sum(axis=2) / n
+            centered = blocks - block_means[:, :, np.newaxis]
+            means[nodes] = np.ravel(block_means)
+            squares[nodes] = np.ravel((centered * centered).sum(axis=2) +
+                                      (n - size) * block_means**2)
+
+        return [means, np.sqrt(squares)]
+
+
+def components_precompute(m, alpha=0.9, labels=None, precompute_options=None):
+    """
+    ComponentsPrecomputed representation of the precomputed matrix of a
+    normalized matrix m, precomputing each connected component on its own.
+    Components up to DENSE_COMPONENT_SIZE nodes are inverted directly, and
+    larger ones with planner.precompute (precompute_options are passed to
+    it).
+
+    Arguments:
+        m:          sparse matrix (normalized)
+        labels:     preprocessing.component_labels of m (computed if None)
+    """
+    m = sparse.csr_matrix(m, dtype=float)
+    if labels is None:
+        labels = preprocessing.component_labels(m)
+
+    precompute_options = dict(precompute_options or {})
+    precompute_options.pop('filename', None)
+
+    blocks = []
+    for nodes in preprocessing.component_nodes(labels):
+        component = m[nodes][:, nodes]
+        if len(nodes) <= DENSE_COMPONENT_SIZE:
+            block = preprocessing.precompute_dense(component, alpha)
+        else:
+            block = planner.precompute(component, alpha=alpha, **precompute_options)
+        blocks.append(np.ravel(np.asarray(block)))
+
+    values = np.concatenate(blocks) if blocks else np.zeros(0)
+    return ComponentsPrecomputed(labels, values, alpha)
+
+
+def spectral_precompute(m, k=100, alpha=0.9, tol=0):
+    """
+    SpectralPrecomputed representation of the precomputed matrix of a
+    symmetric normalized matrix m, from its k largest eigenpairs.
+
+    Arguments:
+        m:      sparse matrix (normalized, symmetric)
+        k:      number of eigenpairs. All of them (exact) if k >= n - 1.
+        tol:    eigsh tolerance (0 is machine precision)
+    """
+    m = sparse.csr_matrix(m, dtype=float)
+    n = m.shape[0]
+    if n and abs(m - m.T).max() > 1e-10:
+        raise ValueError("Spectral representation needs a symmetric matrix")
+
+    if k >= n - 1:
+        values, vectors = np.linalg.eigh(m.toarray())
+    else:
+        values, vectors = splinalg.eigsh(m, k=k, which='LA', tol=tol)
+
+    return SpectralPrecomputed(vectors, values, m.diagonal().sum(), alpha)
+
+
+def build(m, representation='dense', alpha=0.9, spectral_k=100,
+          push_tol=1e-4, threshold=1e-4, top_per_row=None,
+          representation_file=None, precompute_options=None):
+    """
+    Precomputed matrix of a normalized matrix m in the given representation.
+    'dense' precomputes it with planner.precompute (precompute_options are
+    passed to it), 'spectral' keeps spectral_k eigenpairs and 'push' is a
+    csr matrix computed by preprocessing.push_precompute with tolerance
+    push_tol. 'thresholded' precomputes it as 'dense' and keeps the entries
+    larger than threshold (and among the top_per_row of their row, if
+    given) in a csr matrix, logging how much that changes pearson scores.
+    'float16' and 'uint8' precompute it as 'dense' and quantize it, and
+    'packed' keeps the upper triangle of a symmetric one, computed a block
+    of columns at a time. The quantized and packed values are written to
+    representation_file (a .npy file) if given. 'components' precomputes
+    each connected component on its own, and is always kept in memory.
+    """
+    validate_representation(representation)
+    precompute_options = dict(precompute_options or {})
+
+    if representation == 'spectral':
+        return spectral_precompute(m, spectral_k, alpha)
+
+    if representation == 'push':
+        return preprocessing.push_precompute(
+            m, alpha, push_tol, block_size=precompute_options.get('block_size', 256))
+
+    if representation == 'components':
+        return components_precompute(m, alpha, precompute_options=precompute_options)
+
+    if representation == 'packed':
+        solver = precompute_options.get('strategy', 'iterative')
+        if solver not in solvers.AVAILABLE_SOLVERS:
+            solver = 'iterative'
+        return packed_precompute(m, alpha,
+                                 precompute_options.get('maxiter', 1000),
+                                 precompute_options.get('block_size', 256),
+                                 solver, representation_file)
+
+    precomputed = planner.precompute(m, alpha=alpha, **precompute_options)
+    if representation == 'thresholded':
+        thresholded = preprocessing.sparsify(precomputed, threshold, top_per_row)
+        log.info("Thresholded precomputed matrix keeps {} of {} entries".format(
+            thresholded.nnz, precomputed.shape[0] * precomputed.shape[1]))
+        log.info("Pearson score change on {queries} sampled queries: max {max_score_change:.3g}, "
+                 "mean {mean_score_change:.3g}".format(**pearson_change(precomputed, thresholded)))
+        return thresholded
+
+    if representation in QUANTIZED_TYPES:
+        return quantize(precomputed, representation, representation_file)
+
+    return precomputed
+
+
+def error_report(m, precomputed, alpha=0.9, n_samples=20, seed=0):
+    """
+    Compares a representation with the exact precomputed matrix of the
+    normalized matrix m on a random sample of columns, which are computed
+    exactly by iteration.
+
+    Returns:
+        A dictionary with the number of sampled columns, the largest
+        absolute error, the relative (Frobenius) error of the sample and
+        the lowest Pearson correlation between an exact column and its
+        approximation.
+    """
+    m = sparse.csr_matrix(m, dtype=float)
+    n = m.shape[1]
+    n_samples = min(n_samples, n)
+    sample = np.sort(np.random.RandomState(seed).choice(n, n_samples, replace=False))
+
+    exact = np.zeros((m.shape[0], n_samples))
+    for j, column in enumerate(sample):
+        exact[:, j] = preprocessing.precompute_columns(m, column, column + 1, alpha)[:, 0]
+
+    if isinstance(precomputed, PrecomputedMatrix):
+        approximate = precomputed.columns(sample)
+    elif sparse.issparse(precomputed):
+        approximate = sparse.csc_matrix(precomputed)[:, sample].toarray()
+    else:
+        approximate = np.asarray(precomputed[:, sample], dtype=float)
+
+    errors = approximate - exact
+    correlations = [np.corrcoef(exact[:, j], approximate[:, j])[0, 1]
+                    for j in range(n_samples)]
+
+    return {'columns': n_samples,
+            'max_abs_error': float(abs(errors).max()) if n_samples else 0.0,
+            'relative_error': float(np.linalg.norm(errors) / np.linalg.norm(exact)) if n_samples else 0.0,
+            'min_column_correlation': float(np.nanmin(correlations)) if n_samples else 1.0}
+
+
+def pearson_change(precomputed, approximate, n_samples=20, seed=0):
+    """
+    Change in pearson scores from replacing a precomputed matrix by an
+    approximation of it. The queries are a random sample of single nodes,
+    propagated with the exact matrix (their precomputed columns), and
+    scored against the rows of both matrices.
+
+    Returns:
+        A dictionary with the number of sampled queries and the largest
+        and mean absolute change of their scores.
+    """
+    n = precomputed.shape[1]
+    n_samples = min(n_samples, n)
+    if not n_samples:
+        return {'queries': 0, 'max_score_change': 0.0, 'mean_score_change': 0.0}
+
+    sample = np.sort(np.random.RandomState(seed).choice(n, n_samples, replace=False))
+    if isinstance(precomputed, PrecomputedMatrix):
+        vectors = precomputed.columns(sample)
+    elif sparse.issparse(precomputed):
+        vectors = sparse.csc_matrix(precomputed)[:, sample].toarray()
+    else:
+        vectors = np.asarray(precomputed[:, sample], dtype=float)
+
+    changes = abs(_pearson_rows(precomputed, vectors) -
+                  _pearson_rows(approximate, vectors))
+    changes = changes[~np.isnan(changes)]
+
+    return {'queries': n_samples,
+            'max_score_change': float(changes.max()) if len(changes) else 0.0,
+            'mean_score_change': float(changes.mean()) if len(changes) else 0.0}
+
+
+def _pearson_rows(m, vectors):
+    """
+    Pearson correlation of each row of m with each column of vectors.
+    """
+    if isinstance(m, PrecomputedMatrix):
+        means = np.zeros(m.shape[0])
+        norms = np.zeros(m.shape[0])
+        for start, stop in preprocessing.column_blocks(m.shape[0], 1024):
+            [means[start:stop], norms[start:stop]] = preprocessing.row_statistics(m.rows(start, stop))
+        products = m.dot(vectors)
+    else:
+        [means, norms] = preprocessing.row_statistics(m)
+        products = np.asarray(m.dot(vectors))
+
+    centered = vectors - vectors.mean(axis=0)
+    vector_norms = np.sqrt((centered * centered).sum(axis=0))
+    numerators = products - np.outer(means, vectors.sum(axis=0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return numerators / np.outer(norms, vector_norms)
+
+
+def save(mdict, name, precomputed, path='.'):
+    """
+    Adds the entries of a precomputed representation of network name to a
+    .mat dictionary. Dense (and sparse) matrices are left to the caller.
+
+    Quantized or packed values memory mapped from a .npy file are
+    referenced by its path relative to path (the directory of the .mat
+    file). float16 values saved in the .mat file are stored as their uint16
+    bits, as .mat files have no half precision type.
+
+    Returns:
+        True if precomputed is a representation and was added.
+    """
+    if isinstance(precomputed, SpectralPrecomputed):
+        mdict["{}_spectral_vectors".format(name)] = precomputed.vectors
+        mdict["{}_spectral_values".format(name)] = precomputed.values
+        mdict["{}_spectral_trace".format(name)] = precomputed.trace
+        return True
+
+    if isinstance(precomputed, QuantizedPrecomputed):
+        _save_values(mdict, "{}_quantized".format(name), precomputed.values, path)
+        mdict["{}_quantized_type".format(name)] = precomputed.values.dtype.name
+        mdict["{}_quantized_scale".format(name)] = precomputed.scale
+        mdict["{}_quantized_offset".format(name)] = precomputed.offset
+        return True
+
+    if isinstance(precomputed, PackedPrecomputed):
+        _save_values(mdict, "{}_packed".format(name), precomputed.values, path)
+        return True
+
+    if isinstance(precomputed, ComponentsPrecomputed):
+        _save_values(mdict, "{}_components".format(name), precomputed.values, path)
+        mdict["{}_component_labels".format(name)] = precomputed.labels
+        return True
+
+    return False
+
+
+def _save_values(mdict, key, values, path):
+    filename = getattr(values, 'filename', None)
+    if isinstance(values, np.memmap) and filename and filename.endswith('.npy'):
+        mdict["{}_file".format(key)] = os.path.relpath(filename, path)
+    elif values.dtype == np.float16:
+        mdict[key] = np.asarray(values).view(np.uint16)
+    else:
+        mdict[key] = np.asarray(values)
+
+
+def _load_values(data, key, data_path, dtype=None):
+    file_key = "{}_file".format(key)
+    if file_key in data:
+        filename = str(np.ravel(data[file_key])[0]).strip()
+        return np.load(os.path.join(data_path, filename), mmap_mode='r')
+
+    values = np.ascontiguousarray(data[key])
+    if dtype == 'float16':
+        values = values.view(np.float16)
+    return values
+
+
+def load(data, name, alpha=0.9, data_path='.'):
+    """
+    Precomputed representation of network name saved in a .mat dictionary
+    with save, or None if there is none. .npy files are looked for relative
+    to data_path.
+    """
+    if "{}_spectral_vectors".format(name) in data:
+        return SpectralPrecomputed(data["{}_spectral_vectors".format(name)],
+                                   data["{}_spectral_values".format(name)],
+                                   np.ravel(data["{}_spectral_trace".format(name)])[0],
+                                   alpha)
+
+    if "{}_quantized_type".format(name) in data:
+        dtype = str(np.ravel(data["{}_quantized_type".format(name)])[0]).strip()
+        values = _load_values(data, "{}_quantized".format(name), data_path, dtype)
+        return QuantizedPrecomputed(values,
+                                    data["{}_quantized_scale".format(name)],
+                                    data["{}_quantized_offset".format(name)])
+
+    key = "{}_packed".format(name)
+    if key in data or "{}_file".format(key) in data:
+        return PackedPrecomputed(np.ravel(_load_values(data, key, data_path)))
+
+    if "{}_component_labels".format(name) in data:
+        values = _load_values(data, "{}_components".format(name), data_path)
+        return ComponentsPrecomputed(data["{}_component_labels".format(name)],
+                                     np.ravel(values), alpha)
+
+    return None
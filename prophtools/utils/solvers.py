@@ -0,0 +1,492 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+"""
+.. module:: solvers.py
+.. moduleauthor:: Carmen Navarro Luzon
+
+Solvers for the random walk with restart system. Propagating a query F0 on
+a normalized matrix W with restart probability alpha means solving
+
+    (I - alpha * W) F = (1 - alpha) * F0
+
+which RWR and LG do by fixed point iteration ('power', see
+power_iteration, or refined_iteration in mixed precision) or, through
+krylov_solve, by conjugate gradient ('cg', for symmetric W, where
+I - alpha * W is symmetric positive definite) or BiCGSTAB ('bicgstab', for
+any W), optionally preconditioned (see build_preconditioner).
+
+series_iteration propagates a query for several alphas at once.
+"""
+
+import logging
+
+import scipy.sparse as sparse
+import scipy.sparse.linalg as splinalg
+import numpy as np
+
+# Sparse by dense block product into a given output, which the sparse
+# matrix classes do not expose. These are private scipy functions, so
+# csr_product falls back to m.dot when they are missing.
+try:
+    from scipy.sparse._sparsetools import csr_matvec, csr_matvecs
+except ImportError:
+    csr_matvec = csr_matvecs = None
+
+
+AVAILABLE_SOLVERS = ['iterative', 'factorized']
+
+# Only worth it for whole precomputed matrices of small networks
+PRECOMPUTE_SOLVERS = AVAILABLE_SOLVERS + ['dense']
+
+# Solve one query at a time, so they are only used for propagation
+KRYLOV_METHODS = ['cg', 'bicgstab']
+PROPAGATION_SOLVERS = AVAILABLE_SOLVERS + KRYLOV_METHODS
+
+ITERATIVE_METHODS = ['power'] + KRYLOV_METHODS
+PRECONDITIONERS = ['none', 'jacobi', 'ilu']
+
+# How power_iteration measures the change of a query in an iteration
+NORMS = {'sum': np.add.reduce, 'max': np.maximum.reduce}
+
+# 'mixed' iterates in single precision, see refined_iteration
+PRECISIONS = ['double', 'mixed']
+
+# Each single precision solve of refined_iteration reduces the residual by
+# this factor, well above the relative precision of float32 (~6e-8).
+REFINEMENT_REDUCTION = 1e-4
+MAX_REFINEMENTS = 20
+
+log = logging.getLogger(__name__)
+
+
+def validate_solver(solver, available=AVAILABLE_SOLVERS):
+    if solver not in available:
+        msg = "Unknown solver: {}. Available solvers: {}".format(
+            solver, ', '.join(available))
+        raise ValueError(msg)
+
+
+def validate_method(method):
+    validate_solver(method, ITERATIVE_METHODS)
+
+
+def validate_precision(precision, method='power'):
+    validate_solver(precision, PRECISIONS)
+    if precision == 'mixed' and method != 'power':
+        raise ValueError("Mixed precision is only available for power iteration")
+
+
+def validate_preconditioner(kind, method=None):
+    if kind not in PRECONDITIONERS:
+        msg = "Unknown preconditioner: {}. Available: {}".format(
+            kind, ', '.join(PRECONDITIONERS))
+        raise ValueError(msg)
+
+    if kind == 'ilu' and method == 'cg':
+        raise ValueError("The ilu preconditioner is not symmetric, use it with bicgstab")
+
+
+def system_matrix(m, alpha):
+    """
+    I - alpha * m, as a csr matrix.
+    """
+    return sparse.identity(m.shape[0], format='csr') - alpha * sparse.csr_matrix(m, dtype=float)
+
+
+def build_preconditioner(m, alpha, kind='jacobi'):
+    """
+    Preconditioner of I - alpha * m for krylov_solve.
+
+    'jacobi' scales by the inverse of the diagonal, which only differs from
+    the identity on networks with self loops. 'ilu' is an incomplete LU
+    factorization (scipy.sparse.linalg.spilu) with no more nonzeros than
+    the matrix, cheap to build and store (larger ones of networks with
+    random-like structure fill in almost as much as the full
+    factorization). It is not symmetric, even for symmetric networks, so
+    it is only used with 'bicgstab': 'cg' does not converge with it.
+
+    Returns:
+        A scipy.sparse.linalg.LinearOperator, or None for 'none'.
+    """
+    validate_preconditioner(kind)
+    if kind == 'none':
+        return None
+
+    n = m.shape[0]
+    system = system_matrix(m, alpha)
+    if kind == 'jacobi':
+        inverse_diagonal = 1.0 / system.diagonal()
+        return splinalg.LinearOperator(
+            (n, n), matvec=lambda x: inverse_diagonal * np.ravel(x), dtype=float)
+
+    incomplete = splinalg.spilu(sparse.csc_matrix(system), drop_tol=0.1,
+                                fill_factor=1)
+    return splinalg.LinearOperator((n, n), matvec=incomplete.solve, dtype=float)
+
+
+def csr_product(m, x, out):
+    """
+    Writes m * x into out, for a csr matrix m and C ordered n x k arrays x
+    and out of its dtype. The product is not allocated, except when the
+    private scipy functions used for it cannot be imported.
+    """
+    if csr_matvecs is None:
+        out[:, :] = m.dot(x)
+        return
+
+    [n_rows, n_columns] = m.shape
+    out.fill(0.0)
+    if x.shape[1] == 1:
+        csr_matvec(n_rows, n_columns, m.indptr, m.indices, m.data,
+                   x.ravel(), out.ravel())
+    else:
+        csr_matvecs(n_rows, n_columns, x.shape[1], m.indptr, m.indices,
+                    m.data, x.ravel(), out.ravel())
+
+
+def power_iteration(m, F, alpha=0.9, maxiter=1000, tol=1e-9, norm='sum', x0=None,
+                    dtype=float, stop=None):
+    """
+    Propagates F (a vector or a n x k block of queries) by fixed point
+    iteration, F <- alpha * m * F + (1 - alpha) * F0, until every query
+    changes by less than tol in an iteration.
+
+    Iterations allocate nothing: the product is written into a
+    preallocated buffer (which then swaps places with the current
+    iterate) and the change is computed into a third one, so a block of
+    queries holds three n x k arrays however many iterations it takes. A
+    query stops as soon as it converges: its result is stored, and the
+    buffers are only reallocated, smaller, when some query has converged.
+
+    Arguments:
+        m:          sparse matrix (normalized)
+        F:          queries
+        alpha:      restart probability
+        tol:        change at which a query has converged (one for all,
+                    or one per query)
+        norm:       'sum' (of absolute changes, as RWR) or 'max' (as LG)
+        x0:         initial guess of the result (warm start), same shape
+                    as F
+        dtype:      floating point type of the matrix and the iteration
+        stop:       optional function called after every iteration with
+                    the indices of the queries still iterating, their
+                    iterates and the absolute change of each entry in the
+                    iteration (n x len(indices) arrays, not to be kept).
+                    It returns which of them should stop, besides those
+                    that have converged (see method.top_k_RWR).
+
+    Returns:
+        [result, iterations, residuals]: the propagated queries, with the
+        shape of F, and for each query the iterations it took to converge
+        (maxiter if it did not) and its change in the last iteration.
+    """
+    m = sparse.csr_matrix(m, dtype=dtype)
+    reduce_change = NORMS[norm]
+
+    queries = np.asarray(F, dtype=dtype)
+    restart = np.array(queries.reshape(queries.shape[0], -1), order='C')
+    if x0 is None:
+        current = restart.copy()
+    else:
+        current = np.array(np.asarray(x0, dtype=dtype).reshape(restart.shape), order='C')
+    restart *= 1 - alpha
+
+    result = current.copy()
+    iterations = np.zeros(restart.shape[1], dtype=int)
+    residuals = np.zeros(restart.shape[1])
+    tolerances = np.zeros(restart.shape[1])
+    tolerances[:] = tol
+
+    active = np.arange(restart.shape[1])
+    following = np.empty_like(current)
+    change = np.empty_like(current)
+    change_norms = np.empty(len(active), dtype=dtype)
+    for iteration in range(1, maxiter + 1):
+        csr_product(m, current, following)
+        following *= alpha
+        following += restart
+
+        np.subtract(following, current, out=change)
+        np.abs(change, out=change)
+        reduce_change(change, axis=0, out=change_norms)
+        [current, following] = [following, current]
+
+        converged = change_norms < tolerances
+        if stop is not None:
+            converged |= stop(active, current, change)
+        if iteration == maxiter:
+            converged[:] = True
+        if not converged.any():
+            continue
+
+        done = active[converged]
+        result[:, done] = current[:, converged]
+        iterations[done] = iteration
+        residuals[done] = change_norms[converged]
+
+        pending = ~converged
+        active = active[pending]
+        if len(active) == 0:
+            break
+
+        tolerances = tolerances[pending]
+        current = np.ascontiguousarray(current[:, pending])
+        restart = np.ascontiguousarray(restart[:, pending])
+        following = np.empty_like(current)
+        change = np.empty_like(current)
+        change_norms = np.empty(len(active), dtype=dtype)
+
+    return [result.reshape(queries.shape), iterations, residuals]
+
+
+def refined_iteration(m, F, alpha=0.9, maxiter=1000, tol=1e-9, norm='sum', x0=None):
+    """
+    power_iteration in mixed precision: the iterations run on a single
+    precision copy of m, which halves the memory they read, and their
+    result is corrected in double precision (iterative refinement).
+
+    Each step computes the residual of the current result in double
+    precision, r = (1 - alpha) * F0 - (I - alpha * m) * F, and solves
+    (I - alpha * m) * D = r for the correction D by power_iteration in
+    single precision, until r has been reduced by REFINEMENT_REDUCTION.
+    The residual is the change the next double precision iteration would
+    make, so queries stop on the same criterion (and tol) as
+    power_iteration; results agree with it within about tol / (1 - alpha).
+
+    Returns:
+        [result, iterations, residuals] as power_iteration, where
+        iterations counts the single precision ones and residuals are the
+        final double precision ones.
+    """
+    m = sparse.csr_matrix(m, dtype=float)
+    single = m.astype(np.float32)
+    reduce_change = NORMS[norm]
+
+    queries = np.asarray(F, dtype=float)
+    restart = (1 - alpha) * queries.reshape(queries.shape[0], -1)
+    if x0 is None:
+        result = np.zeros(restart.shape)
+    else:
+        result = np.array(np.asarray(x0, dtype=float).reshape(restart.shape))
+
+    iterations = np.zeros(restart.shape[1], dtype=int)
+    residuals = np.zeros(restart.shape[1])
+    active = np.arange(restart.shape[1])
+    for step in range(MAX_REFINEMENTS + 1):
+        current = result[:, active]
+        residual = alpha * (m * current) + restart[:, active] - current
+        residual_norms = reduce_change(np.abs(residual), axis=0)
+        residuals[active] = residual_norms
+
+        pending = residual_norms >= tol
+        active = active[pending]
+        if len(active) == 0 or step == MAX_REFINEMENTS:
+            break
+
+        [correction, steps, _] = power_iteration(
+            single, residual[:, pending] / (1 - alpha), alpha, maxiter,
+            tol=np.maximum(REFINEMENT_REDUCTION * residual_norms[pending], tol / 2),
+            norm=norm,
+            dtype=np.float32)
+        result[:, active] += correction
+        iterations[active] += steps
+
+    return [result.reshape(queries.shape), iterations, residuals]
+
+
+def validate_alphas(alphas):
+    alphas = np.asarray(alphas, dtype=float).ravel()
+    if len(alphas) == 0 or (alphas < 0).any() or (alphas >= 1).any():
+        raise ValueError("Restart probabilities must be in [0, 1): {}".format(alphas))
+    return alphas
+
+
+def series_iteration(m, F, alphas, maxiter=1000, tol=1e-9, norm='sum'):
+    """
+    Propagates F (a vector or a n x k block of queries) for every restart
+    probability in alphas with the same sparse products. The k-th fixed
+    point iterate of power_iteration for alpha is
+
+        (1 - alpha) * sum_{i < k} alpha**i * m**i * F0 + alpha**k * m**k * F0
+
+    and the vectors m**i * F0 (a Krylov basis) do not depend on alpha, so
+    each iteration computes the next one once (in place, as
+    power_iteration) and adds the previous one, scaled, to the partial sum
+    of every alpha. The change of the iterate in that iteration is
+    alpha**k * |m**k * F0 - m**(k-1) * F0|, so a query converges for each
+    alpha on the same iteration (and tol) as power_iteration, which gives
+    the same results, and stops iterating when it has converged for every
+    alpha: a sweep costs the products of a single propagation with the
+    largest alpha, plus a scaled sum per alpha and iteration.
+
+    Arguments:
+        m:          sparse matrix (normalized)
+        F:          queries
+        alphas:     restart probabilities, in [0, 1)
+        tol:        change at which a query has converged
+        norm:       'sum' (of absolute changes, as RWR) or 'max' (as LG)
+
+    Returns:
+        [result, iterations, residuals]: the propagated queries, stacked
+        in an array of shape (len(alphas),) + F.shape, and for each alpha
+        and query (len(alphas) x k arrays) the iterations it took to
+        converge (maxiter if it did not) and its change in the last one.
+    """
+    alphas = validate_alphas(alphas)
+    m = sparse.csr_matrix(m, dtype=float)
+    reduce_change = NORMS[norm]
+
+    queries = np.asarray(F, dtype=float)
+    current = np.array(queries.reshape(queries.shape[0], -1), order='C')
+    n_queries = current.shape[1]
+
+    powers = np.ones(len(alphas))
+    partial = np.zeros((len(alphas),) + current.shape)
+    result = np.empty_like(partial)
+    iterations = np.zeros((len(alphas), n_queries), dtype=int)
+    residuals = np.zeros((len(alphas), n_queries))
+    running = np.ones((len(alphas), n_queries), dtype=bool)
+
+    active = np.arange(n_queries)
+    following = np.empty_like(current)
+    term = np.empty_like(current)
+    change_norms = np.empty(n_queries)
+    for iteration in range(1, maxiter + 1):
+        csr_product(m, current, following)
+        [current, previous] = [following, current]
+
+        np.subtract(current, previous, out=term)
+        np.abs(term, out=term)
+        reduce_change(term, axis=0, out=change_norms)
+        for i in np.flatnonzero(running.any(axis=1)):
+            np.multiply(previous, (1 - alphas[i]) * powers[i], out=term)
+            partial[i] += term
+        powers *= alphas
+
+        changes = powers[:, np.newaxis] * change_norms
+        converged = running & (changes < tol)
+        if iteration == maxiter:
+            converged = running.copy()
+        following = previous
+        if not converged.any():
+            continue
+
+        for i in np.flatnonzero(converged.any(axis=1)):
+            done = converged[i]
+            result[i][:, active[done]] = partial[i][:, done] + powers[i] * current[:, done]
+            iterations[i, active[done]] = iteration
+            residuals[i, active[done]] = changes[i, done]
+        running &= ~converged
+
+        pending = running.any(axis=0)
+        if pending.all():
+            continue
+
+        active = active[pending]
+        if len(active) == 0:
+            break
+
+        current = np.ascontiguousarray(current[:, pending])
+        partial = np.ascontiguousarray(partial[:, :, pending])
+        running = running[:, pending]
+        following = np.empty_like(current)
+        term = np.empty_like(current)
+        change_norms = np.empty(len(active))
+
+    return [result.reshape((len(alphas),) + queries.shape), iterations, residuals]
+
+
+def iterative_solve(m, F, alpha, method, preconditioner='none', x0=None,
+                    tol=1e-9, maxiter=1000):
+    """
+    krylov_solve for RWR and LG: preconditioner is either one of
+    PRECONDITIONERS, built for this call, or an operator already built by
+    build_preconditioner (to reuse it across calls).
+    """
+    M = preconditioner
+    if preconditioner is None or isinstance(preconditioner, str):
+        kind = preconditioner or 'none'
+        validate_preconditioner(kind, method)
+        M = build_preconditioner(m, alpha, kind)
+
+    return krylov_solve(m, F, alpha, method, M, x0, tol, maxiter)
+
+
+def krylov_solve(m, F, alpha, method='cg', M=None, x0=None, tol=1e-9, maxiter=1000):
+    """
+    Propagates F (a vector or a n x k block of queries, solved one column
+    at a time) by a Krylov method on I - alpha * m.
+
+    Arguments:
+        m:          sparse matrix (normalized)
+        F:          queries
+        alpha:      restart probability
+        method:     'cg' (m must be symmetric) or 'bicgstab'
+        M:          preconditioner (see build_preconditioner), None for none
+        x0:         initial guess of the result, such as the propagation of
+                    a similar query or of the same one for a close alpha
+                    (warm start). Same shape as F.
+        tol:        relative residual at which each column stops
+
+    Returns:
+        [result, iterations, residuals]: the propagated queries, with the
+        shape of F, and for each query the iterations it took and its final
+        relative residual.
+    """
+    validate_solver(method, KRYLOV_METHODS)
+    solve = splinalg.cg if method == 'cg' else splinalg.bicgstab
+    system = system_matrix(m, alpha)
+
+    F = np.asarray(F, dtype=float)
+    columns = F.reshape(F.shape[0], -1)
+    guesses = None
+    if x0 is not None:
+        guesses = np.asarray(x0, dtype=float).reshape(columns.shape)
+
+    result = np.zeros(columns.shape)
+    iterations = np.zeros(columns.shape[1], dtype=int)
+    residuals = np.zeros(columns.shape[1])
+    for j in range(columns.shape[1]):
+        guess = None if guesses is None else guesses[:, j]
+        b = (1 - alpha) * columns[:, j]
+        count = [0]
+
+        def callback(x):
+            count[0] += 1
+
+        [x, info] = solve(system, b, x0=guess, tol=tol, atol=0.0,
+                          maxiter=maxiter, M=M, callback=callback)
+        if info != 0:
+            log.warning("{} did not converge on query {} (info {})".format(
+                method, j, info))
+        result[:, j] = x
+        iterations[j] = count[0]
+        b_norm = np.linalg.norm(b)
+        if b_norm > 0:
+            residuals[j] = np.linalg.norm(b - system.dot(x)) / b_norm
+
+    return [result.reshape(F.shape), iterations, residuals]
+
+
+def factorize(m, alpha):
+    """
+    Sparse LU factorization of I - alpha * m. Once computed, each query
+    (or precomputed column) costs a pair of triangular solves.
+
+    Arguments:
+        m:      sparse matrix (normalized)
+        alpha:  restart probability
+
+    Returns:
+        A scipy.sparse.linalg.SuperLU object.
+    """
+    return splinalg.splu(sparse.csc_matrix(system_matrix(m, alpha)))
+
+
+def factorized_solve(factorization, F, alpha):
+    """
+    Propagates F (a vector or a n x k block of queries) using a
+    factorization computed by factorize for the same alpha.
+    """
+    return (1 - alpha) * factorization.solve(np.asarray(F, dtype=float))